@@ -24,7 +24,7 @@ async def main() -> None:
     # users to be generated. Prioritizing the generation of
     # this list to speed up the starting time of the services.
     with importlib.import_module("bypasshub.managers").Users() as users:
-        users.generate_list()
+        users.generate_list(passwd=True)
 
     await importlib.import_module("bypasshub.app").run()
 
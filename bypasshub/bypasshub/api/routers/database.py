@@ -5,9 +5,17 @@ from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 
 from ..dependencies import get_manager
 from ...managers import Manager
-from ...database import Database
+from ...backup import Backup
+from ...database import Database, database_shards
+from ...replica import Replica
 from ...errors import SynchronizationError
-from ...types import DatabaseSchema, HTTPSerializedError
+from ...types import (
+    BackupInfo,
+    DatabaseSchema,
+    HTTPSerializedError,
+    Reconciliation,
+    ReplicaStatus,
+)
 
 router = APIRouter(prefix="/database")
 
@@ -36,6 +44,35 @@ async def sync(manager: Annotated[Manager, Depends(get_manager)]) -> bool:
     return await manager.sync()
 
 
+@router.get(
+    "/reconcile",
+    tags=["database"],
+    summary=(
+        "Reflects the differences between the users that actually"
+        " exist on the services and the database to the services"
+    ),
+    response_description="The differences and timings for each service",
+    responses={
+        HTTP_500_INTERNAL_SERVER_ERROR: {
+            "model": HTTPSerializedError,
+            "content": {
+                "application/json": {
+                    "examples": {
+                        "failed to reconcile services with database": {
+                            "value": {"details": [SynchronizationError().serialize()]},
+                        },
+                    }
+                }
+            },
+        }
+    },
+)
+async def reconcile(
+    manager: Annotated[Manager, Depends(get_manager)],
+) -> Reconciliation:
+    return await manager.reconcile()
+
+
 @router.get("/dump", tags=["database"], summary="Dumps the database")
 def dump() -> DatabaseSchema:
     return Database.dump()
@@ -58,3 +95,31 @@ def backup(
     ] = None
 ) -> "None":
     Database.backup(suffix and f".{suffix}")
+
+
+@router.get(
+    "/backups",
+    tags=["database"],
+    summary="Returns the auto backups of the database",
+)
+def backups() -> list[BackupInfo]:
+    return [
+        backup for shard in range(database_shards) for backup in Backup(shard).list()
+    ]
+
+
+@router.get(
+    "/replica",
+    tags=["database"],
+    summary="Returns the replication status of the database replica of each shard",
+)
+def replica() -> list[ReplicaStatus]:
+    statuses = []
+    for shard in range(database_shards):
+        replica = Replica(shard=shard)
+        try:
+            statuses.append(replica.status())
+        finally:
+            replica.close()
+
+    return statuses
@@ -30,6 +30,20 @@ async def active_capacity(manager: Annotated[Manager, Depends(get_manager)]) ->
     return manager.active_capacity
 
 
+@router.get(
+    "/pending-operations",
+    tags=["info"],
+    summary=(
+        "The count of the operations that are waiting"
+        " to be reflected to each service"
+    ),
+)
+async def pending_operations(
+    manager: Annotated[Manager, Depends(get_manager)],
+) -> dict[str, int]:
+    return manager.pending_operations
+
+
 @router.get(
     "/credentials",
     tags=["info"],
@@ -6,8 +6,11 @@ from . import __version__
 from .utils import Process
 from .managers import State
 from .cleanup import Cleanup
-from .monitor import Monitor
-from .database import Database
+from .config import config
+from .monitor import Monitor, MonitorPool
+from .backup import Backup
+from .replica import Replica
+from .database import database_shards
 from .api.app import run as api
 
 logger = logging.getLogger(__name__)
@@ -24,10 +27,20 @@ async def run() -> None:
     state = State()
     cleanup.add(state.close)
     state.run()
-    monitor = Monitor()
+    monitor = MonitorPool() if config["main"]["monitor_workers"] > 1 else Monitor()
     cleanup.add(monitor.stop)
-    if Database.BACKUP_ENABLED:
-        cleanup.add(Database.stop_backup)
-        await asyncio.wait([monitor.start(), Database.start_backup()])
+    tasks = [monitor.start()]
+    for shard in range(database_shards):
+        if Backup.ENABLED:
+            backup = Backup(shard)
+            cleanup.add(backup.stop)
+            tasks.append(backup.start())
+        if Replica.ENABLED:
+            replica = Replica(shard=shard)
+            cleanup.add(replica.stop)
+            tasks.append(replica.start())
+
+    if len(tasks) > 1:
+        await asyncio.wait(tasks)
     else:
-        await monitor.start()
+        await tasks[0]
@@ -0,0 +1,438 @@
+import os
+import zlib
+import asyncio
+import logging
+import sqlite3
+from pathlib import Path
+from hashlib import blake2b
+from typing import Any, NamedTuple
+from datetime import datetime, timedelta, timezone
+
+import orjson
+
+from . import errors
+from .config import config
+from .types import BackupInfo
+from .utils import current_time, convert_size, get_instance_path
+from .database import Database, backup_dir, database_path, cluster_node
+
+VERSION = 1
+HASH_SIZE = 8
+BASE_EXTENSION = "base"
+INCREMENT_EXTENSION = "incr"
+
+backup_interval = config["database"]["backup_interval"]
+backup_base_steps = config["database"]["backup_base_steps"]
+backup_retention = config["database"]["backup_retention"]
+logger = logging.getLogger(__name__)
+
+
+class _Backup(NamedTuple):
+    date: datetime
+    path: Path
+    base: bool
+
+
+class Backup:
+    """The incremental backups of the database.
+
+    Each backup only stores the pages of the database that are changed
+    since the previous backup and a full backup (the base) is stored
+    periodically. The pages are compressed and their hashes are stored
+    in the header line of the backup file, so the next backup is compared
+    against the latest one without reading the stored pages. A backup is
+    restored by applying the pages of its base and the following backups
+    in order and is verified against the stored hashes.
+
+    The backups are stored in the `backup` directory beside the database
+    as `%name%.%timestamp%.base` and `%name%.%timestamp%.incr` files.
+    Each shard of the database is backed up separately.
+
+    Attributes:
+        `shard`:
+            The shard of the database that is backed up.
+        `base_steps`:
+            The count of the backups from a base to the next one.
+            The default value is equal to `backup_base_steps`
+            property of the configuration file.
+        `retention`:
+            The time in seconds that the backups are kept.
+            The default value is equal to `backup_retention`
+            property of the configuration file.
+        `ENABLED`:
+            Whether the auto backup is enabled.
+    """
+
+    ENABLED = backup_interval > 0
+
+    def __init__(
+        self,
+        shard: int = 0,
+        base_steps: int = backup_base_steps,
+        retention: int = backup_retention,
+    ) -> None:
+        self.shard = shard
+        self.path = get_instance_path(database_path, shard)
+        self.base_steps = max(base_steps, 1)
+        self.retention = retention
+        self._task = None
+        self._verified: tuple[Path, str, int] | None = None
+
+    def _list(self) -> list[_Backup]:
+        backups = []
+        if not backup_dir.exists():
+            return backups
+
+        for path in backup_dir.glob(f"{self.path.name}.*"):
+            timestamp, _, extension = path.name.removeprefix(
+                f"{self.path.name}."
+            ).partition(".")
+            if extension not in (BASE_EXTENSION, INCREMENT_EXTENSION):
+                continue
+            try:
+                date = datetime.strptime(timestamp, r"%Y%m%d%H%M%S").replace(
+                    tzinfo=timezone.utc
+                )
+            except ValueError:
+                continue
+            backups.append(_Backup(date, path, extension == BASE_EXTENSION))
+
+        return sorted(backups)
+
+    def _read_header(self, path: Path) -> dict[str, Any]:
+        """
+        Raises:
+            ``errors.BackupNotAvailableError``:
+                When the backup does not exist or is corrupted.
+        """
+        try:
+            with open(path, "rb") as file:
+                header = orjson.loads(file.readline())
+        except (OSError, orjson.JSONDecodeError) as error:
+            logger.warning(f"Failed to read the '{path.name}' backup due to {error!r}")
+            raise errors.BackupNotAvailableError()
+
+        if header.get("version") != VERSION:
+            logger.warning(f"Ignoring the '{path.name}' backup of another version")
+            raise errors.BackupNotAvailableError()
+
+        return header
+
+    def _read_pages(self, path: Path) -> bytes:
+        """
+        Raises:
+            ``errors.BackupNotAvailableError``:
+                When the backup is corrupted.
+        """
+        try:
+            with open(path, "rb") as file:
+                file.readline()
+                return zlib.decompress(file.read())
+        except (OSError, zlib.error) as error:
+            logger.warning(f"Failed to read the '{path.name}' backup due to {error!r}")
+            raise errors.BackupNotAvailableError()
+
+    def _get_chain(self, path: Path) -> list[tuple[Path, dict[str, Any]]]:
+        """
+        Returns the backup and the previous ones
+        that it depends on in reverse order.
+
+        Raises:
+            ``errors.BackupNotAvailableError``:
+                When any of the backups does not exist or is corrupted.
+        """
+        chain = []
+        names = set()
+        while path:
+            if path.name in names:
+                raise errors.BackupNotAvailableError()
+            names.add(path.name)
+            chain.append((path, header := self._read_header(path)))
+            path = backup_dir.joinpath(parent) if (parent := header["parent"]) else None
+
+        return chain
+
+    def list(self) -> list[BackupInfo]:
+        """Returns the stored backups in chronological order."""
+        return [
+            {
+                "name": backup.path.name,
+                "date": backup.date,
+                "base": backup.base,
+                "size": backup.path.stat().st_size,
+            }
+            for backup in self._list()
+        ]
+
+    def create(self) -> Path:
+        """
+        Stores the pages of the database that are changed since
+        the latest backup or all the pages when a base is due.
+
+        Returns:
+            The location of the backup file. It's the latest backup
+            when it's already created within the current second.
+        """
+        date = current_time()
+        if (backups := self._list()) and backups[-1].date >= date:
+            return backups[-1].path
+
+        database = Database(self.shard)
+        try:
+            page_size = database.execute("PRAGMA page_size").fetchone()["page_size"]
+            database.commit()
+            # The serialization is performed within a read transaction
+            # and includes the committed changes that are in the WAL file
+            image = memoryview(database.serialize())
+        finally:
+            database.close()
+
+        page_count = len(image) // page_size
+        hashes = b"".join(
+            blake2b(image[offset : offset + page_size], digest_size=HASH_SIZE).digest()
+            for offset in range(0, len(image), page_size)
+        )
+
+        parent = None
+        steps = 0
+        pages = range(page_count)
+        if backups:
+            latest = backups[-1].path
+            try:
+                header = self._read_header(latest)
+            except errors.BackupNotAvailableError:
+                header = None
+            if (
+                header
+                and header["steps"] + 1 < self.base_steps
+                and header["page_size"] == page_size
+            ):
+                parent = latest.name
+                steps = header["steps"] + 1
+                parent_hashes = bytes.fromhex(header["hashes"])
+                pages = [
+                    index
+                    for index in pages
+                    if hashes[(offset := index * HASH_SIZE) : offset + HASH_SIZE]
+                    != parent_hashes[offset : offset + HASH_SIZE]
+                ]
+
+        extension = INCREMENT_EXTENSION if parent else BASE_EXTENSION
+        name = f"{self.path.name}{date.strftime(r'.%Y%m%d%H%M%S')}.{extension}"
+        path = backup_dir.joinpath(name)
+        if not backup_dir.exists():
+            backup_dir.mkdir(parents=True, exist_ok=True)
+
+        temp_path = path.with_name(f".{name}.tmp")
+        compressor = zlib.compressobj()
+        with open(temp_path, "wb") as file:
+            file.write(
+                orjson.dumps(
+                    {
+                        "version": VERSION,
+                        "parent": parent,
+                        "steps": steps,
+                        "page_size": page_size,
+                        "page_count": page_count,
+                        "pages": list(pages),
+                        "hashes": hashes.hex(),
+                    }
+                )
+                + b"\n"
+            )
+            for index in pages:
+                file.write(
+                    compressor.compress(
+                        image[(offset := index * page_size) : offset + page_size]
+                    )
+                )
+            file.write(compressor.flush())
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, path)
+        logger.debug(
+            f"The database backup file '{name}' is created"
+            f" ('{len(pages)}' of '{page_count}' pages,"
+            f" '{convert_size(path.stat().st_size)}')"
+        )
+        return path
+
+    def verify(self, date: datetime | None = None) -> str:
+        """
+        Builds the database from the latest backup that is created at or
+        before the passed date and verifies it beside the database, so
+        the database can be replaced with it by calling ``self.replace()``.
+
+        Args:
+            `date`:
+                The point in time to restore the database to.
+                If omitted, the latest backup will be verified.
+
+        Returns:
+            The name of the verified backup.
+
+        Raises:
+            ``errors.BackupNotAvailableError``:
+                When there is no such backup or any
+                of the required backups is corrupted.
+        """
+        self.discard()
+        if not (
+            backups := [
+                backup for backup in self._list() if date is None or backup.date <= date
+            ]
+        ):
+            raise errors.BackupNotAvailableError()
+
+        chain = self._get_chain(backups[-1].path)
+        image = bytearray()
+        for path, header in reversed(chain):
+            page_size = header["page_size"]
+            if len(image) > (size := header["page_count"] * page_size):
+                del image[size:]
+            else:
+                image.extend(bytes(size - len(image)))
+
+            data = self._read_pages(path)
+            for position, index in enumerate(header["pages"]):
+                offset = position * page_size
+                image[index * page_size : (index + 1) * page_size] = data[
+                    offset : offset + page_size
+                ]
+
+        path, header = chain[0]
+        if (
+            b"".join(
+                blake2b(
+                    image[offset : offset + page_size], digest_size=HASH_SIZE
+                ).digest()
+                for offset in range(0, len(image), page_size)
+            ).hex()
+            != header["hashes"]
+        ):
+            logger.warning(f"The restored '{path.name}' backup is corrupted")
+            raise errors.BackupNotAvailableError()
+
+        temp_path = self.path.with_name(f".{self.path.name}.restore")
+        with open(temp_path, "wb") as file:
+            file.write(image)
+            file.flush()
+            os.fsync(file.fileno())
+
+        database = sqlite3.connect(temp_path, autocommit=True)
+        try:
+            intact = database.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        finally:
+            database.close()
+        if not intact:
+            temp_path.unlink(missing_ok=True)
+            logger.warning(f"The restored '{path.name}' backup is corrupted")
+            raise errors.BackupNotAvailableError()
+
+        self._verified = (temp_path, path.name, len(chain))
+        return path.name
+
+    def replace(self) -> str:
+        """
+        Replaces the database with the backup that is verified by
+        ``self.verify()``. The current database is moved to the
+        backups directory if it exists.
+        The app should not be running meanwhile.
+
+        Returns:
+            The name of the restored backup.
+
+        Raises:
+            ``RuntimeError``:
+                When no backup is verified.
+        """
+        if self._verified is None:
+            raise RuntimeError("The backup should be verified before the replacement")
+
+        temp_path, name, count = self._verified
+        Database.replace(temp_path, self.shard)
+        self._verified = None
+        logger.info(
+            f"The database is restored from the '{name}' backup"
+            f" ('{count}' backups are applied)"
+        )
+        return name
+
+    def discard(self) -> None:
+        """Removes the backup that is verified by ``self.verify()``."""
+        if self._verified is not None:
+            self._verified[0].unlink(missing_ok=True)
+            self._verified = None
+
+    def prune(self) -> None:
+        """
+        Removes the backups that are older than the retention time,
+        unless the latest backup or the newer ones depend on them.
+        """
+        if self.retention <= 0 or not (backups := self._list()):
+            return
+
+        expiry_date = current_time() - timedelta(seconds=self.retention)
+        kept = set()
+        for backup in backups:
+            if backup.date >= expiry_date or backup is backups[-1]:
+                if backup.path.name in kept:
+                    continue
+                try:
+                    kept.update(path.name for path, _ in self._get_chain(backup.path))
+                except errors.BackupNotAvailableError:
+                    kept.add(backup.path.name)
+
+        for backup in backups:
+            if backup.path.name not in kept:
+                backup.path.unlink(missing_ok=True)
+                logger.debug(
+                    f"The database backup file '{backup.path.name}' is removed"
+                )
+
+    def start(self) -> asyncio.Task | None:
+        """Starts the database backup procedure.
+
+        The backup interval can be configured with `backup_interval`
+        property in the configuration file. Only the leader backs up
+        the database when it's shared within a cluster.
+
+        Returns:
+            The related AsyncIO Task that can be awaited on.
+
+        Raises:
+            ``RuntimeError``:
+                When called while the procedure is already running.
+        """
+        if self._task is not None:
+            raise RuntimeError("The database backup procedure is already running")
+        elif not self.ENABLED:
+            logger.debug("The database backup procedure is disabled")
+            return
+
+        async def _backup() -> None:
+            logger.info("The database backup procedure is started")
+            while True:
+                try:
+                    await asyncio.sleep(backup_interval)
+                    if cluster_node and not Database.is_leader():
+                        continue
+                    # The database is serialized, hashed and
+                    # compressed without blocking the event loop
+                    await asyncio.to_thread(self.create)
+                    await asyncio.to_thread(self.prune)
+                except asyncio.CancelledError:
+                    logger.info("The database backup procedure is stopped")
+                    raise
+                except Exception as error:
+                    logger.exception(error)
+
+        self._task = asyncio.create_task(_backup(), name="database_backup")
+        return self._task
+
+    def stop(self) -> None:
+        """Stops the database backup procedure."""
+        if (task := self._task) is not None and not task.cancelled():
+            task.cancel()
+            self._task = None
@@ -9,10 +9,12 @@ from click import style
 
 from . import __version__
 from . import errors
-from .utils import gather
+from .utils import gather, convert_date
 from .errors import BaseError
 from .managers import Manager
-from .database import Database
+from .backup import Backup
+from .database import Database, database_shards
+from .replica import Replica
 from .log import modify_console_logger, modify_handler
 
 logger = logging.getLogger(__name__)
@@ -240,6 +242,14 @@ class CLI:
             action="store_true",
             help="Show count of all the users that have an active plan",
         )
+        info.add_argument(
+            "--pending-operations",
+            action="store_true",
+            help=(
+                "Show count of the operations that are waiting"
+                " to be reflected to each service"
+            ),
+        )
         info.add_argument(
             "--credentials",
             metavar="<USERNAME>",
@@ -339,6 +349,27 @@ class CLI:
             action="store_true",
             help="Manually synchronize the services with the database",
         )
+        database.add_argument(
+            "-r",
+            "--reconcile",
+            action="store_true",
+            help=(
+                "Reflect the differences between the users that actually"
+                " exist on the services and the database to the services"
+            ),
+        )
+        database.add_argument(
+            "-n",
+            "--notify",
+            metavar="<USERNAME>",
+            action=UsernameAction,
+            nargs="+",
+            help=(
+                "Immediately synchronize the users that are modified"
+                " on the database with the services. Multiple usernames"
+                " could be specified"
+            ),
+        )
         database.add_argument(
             "-d",
             "--dump",
@@ -353,6 +384,38 @@ class CLI:
             const="",
             help="Generate and store a database backup (default: %%timestamp%%.bak)",
         )
+        database.add_argument(
+            "--backups",
+            action="store_true",
+            help="Show the auto backups of the database as JSON",
+        )
+        database.add_argument(
+            "--restore",
+            metavar="<DATE>",
+            nargs="?",
+            const="",
+            help=(
+                "Replace the database with the latest auto backup that is"
+                " created at or before the date in ISO 8601 format"
+                f" (default: the latest one). The '{__package__}' should not be running"
+            ),
+        )
+        database.add_argument(
+            "--replica",
+            action="store_true",
+            help=(
+                "Show the replication status of the database"
+                " replica of each shard as JSON"
+            ),
+        )
+        database.add_argument(
+            "--promote",
+            action="store_true",
+            help=(
+                "Replace the database with its replica."
+                f" The '{__package__}' should not be running"
+            ),
+        )
 
     def _log(
         self,
@@ -381,6 +444,34 @@ class CLI:
 
     async def _exec(self, command: str) -> None:
         arguments = self._arguments
+        if command == "database" and (
+            arguments.promote or (date := arguments.restore) is not None
+        ):
+            # The database should not be opened before getting replaced
+            try:
+                if arguments.promote:
+                    for shard in range(database_shards):
+                        Replica(shard=shard).promote()
+                        print(f"The replica of the shard '{shard}' is promoted")
+                else:
+                    backups = [Backup(shard) for shard in range(database_shards)]
+                    try:
+                        # The shards are only replaced when all of them are verified
+                        for backup in backups:
+                            backup.verify(convert_date(date) if date else None)
+                    except BaseException:
+                        for backup in backups:
+                            backup.discard()
+                        raise
+
+                    for backup in backups:
+                        name = backup.replace()
+                        print(f"The database is restored from the '{name}' backup")
+            except Exception as error:
+                self._log(error, traceback=True)
+                self._parser.exit(1)
+            return
+
         async with Manager(skip_retry=True) as manager:
             try:
                 match command:
@@ -454,6 +545,9 @@ class CLI:
                             print(manager.capacity)
                         elif arguments.active_capacity:
                             print(manager.active_capacity)
+                        elif arguments.pending_operations:
+                            for service, count in manager.pending_operations.items():
+                                print(f"{service}: {count}")
                         elif username := arguments.credentials:
                             credentials = manager.get_credentials(username)
                             print(f"{credentials['username']}@{credentials['uuid']}")
@@ -558,6 +652,24 @@ class CLI:
                                 )
                             except Exception as error:
                                 self._log(error, log_sync=True)
+                        elif arguments.reconcile:
+                            try:
+                                if not manager.connected:
+                                    manager.connect()
+                                print(
+                                    orjson.dumps(
+                                        await manager.reconcile(),
+                                        option=orjson.OPT_INDENT_2,
+                                    ).decode()
+                                )
+                            except Exception as error:
+                                self._log(error, traceback=True, log_sync=True)
+                        elif usernames := arguments.notify:
+                            if not manager.notify(usernames):
+                                logger.warning(
+                                    "Failed to notify the monitor procedure"
+                                    f" (is '{__package__}' running?)"
+                                )
                         elif arguments.dump:
                             print(
                                 orjson.dumps(
@@ -567,6 +679,30 @@ class CLI:
                         elif (suffix := arguments.backup) is not None:
                             Database.backup(suffix and f".{suffix}")
                             print("Database backup is located in: ./database/backup")
+                        elif arguments.backups:
+                            print(
+                                orjson.dumps(
+                                    [
+                                        backup
+                                        for shard in range(database_shards)
+                                        for backup in Backup(shard).list()
+                                    ],
+                                    option=orjson.OPT_INDENT_2,
+                                ).decode()
+                            )
+                        elif arguments.replica:
+                            statuses = []
+                            for shard in range(database_shards):
+                                replica = Replica(shard=shard)
+                                try:
+                                    statuses.append(replica.status())
+                                finally:
+                                    replica.close()
+                            print(
+                                orjson.dumps(
+                                    statuses, option=orjson.OPT_INDENT_2
+                                ).decode()
+                            )
                         else:
                             self._database.print_help()
             except Exception as error:
@@ -15,17 +15,47 @@ class ManagerReason(StrEnum):
     ZOMBIE_USER = "user doesn't exist on database"
 
 
+class OperationAction(StrEnum):
+    ADD = "add"
+    DELETE = "delete"
+
+
 class ServiceState(Enum):
     UNKNOWN = 0
     DELETED = 1
     ADDED = 2
 
 
+class StateCommand(Enum):
+    INITIALIZE = 0
+    ADD_USERS = 1
+    DELETE_USERS = 2
+    HAS_USER = 3
+    GET_USERNAMES = 4
+    GET_USER = 5
+    GET_SERVICE_STATE = 6
+    SET_SERVICE_STATES = 7
+    SET_ACTIVE_PLAN = 8
+    GET_REASON = 9
+    SET_REASON = 10
+    DUMP_USERS = 11
+    RESTORE_USERS = 12
+    POP_RESTORED_CHANGES = 13
+    ACQUIRE = 14
+    RELEASE = 15
+
+
 class ServiceStatus(Enum):
     DISCONNECTED = 0
     CONNECTED = 1
 
 
+class BreakerState(Enum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
 class XrayService(StrEnum):
     NAME = "xray"
     ALIAS = "Xray-core"
@@ -1,4 +1,4 @@
-import asyncio
+import os
 import logging
 import sqlite3
 from os import PathLike
@@ -8,36 +8,82 @@ import orjson
 
 from .config import config
 from .types import DatabaseSchema
-from .utils import current_time, convert_size
+from .utils import (
+    current_time,
+    convert_size,
+    get_instance_path,
+    get_hash_index,
+)
 
-backup_interval = config["database"]["backup_interval"]
+LEADER_LEASE = "leader"
+CHANGELOG_TRIGGER_PREFIX = "changelog_"
+SHARD_SCHEMA_PREFIX = "shard"
+MAX_SHARDS = 11  # the database and the maximum attached databases
+# The tables of the users' rows that are moved between the shards.
+# Each shard also stores the sequences of the journals separately.
+SHARDED_TABLES = (
+    "users",
+    "reserved_plans",
+    "history",
+    "pending_operations",
+    "traffic_deltas",
+)
+# The bookkeeping tables of the monitor procedures
+# that are not recorded in the changelog for the replica
+UNREPLICATED_TABLES = ("journals", "leases", "traffic_deltas", "plan_changes")
+
+cluster_node = config["main"]["cluster_node"]
 database_path = Path(config["database"]["path"])
+database_shards = config["database"]["shards"]
+replica_path = config["database"]["replica_path"]
 backup_dir = database_path.with_name("backup")
 logger = logging.getLogger(__name__)
 
 
+def get_shard(username: str) -> int:
+    """Returns the shard of the database that the user's rows are stored on."""
+    return get_hash_index(username, database_shards)
+
+
 class Database:
     """The interface to manage the database.
 
-    Attributes:
-        `BACKUP_ENABLED`: Whether the auto backup is enabled.
+    The users' rows could be partitioned among multiple database files
+    (the shards) by the hash of their username, so the users that are
+    stored on different shards are modified concurrently. All the shards
+    have the same tables and the first one is the database itself which
+    also stores the rows that are not related to the users.
+
+    Args:
+        `shard`:
+            The shard to connect to. The connection can be shared
+            between the threads.
+            If omitted, the connection has the other shards attached and
+            the sharded tables are shadowed by the temporary views of all
+            the shards' rows which are only readable. The users' rows
+            should be modified through the connection of their own shard.
 
     Returns:
         The database connection object that can be used
         to interact with the database.
     """
 
-    __initiated = None
-    __backup_task = None
-    BACKUP_ENABLED = backup_interval > 0
+    # The initiated shards and `None` after the shards are attached once,
+    # so only the first connections of the process create the tables
+    # and the triggers and move the users' rows between the shards
+    __initiated: set[int | None] = set()
 
-    def __new__(cls) -> sqlite3.Connection:
+    def __new__(cls, shard: int | None = None) -> sqlite3.Connection:
         database = super().__new__(cls)
-        database.__init__()
+        database.__init__(shard)
         return database.connection
 
-    def __init__(self) -> None:
-        self.connection = sqlite3.connect(database_path, autocommit=False)
+    def __init__(self, shard: int | None = None) -> None:
+        self.connection = sqlite3.connect(
+            get_instance_path(database_path, shard or 0),
+            autocommit=False,
+            check_same_thread=shard is None,
+        )
         self.connection.row_factory = lambda cursor, row: {
             key: value
             for key, value in zip([column[0] for column in cursor.description], row)
@@ -49,10 +95,11 @@ class Database:
         self.connection.execute("PRAGMA foreign_keys=ON")
         self.connection.autocommit = False
 
-        if not Database.__initiated:
-            if backup_interval == 0:
-                logger.debug("The database backup procedure is disabled")
+        if (shard or 0) not in Database.__initiated:
             self._initiate()
+            Database.__initiated.add(shard or 0)
+        if shard is None:
+            self._attach()
 
     def _initiate(self) -> None:
         """Creates the database and its required tables."""
@@ -92,9 +139,255 @@ class Database:
                 plan_extra_traffic BIGINT, /* in bytes */
                 FOREIGN KEY (username) REFERENCES users (username) ON DELETE CASCADE
             );
+            CREATE TABLE IF NOT EXISTS pending_operations (
+                username VARCHAR(64),
+                service VARCHAR(16),
+                action VARCHAR(16),
+                attempts INT DEFAULT 0,
+                next_attempt_date TEXT,
+                PRIMARY KEY (username, service)
+            );
+            CREATE TABLE IF NOT EXISTS journals (
+                name VARCHAR(64),
+                sequence INT, /* the last stored record */
+                PRIMARY KEY (name)
+            );
+            CREATE TABLE IF NOT EXISTS traffic_deltas (
+                node VARCHAR(64),
+                username VARCHAR(64),
+                upload BIGINT DEFAULT 0, /* in bytes */
+                download BIGINT DEFAULT 0, /* in bytes */
+                date TEXT,
+                PRIMARY KEY (node, username)
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name VARCHAR(64),
+                node VARCHAR(64),
+                expiry_date TEXT,
+                PRIMARY KEY (name)
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                count INT /* the count of the shards that the users are stored on */
+            );
+            CREATE TABLE IF NOT EXISTS changelog (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time REAL, /* in seconds since the epoch */
+                table_name VARCHAR(64),
+                row_id INT,
+                data TEXT /* the row's values as JSON or NULL for deletion */
+            );
+            CREATE TABLE IF NOT EXISTS plan_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                time REAL, /* in seconds since the epoch */
+                username VARCHAR(64),
+                node VARCHAR(64) /* the node of the traffic deltas or NULL */
+            );
+            CREATE TRIGGER IF NOT EXISTS plan_changes_users_insert
+            AFTER INSERT ON users BEGIN
+                INSERT INTO plan_changes (time, username)
+                VALUES ((JULIANDAY('now') - 2440587.5) * 86400, NEW.username);
+            END;
+            /* The traffic usages are only changed by the monitor procedures */
+            CREATE TRIGGER IF NOT EXISTS plan_changes_users_update
+            AFTER UPDATE OF plan_start_date, plan_duration, plan_traffic, plan_extra_traffic
+            ON users BEGIN
+                INSERT INTO plan_changes (time, username)
+                VALUES ((JULIANDAY('now') - 2440587.5) * 86400, NEW.username);
+            END;
+            CREATE TRIGGER IF NOT EXISTS plan_changes_users_delete
+            AFTER DELETE ON users BEGIN
+                INSERT INTO plan_changes (time, username)
+                VALUES ((JULIANDAY('now') - 2440587.5) * 86400, OLD.username);
+            END;
+            CREATE TRIGGER IF NOT EXISTS plan_changes_traffic_deltas_insert
+            AFTER INSERT ON traffic_deltas BEGIN
+                INSERT INTO plan_changes (time, username, node)
+                VALUES ((JULIANDAY('now') - 2440587.5) * 86400, NEW.username, NEW.node);
+            END;
+            CREATE TRIGGER IF NOT EXISTS plan_changes_traffic_deltas_update
+            AFTER UPDATE ON traffic_deltas BEGIN
+                INSERT INTO plan_changes (time, username, node)
+                VALUES ((JULIANDAY('now') - 2440587.5) * 86400, NEW.username, NEW.node);
+            END;
             """
         )
         self.connection.commit()
+        self._record_changes(bool(replica_path))
+
+    def _attach(self) -> None:
+        """
+        Attaches the other shards and shadows the sharded tables with
+        the views of all the shards' rows. The users' rows are moved
+        to their own shard when the count of the shards is changed.
+
+        Raises:
+            ``ValueError``:
+                When the count of the shards is out of the allowed range.
+        """
+        if not 1 <= database_shards <= MAX_SHARDS:
+            raise ValueError(
+                f"The count of the database shards should be between 1 and {MAX_SHARDS}"
+            )
+
+        count = database_shards
+        if not (initiated := None in Database.__initiated):
+            with self.connection:
+                stored = self.connection.execute("SELECT count FROM shards").fetchone()
+            count = stored["count"] if stored else 1
+        schemas = ["main"]
+        # It's not possible to attach or detach the databases within a transaction
+        self.connection.autocommit = True
+        for shard in range(1, max(count, database_shards)):
+            if not initiated:
+                # Creating the shard's tables
+                Database(shard).close()
+            schemas.append(schema := f"{SHARD_SCHEMA_PREFIX}{shard}")
+            self.connection.execute(
+                f"ATTACH DATABASE ? AS {schema}",
+                (str(get_instance_path(database_path, shard)),),
+            )
+        self.connection.autocommit = False
+
+        if not initiated:
+            if count != database_shards:
+                self._rebalance(schemas)
+            if count != database_shards or not stored:
+                with self.connection:
+                    self.connection.execute("DELETE FROM shards")
+                    self.connection.execute(
+                        "INSERT INTO shards (count) VALUES (?)", (database_shards,)
+                    )
+
+        if len(schemas) > database_shards:
+            self.connection.autocommit = True
+            for schema in schemas[database_shards:]:
+                self.connection.execute(f"DETACH DATABASE {schema}")
+            self.connection.autocommit = False
+            del schemas[database_shards:]
+
+        if database_shards > 1:
+            with self.connection:
+                for table in (*SHARDED_TABLES, "journals"):
+                    self.connection.execute(
+                        f"CREATE TEMP VIEW {table} AS "
+                        + " UNION ALL ".join(
+                            f"SELECT * FROM {schema}.{table}" for schema in schemas
+                        )
+                    )
+        Database.__initiated.add(None)
+
+    def _rebalance(self, schemas: list[str]) -> None:
+        """
+        Moves the users' rows of the attached shards to their own shard.
+
+        The transactions over multiple databases are not atomic in
+        the WAL mode, so each move is performed in a separate transaction
+        and the interrupted moves are performed again.
+        """
+        self.connection.create_function("get_shard", 1, get_shard, deterministic=True)
+        for source, source_schema in enumerate(schemas):
+            for target, target_schema in enumerate(schemas[:database_shards]):
+                if source == target:
+                    continue
+
+                with self.connection:
+                    for table in SHARDED_TABLES:
+                        rows = (
+                            f"FROM {source_schema}.{table}"
+                            f" WHERE get_shard(username) = {target}"
+                        )
+                        # The rows that are copied by an interrupted move
+                        self.connection.execute(
+                            f"DELETE FROM {target_schema}.{table}"
+                            f" WHERE username IN (SELECT username {rows})"
+                        )
+                        self.connection.execute(
+                            f"INSERT INTO {target_schema}.{table} SELECT * {rows}"
+                        )
+                    for table in reversed(SHARDED_TABLES):
+                        self.connection.execute(
+                            f"DELETE FROM {source_schema}.{table}"
+                            f" WHERE get_shard(username) = {target}"
+                        )
+
+        # The moved users' traffic usages are stored up to the latest
+        # journaled record on whichever shard they are moved from
+        with self.connection:
+            for schema in schemas[:database_shards]:
+                self.connection.execute(
+                    f"""
+                    INSERT INTO {schema}.journals (name, sequence)
+                    SELECT name, MAX(sequence) FROM ({
+                        " UNION ALL ".join(
+                            f"SELECT * FROM {_schema}.journals" for _schema in schemas
+                        )
+                    }) WHERE true GROUP BY name
+                    ON CONFLICT (name) DO UPDATE SET sequence = excluded.sequence
+                    """
+                )
+
+        logger.info(
+            f"The users are moved to their own shard of the '{database_shards}'"
+            " database shards"
+        )
+
+    def _record_changes(self, enable: bool) -> None:
+        """
+        Creates the triggers that record the changes of the tables
+        in the `changelog` table for the replica, or removes them.
+        The triggers are only replaced when the tables are modified.
+        """
+        triggers = {}
+        if enable:
+            excluded = ("changelog", *UNREPLICATED_TABLES)
+            for table in self.connection.execute(
+                f"""
+                SELECT name FROM sqlite_master
+                WHERE
+                    type = 'table'
+                    AND name NOT IN ({", ".join("?" * len(excluded))})
+                    AND name NOT LIKE 'sqlite_%'
+                """,
+                excluded,
+            ).fetchall():
+                table = table["name"]
+                values = ", ".join(
+                    f'NEW."{column["name"]}"'
+                    for column in self.connection.execute(
+                        f"PRAGMA table_info('{table}')"
+                    ).fetchall()
+                )
+                for operation, row, data in (
+                    ("INSERT", "NEW", f"json_array({values})"),
+                    ("UPDATE", "NEW", f"json_array({values})"),
+                    ("DELETE", "OLD", "NULL"),
+                ):
+                    name = f"{CHANGELOG_TRIGGER_PREFIX}{table}_{operation.lower()}"
+                    triggers[name] = (
+                        f"CREATE TRIGGER {name} AFTER {operation} ON {table} BEGIN"
+                        " INSERT INTO changelog (time, table_name, row_id, data)"
+                        " VALUES ((JULIANDAY('now') - 2440587.5) * 86400,"
+                        f" '{table}', {row}.rowid, {data}); END"
+                    )
+
+        existing_triggers = {
+            trigger["name"]: trigger["sql"]
+            for trigger in self.connection.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+                (f"{CHANGELOG_TRIGGER_PREFIX}%",),
+            ).fetchall()
+        }
+        self.connection.commit()
+        if existing_triggers == triggers:
+            return
+
+        with self.connection:
+            for name in existing_triggers.keys() | triggers.keys():
+                self.connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+            for sql in triggers.values():
+                self.connection.execute(sql)
+            if not triggers:
+                self.connection.execute("DELETE FROM changelog")
 
     @staticmethod
     def size(database: sqlite3.Connection) -> int:
@@ -151,67 +444,67 @@ class Database:
         if not backup_dir.exists():
             backup_dir.mkdir(parents=True, exist_ok=True)
 
-        backup_name = f"{database_path.name}{suffix}"
-        with sqlite3.connect(
-            backup_dir.joinpath(backup_name),
-            # It's not possible to perform `VACUUM`
-            # command within a transaction
-            autocommit=True,
-        ) as db:
-            # It seems `backup()` method (and then `VACUUM` command)
-            # do not blocks the original database's transactions so
-            # it's favored over `VACUUM INTO` command.
-            _db = Database()
-            _db.backup(db)
-            _db.close()
-            previous_size = Database.size(db)
-            db.execute("VACUUM")
-            reduced = previous_size - Database.size(db)
-
-        db.close()
-        logger.debug(
-            f"The database backup file '{backup_name}' is created{
-                f" (file size reduced by '{convert_size(reduced)}')"
-                if reduced > 0
-                else ""
-            }"
-        )
+        for shard in range(database_shards):
+            backup_name = f"{get_instance_path(database_path, shard).name}{suffix}"
+            with sqlite3.connect(
+                backup_dir.joinpath(backup_name),
+                # It's not possible to perform `VACUUM`
+                # command within a transaction
+                autocommit=True,
+            ) as db:
+                # It seems `backup()` method (and then `VACUUM` command)
+                # do not blocks the original database's transactions so
+                # it's favored over `VACUUM INTO` command.
+                _db = Database(shard)
+                _db.backup(db)
+                _db.close()
+                previous_size = Database.size(db)
+                db.execute("VACUUM")
+                reduced = previous_size - Database.size(db)
 
-    @staticmethod
-    def start_backup() -> asyncio.Task | None:
-        """Starts the database backup procedure.
+            db.close()
+            logger.debug(
+                f"The database backup file '{backup_name}' is created{
+                    f" (file size reduced by '{convert_size(reduced)}')"
+                    if reduced > 0
+                    else ""
+                }"
+            )
 
-        The backup interval can be configured with `backup_interval`
-        property in the configuration file.
+    @staticmethod
+    def is_leader() -> bool:
+        """Whether this server holds the leadership of the cluster."""
+        database = Database(0)
+        try:
+            lease = database.execute(
+                "SELECT node FROM leases WHERE name = ? AND expiry_date > ?",
+                (LEADER_LEASE, current_time().isoformat()),
+            ).fetchone()
+            database.commit()
+        finally:
+            database.close()
 
-        Returns:
-            The related AsyncIO Task that can be awaited on.
+        return bool(lease) and lease["node"] == cluster_node
 
-        Raises:
-            ``RuntimeError``:
-                When called while the procedure is already running.
+    @staticmethod
+    def replace(path: Path, shard: int = 0) -> None:
         """
-        if Database.__backup_task is not None:
-            raise RuntimeError("The database backup procedure is already running")
-        elif backup_interval <= 0:
-            return
-
-        async def _backup() -> None:
-            logger.info("The database backup procedure is started")
-            while True:
-                try:
-                    await asyncio.sleep(backup_interval)
-                    Database.backup()
-                except asyncio.CancelledError:
-                    logger.info("The database backup procedure is stopped")
-                    raise
-
-        Database.__backup_task = asyncio.create_task(_backup(), name="database_backup")
-        return Database.__backup_task
+        Replaces the database's shard with the passed database file.
+        The current shard is moved to the backups directory if it exists.
+        The app should not be running meanwhile.
+        """
+        shard_path = get_instance_path(database_path, shard)
+        suffix = f"{current_time().strftime(r'.%Y%m%d%H%M%S')}.old"
+        for sidecar in ("", "-wal", "-shm"):
+            _path = shard_path.with_name(f"{shard_path.name}{sidecar}")
+            if _path.exists():
+                if not backup_dir.exists():
+                    backup_dir.mkdir(parents=True, exist_ok=True)
+                # The stale sidecar files would be applied to the replaced database
+                os.replace(
+                    _path, backup_dir.joinpath(f"{shard_path.name}{suffix}{sidecar}")
+                )
 
-    @staticmethod
-    def stop_backup() -> None:
-        """Stops the database backup procedure."""
-        if (task := Database.__backup_task) is not None and not task.cancelled():
-            task.cancel()
-            Database.__backup_task = None
+        os.replace(path, shard_path)
+        # The replaced shard is initiated again by the next connection
+        Database.__initiated.difference_update((shard, None))
@@ -259,6 +259,21 @@ class OpenConnectTimeoutError(BaseError):
         )
 
 
+class OpenConnectCommandError(BaseError):
+    """The `OpenConnect` service failed to run the command."""
+
+    ALIAS = OpenConnectService.ALIAS
+
+    def __init__(self, command: str = "", **kwargs) -> None:
+        super().__init__(
+            f"The '{self.ALIAS}' VPN server failed to run the "
+            f"{command and f"'{command}' "}command",
+            17,
+            HTTP_500_INTERNAL_SERVER_ERROR,
+            **kwargs,
+        )
+
+
 class SynchronizationError(BaseError):
     """Failed to reflect the changes to the related services."""
 
@@ -302,3 +317,27 @@ class StateSynchronizerTimeout(BaseError):
             HTTP_500_INTERNAL_SERVER_ERROR,
             **kwargs,
         )
+
+
+class ReplicaNotAvailableError(BaseError):
+    """The database replica is not available."""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(
+            "The database replica is not available",
+            15,
+            HTTP_500_INTERNAL_SERVER_ERROR,
+            **kwargs,
+        )
+
+
+class BackupNotAvailableError(BaseError):
+    """The database backup is not available."""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(
+            "The database backup is not available",
+            16,
+            HTTP_500_INTERNAL_SERVER_ERROR,
+            **kwargs,
+        )
@@ -2,6 +2,20 @@ from .state import State
 from .users import Users
 from .xray import Xray
 from .openconnect import OpenConnect
+from .plans import PlanTable
+from .breaker import CircuitBreaker
+from .checkpoint import Checkpoint
+from .journal import TrafficJournal
 from .manager import Manager
 
-__all__ = ["State", "Users", "Xray", "OpenConnect", "Manager"]
+__all__ = [
+    "State",
+    "Users",
+    "Xray",
+    "OpenConnect",
+    "PlanTable",
+    "CircuitBreaker",
+    "Checkpoint",
+    "TrafficJournal",
+    "Manager",
+]
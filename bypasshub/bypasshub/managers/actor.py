@@ -0,0 +1,414 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Any, NamedTuple, Self
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection
+from collections.abc import Callable, Iterable
+
+from .. import errors
+from ..config import config
+from ..constants import ServiceState, ManagerReason, StateCommand
+from .snapshot import StateSnapshot
+from ..types import ManagerState, ManagerUserState
+
+socket_path = Path(config["main"]["temp_path"]).joinpath("state-actor.sock")
+# The listener skips the authentication for an empty key
+# while the client does not and the handshake hangs forever
+authkey = config["api"]["key"] or None
+logger = logging.getLogger(__name__)
+
+
+class StateRequest(NamedTuple):
+    command: StateCommand
+    arguments: tuple = ()
+
+
+def _initialize(state: ManagerState) -> bool:
+    if state.get("initialized"):
+        return False
+
+    state["initialized"] = True
+    return True
+
+
+def _add_users(
+    state: ManagerState,
+    users: dict[str, bool],
+    service_names: list[str],
+    service_state: ServiceState | None,
+    synced: bool,
+    safe: bool,
+) -> dict[str, ManagerUserState]:
+    _users = state["users"]
+    entries = {}
+    for username, has_active_plan in users.items():
+        if safe and username in _users:
+            continue
+
+        _service_state = (
+            service_state
+            if service_state is not None
+            else (ServiceState.ADDED if has_active_plan else ServiceState.DELETED)
+        )
+        entries[username] = {
+            "synced": synced,
+            "has_active_plan": has_active_plan,
+            "services": {name: _service_state for name in service_names},
+        }
+
+    _users.update(entries)
+    return entries
+
+
+def _delete_users(state: ManagerState, usernames: Iterable[str]) -> dict[str, None]:
+    for username in usernames:
+        for dic in (state["users"], state["reasons"]):
+            if username in dic:
+                del dic[username]
+
+    return dict.fromkeys(usernames)
+
+
+def _has_user(state: ManagerState, username: str) -> bool:
+    return username in state["users"]
+
+
+def _get_usernames(state: ManagerState) -> list[str]:
+    return list(state["users"].keys())
+
+
+def _get_user(state: ManagerState, username: str) -> dict | None:
+    if (user := state["users"].get(username)) is None:
+        return None
+
+    return user | {"services": user["services"].copy()}
+
+
+def _get_service_state(
+    state: ManagerState, username: str, service_name: str
+) -> ServiceState:
+    return state["users"][username]["services"][service_name]
+
+
+def _set_service_states(
+    state: ManagerState,
+    service_name: str,
+    service_states: dict[str, ServiceState],
+) -> dict[str, ManagerUserState]:
+    users = state["users"]
+    changes = {}
+    for username, service_state in service_states.items():
+        if user := users.get(username):
+            user["services"][service_name] = service_state
+            users[username] = changes[username] = user
+
+    return changes
+
+
+def _set_active_plan(
+    state: ManagerState, username: str, has_active_plan: bool
+) -> dict[str, ManagerUserState]:
+    users = state["users"]
+    user = users[username]
+    user["has_active_plan"] = has_active_plan
+    user["synced"] = True
+    users[username] = user
+    return {username: user}
+
+
+def _get_reason(state: ManagerState, username: str) -> ManagerReason | None:
+    return state["reasons"].get(username)
+
+
+def _set_reason(state: ManagerState, username: str, reason: ManagerReason) -> None:
+    state["reasons"][username] = reason
+
+
+def _dump_users(
+    state: ManagerState,
+) -> tuple[dict[str, ManagerUserState], dict[str, ManagerReason]]:
+    return {
+        username: user | {"services": user["services"].copy()}
+        for username, user in state["users"].copy().items()
+    }, state["reasons"].copy()
+
+
+def _restore_users(
+    state: ManagerState,
+    users: dict[str, ManagerUserState],
+    reasons: dict[str, ManagerReason],
+    changes: list[str],
+    safe: bool,
+) -> dict[str, ManagerUserState]:
+    _users = state["users"]
+    entries = (
+        {username: user for username, user in users.items() if username not in _users}
+        if safe
+        else users
+    )
+    _users.update(entries)
+    state["reasons"].update(
+        {
+            username: reason
+            for username, reason in reasons.items()
+            if username in entries
+        }
+    )
+    state["restored_changes"] = changes
+    return entries
+
+
+def _pop_restored_changes(state: ManagerState) -> list[str]:
+    return state.pop("restored_changes", [])
+
+
+_handlers: dict[StateCommand, Callable[..., Any]] = {
+    StateCommand.INITIALIZE: _initialize,
+    StateCommand.ADD_USERS: _add_users,
+    StateCommand.DELETE_USERS: _delete_users,
+    StateCommand.HAS_USER: _has_user,
+    StateCommand.GET_USERNAMES: _get_usernames,
+    StateCommand.GET_USER: _get_user,
+    StateCommand.GET_SERVICE_STATE: _get_service_state,
+    StateCommand.SET_SERVICE_STATES: _set_service_states,
+    StateCommand.SET_ACTIVE_PLAN: _set_active_plan,
+    StateCommand.GET_REASON: _get_reason,
+    StateCommand.SET_REASON: _set_reason,
+    StateCommand.DUMP_USERS: _dump_users,
+    StateCommand.RESTORE_USERS: _restore_users,
+    StateCommand.POP_RESTORED_CHANGES: _pop_restored_changes,
+}
+
+
+# The commands that modify the users and return the modified users' state
+_modifiers = {
+    StateCommand.ADD_USERS,
+    StateCommand.RESTORE_USERS,
+    StateCommand.DELETE_USERS,
+    StateCommand.SET_SERVICE_STATES,
+    StateCommand.SET_ACTIVE_PLAN,
+}
+
+
+def execute(
+    state: ManagerState, request: StateRequest, snapshot: StateSnapshot | None = None
+) -> Any:
+    """
+    Executes the request on the passed state.
+
+    The state can either be the plain dictionaries that are owned
+    by ``StateActor`` or the proxies of the process state synchronizer.
+    Each user's state is stored by value and is written back
+    as a whole whenever it is modified, so the requests should
+    be executed one at a time on the same state.
+
+    Args:
+        `snapshot`:
+            The snapshot that the modified users get published to.
+    """
+    result = _handlers[request.command](state, *request.arguments)
+    if request.command in _modifiers:
+        if snapshot:
+            snapshot.publish(result)
+        return None
+
+    return result
+
+
+class StateActor:
+    """The single owner of the managers' state.
+
+    The state is kept in the plain memory of the process that
+    runs the actor and the other processes access it through
+    ``StateChannel`` by sending the typed requests. The requests
+    of each round trip are executed in order and each one is
+    executed atomically. The lock stripes are also served by the
+    actor and the ones that are held by a disconnected process
+    are released automatically.
+
+    Attributes:
+        `path`:
+            The listening socket location.
+    """
+
+    def __init__(self, path: Path = socket_path) -> None:
+        self.path = path
+        self._state: ManagerState = {"reasons": {}, "users": {}}
+        self._mutex = threading.Lock()
+        self._locks: dict[int, threading.Lock] = {}
+        self._listener: Listener | None = None
+        self._snapshot = StateSnapshot()
+
+    def _get_lock(self, stripe: int) -> threading.Lock:
+        with self._mutex:
+            if (lock := self._locks.get(stripe)) is None:
+                lock = self._locks[stripe] = threading.Lock()
+            return lock
+
+    def _accept(self) -> None:
+        listener = self._listener
+        while True:
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                logger.warning("Rejected the unauthenticated state actor connection")
+                continue
+            except OSError:
+                if self._listener is None:
+                    return  # the actor is closed
+                continue
+
+            threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            ).start()
+
+    def _serve(self, connection: Connection) -> None:
+        held = set()
+        try:
+            while True:
+                connection.send(self.execute(connection.recv(), held))
+        except (EOFError, OSError):
+            pass
+        finally:
+            for stripe in held:
+                self._get_lock(stripe).release()
+            connection.close()
+
+    def execute(
+        self, requests: Iterable[StateRequest], held: set[int]
+    ) -> tuple[list[Any], Exception | None]:
+        """Executes the requests in order.
+
+        Args:
+            `held`:
+                The lock stripes that are held by the requester.
+
+        Returns:
+            The result of each executed request and the exception that
+            is raised by the failed request. The requests that come after
+            the failed request are not executed.
+        """
+        results = []
+        for request in requests:
+            try:
+                if request.command == StateCommand.ACQUIRE:
+                    (stripe,) = request.arguments
+                    self._get_lock(stripe).acquire()
+                    held.add(stripe)
+                    results.append(None)
+                elif request.command == StateCommand.RELEASE:
+                    (stripe,) = request.arguments
+                    held.remove(stripe)
+                    self._get_lock(stripe).release()
+                    results.append(None)
+                else:
+                    with self._mutex:
+                        results.append(execute(self._state, request, self._snapshot))
+            except Exception as error:
+                return results, error
+
+        return results, None
+
+    def run(self) -> None:
+        """Starts serving the other processes in the background."""
+        if self.path.is_socket():
+            self.path.unlink(missing_ok=True)
+            logger.info("Removed the state actor socket file from the previous session")
+
+        self._listener = Listener(str(self.path), "AF_UNIX", authkey=authkey)
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.debug("State actor is started")
+
+    def close(self) -> None:
+        """Stops serving the other processes."""
+        if listener := self._listener:
+            self._listener = None
+            listener.close()
+            logger.debug("State actor is stopped")
+
+
+class StateLock:
+    """The lock stripe that is served by ``StateActor``."""
+
+    def __init__(self, channel: "StateChannel", stripe: int) -> None:
+        self._channel = channel
+        self._stripe = stripe
+
+    def __enter__(self) -> Self:
+        self.acquire()
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.release()
+
+    def acquire(self) -> None:
+        self._channel.request((StateRequest(StateCommand.ACQUIRE, (self._stripe,)),))
+
+    def release(self) -> None:
+        self._channel.request((StateRequest(StateCommand.RELEASE, (self._stripe,)),))
+
+
+class StateChannel:
+    """The persistent channel of a process to ``StateActor``.
+
+    All the passed requests are sent in a single round trip.
+    The channel communicates with the actor directly
+    when both are in the same process.
+
+    Attributes:
+        `actor`:
+            The actor that runs in the same process.
+    """
+
+    def __init__(self, actor: StateActor | None = None) -> None:
+        self._actor = actor
+        self._connection: Connection | None = None
+        self._held = set()
+        self._mutex = threading.Lock()
+
+    def connect(self, path: Path = socket_path) -> None:
+        """Establishes the connection to the actor.
+
+        Raises:
+            ``errors.UNIX_SOCKET_FAILURE``:
+                When the actor is not running.
+        """
+        self._connection = Client(str(path), "AF_UNIX", authkey=authkey)
+
+    def request(self, requests: Iterable[StateRequest]) -> list[Any]:
+        """Executes the requests on the actor in order.
+
+        Returns:
+            The result of each request.
+
+        Raises:
+            ``errors.StateSynchronizerTimeout``:
+                When the connection to the actor is lost.
+        """
+        if self._actor:
+            results, error = self._actor.execute(requests, self._held)
+        else:
+            with self._mutex:
+                try:
+                    self._connection.send(list(requests))
+                    results, error = self._connection.recv()
+                except (EOFError, OSError):
+                    raise errors.StateSynchronizerTimeout()
+
+        if error:
+            raise error
+        return results
+
+    def lock(self, stripe: int) -> StateLock:
+        """Returns the lock stripe that is served by the actor."""
+        return StateLock(self, stripe)
+
+    def close(self) -> None:
+        """
+        Closes the connection. The lock stripes that
+        are held by the channel are released by the actor.
+        """
+        if self._connection:
+            self._connection.close()
+            self._connection = None
@@ -1,6 +1,8 @@
+import asyncio
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
 
-from ..types import Traffic
+from ..types import Traffic, Credentials
 
 
 class BaseService(ABC):
@@ -18,6 +20,13 @@ class BaseService(ABC):
         """The service's alias."""
         raise NotImplementedError()
 
+    @classmethod
+    @property
+    @abstractmethod
+    def TIMEOUT_ERROR(cls) -> type[Exception]:
+        """The error that is raised when failed to communicate with the service."""
+        raise NotImplementedError()
+
     @abstractmethod
     async def add_user(self, username: str, uuid: str) -> None:
         """Adds the user to the current service session.
@@ -38,6 +47,64 @@ class BaseService(ABC):
         """
         raise NotImplementedError()
 
+    async def add_users(
+        self, credentials: Iterable[Credentials]
+    ) -> dict[str, Exception]:
+        """Adds the users to the current service session.
+
+        Services that support batching should override this
+        method to add all the users with fewer round trips.
+
+        Returns:
+            The raised exceptions mapped to the related user's username
+            for the users that could not be added (e.g. ``errors.UserExistError``).
+        """
+        credentials = list(credentials)
+        return {
+            credential["username"]: result
+            for credential, result in zip(
+                credentials,
+                await asyncio.gather(
+                    *[self.add_user(**credential) for credential in credentials],
+                    return_exceptions=True,
+                ),
+            )
+            if isinstance(result, Exception)
+        }
+
+    async def delete_users(self, usernames: Iterable[str]) -> dict[str, Exception]:
+        """Deletes the users from the current service session.
+
+        Services that support batching should override this
+        method to delete all the users with fewer round trips.
+
+        Returns:
+            The raised exceptions mapped to the related user's username for
+            the users that could not be deleted (e.g. ``errors.UserNotExistError``).
+        """
+        usernames = list(usernames)
+        return {
+            username: result
+            for username, result in zip(
+                usernames,
+                await asyncio.gather(
+                    *[self.delete_user(username) for username in usernames],
+                    return_exceptions=True,
+                ),
+            )
+            if isinstance(result, Exception)
+        }
+
+    async def list_users(self) -> set[str] | None:
+        """Returns the users that currently exist on the service.
+
+        Services that are able to list their users should override this method.
+
+        Returns:
+            The usernames or `None` if the service does not support listing.
+        """
+        return None
+
     @abstractmethod
     async def user_traffic_usage(self, username: str, reset: bool) -> Traffic:
         """Returns the user's traffic usage since start of the current service session.
@@ -50,6 +117,17 @@ class BaseService(ABC):
         """
         raise NotImplementedError()
 
+    async def peek_traffic_usage(self, username: str) -> Traffic:
+        """
+        Returns the user's traffic usage since the last time it was
+        reset without resetting it, so the next call that resets the
+        traffic usage still includes it.
+
+        Services that keep the traffic usage of the resetting calls
+        other than the service's counters should override this method.
+        """
+        return await self.user_traffic_usage(username, reset=False)
+
     @abstractmethod
     async def users_traffic_usage(self, reset: bool) -> dict[str, Traffic]:
         """Returns users traffic usage since start of the current service session.
@@ -0,0 +1,125 @@
+import logging
+from time import monotonic
+from typing import Any, Self
+from multiprocessing import current_process
+from collections.abc import Awaitable, Callable
+
+from ..config import config
+from ..types import Service
+from ..constants import BreakerState
+
+FAILURE_THRESHOLD = 2
+
+probe_interval = config["main"]["service_probe_interval"]
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    The circuit breaker that stops the communications
+    with the service while the service is unreachable.
+
+    After `FAILURE_THRESHOLD` consecutive timeouts, the calls fail
+    immediately with the service's timeout error instead of waiting
+    for the whole timeout. Once every `probe_interval` seconds, a single
+    call is let through to probe the service and the circuit gets closed
+    again when the service responds.
+
+    The breakers should be obtained with ``CircuitBreaker.get()``
+    to be shared between all the instances on the same process.
+
+    Attributes:
+        `service`:
+            The service which its communications are guarded.
+        `probe_interval`:
+            The time in seconds to wait before probing the unreachable service.
+            The default value is equal to `service_probe_interval` property
+            of the configuration file.
+    """
+
+    __pid = None
+    _breakers: dict[str, Self] = {}
+
+    def __init__(
+        self, service: Service, probe_interval: int | float = probe_interval
+    ) -> None:
+        self.name = service.NAME
+        self.alias = service.ALIAS
+        self.error = service.TIMEOUT_ERROR
+        self.probe_interval = probe_interval
+        self.state = BreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+
+    @classmethod
+    def get(cls, service: Service) -> Self:
+        """Returns the shared circuit breaker of the service."""
+        if CircuitBreaker.__pid != (pid := current_process().pid):
+            # The breakers of the parent process are not valid anymore
+            CircuitBreaker.__pid = pid
+            cls._breakers.clear()
+
+        try:
+            return cls._breakers[service.NAME]
+        except KeyError:
+            breaker = cls._breakers[service.NAME] = cls(service)
+            return breaker
+
+    def _open(self) -> None:
+        if self.state != BreakerState.OPEN:
+            if self.state == BreakerState.CLOSED:
+                logger.debug(f"Circuit breaker of '{self.alias}' is opened")
+            self.state = BreakerState.OPEN
+        self._opened_at = monotonic()
+
+    def _close(self) -> None:
+        self._failures = 0
+        if self.state != BreakerState.CLOSED:
+            self.state = BreakerState.CLOSED
+            logger.debug(f"Circuit breaker of '{self.alias}' is closed")
+
+    async def call[T](
+        self, function: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any
+    ) -> T:
+        """Calls the service's method if the circuit is not open.
+
+        Raises:
+            The service's timeout error:
+                When the circuit is open or the service's method
+                failed to communicate with the service.
+        """
+        if self.state == BreakerState.HALF_OPEN or (
+            self.state == BreakerState.OPEN
+            and monotonic() - self._opened_at < self.probe_interval
+        ):
+            # Another call is already probing the service
+            raise self.error()
+        elif self.state == BreakerState.OPEN:
+            self.state = BreakerState.HALF_OPEN
+
+        try:
+            result = await function(*args, **kwargs)
+        except self.error:
+            self._failures += 1
+            if self.state == BreakerState.HALF_OPEN or (
+                self._failures >= FAILURE_THRESHOLD
+            ):
+                self._open()
+            raise
+        except Exception:
+            # The service is responded
+            self._close()
+            raise
+        except BaseException:
+            if self.state == BreakerState.HALF_OPEN:
+                # The probe is interrupted and another one is needed
+                self.state = BreakerState.OPEN
+            raise
+        else:
+            self._close()
+            return result
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the service is considered unreachable."""
+        return self.state != BreakerState.CLOSED
@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+from typing import Any
+from pathlib import Path
+
+import orjson
+
+from ..config import config
+from ..utils import convert_time
+
+VERSION = 1
+
+checkpoint_interval = config["main"]["checkpoint_interval"]
+checkpoint_dir = Path(config["database"]["path"]).with_name("checkpoint")
+cluster_node = config["main"]["cluster_node"]
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    The file that persists a part of the runtime
+    state to be restored after restarting the app.
+
+    The file is replaced atomically on each save, so a crash
+    while saving leaves the previous checkpoint intact.
+
+    Attributes:
+        `name`:
+            The file name inside the checkpoints directory.
+            It's prefixed with the node's name within a cluster.
+        `ENABLED`:
+            Whether the checkpoints are enabled.
+    """
+
+    ENABLED = checkpoint_interval > 0
+
+    def __init__(self, name: str) -> None:
+        self.name = f"{cluster_node}.{name}" if cluster_node else name
+        self.path = checkpoint_dir.joinpath(self.name)
+
+    def save(self, data: dict[str, Any]) -> None:
+        """Atomically replaces the checkpoint with the passed data."""
+        if not (directory := self.path.parent).exists():
+            directory.mkdir(parents=True, exist_ok=True)
+
+        temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(temp_path, "wb") as file:
+            file.write(
+                orjson.dumps(
+                    {"version": VERSION, "time": time.time(), "data": data},
+                    option=orjson.OPT_NON_STR_KEYS,
+                )
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, self.path)
+
+    def load(self) -> dict[str, Any] | None:
+        """
+        Returns the data of the checkpoint or `None` if the checkpoint
+        does not exist or is not readable by the current version.
+        """
+        try:
+            checkpoint = orjson.loads(self.path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as error:
+            logger.warning(f"Ignoring the '{self.name}' checkpoint due to {error!r}")
+            return None
+
+        if checkpoint.get("version") != VERSION:
+            logger.warning(f"Ignoring the '{self.name}' checkpoint of another version")
+            return None
+
+        logger.debug(
+            f"Loaded the '{self.name}' checkpoint that was saved"
+            f" '{convert_time(max(time.time() - checkpoint['time'], 0))}' ago"
+        )
+        return checkpoint["data"]
@@ -0,0 +1,146 @@
+import os
+import logging
+from pathlib import Path
+from typing import NamedTuple
+
+import orjson
+
+from ..config import config
+
+journal_dir = Path(config["database"]["path"]).with_name("journal")
+cluster_node = config["main"]["cluster_node"]
+logger = logging.getLogger(__name__)
+
+
+class JournalRecord(NamedTuple):
+    sequence: int
+    usages: list[tuple[str, int, int, int, int]]
+
+
+class TrafficJournal:
+    """
+    The append-only journal of the traffic usages
+    that are not stored on the database yet.
+
+    Each record is flushed to the disk before the traffic usage
+    is stored on the database and the database records the sequence
+    of the last stored record in the same transaction. Therefore,
+    replaying the journal after a crash only stores the missed
+    records and each record is stored exactly once.
+    The journal is truncated whenever all its records are stored.
+
+    Attributes:
+        `name`:
+            The file name inside the journals directory.
+            It's prefixed with the node's name within a cluster
+            since the database records the sequence by the name.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = f"{cluster_node}.{name}" if cluster_node else name
+        self.path = journal_dir.joinpath(self.name)
+        self._file = None
+        self._sequence = 0
+        self._pending: list[JournalRecord] = []
+
+    @staticmethod
+    def find(name: str) -> list[str]:
+        """
+        Returns the names of the existing journals of the node that
+        are named as the passed name or suffixed with a shard number.
+        """
+        prefix = f"{cluster_node}." if cluster_node else ""
+        return [
+            path.name.removeprefix(prefix)
+            for path in journal_dir.glob(f"{prefix}{name}*")
+            if (suffix := path.name.removeprefix(f"{prefix}{name}")) == ""
+            or (suffix.startswith(".") and suffix[1:].isdigit())
+        ]
+
+    @property
+    def sequence(self) -> int:
+        """The sequence of the last appended record."""
+        return self._sequence
+
+    @property
+    def pending(self) -> list[JournalRecord]:
+        """The records that are not stored on the database yet."""
+        return self._pending
+
+    def _read(self) -> tuple[list[JournalRecord], int]:
+        """Returns the intact records and their size in bytes."""
+        records = []
+        size = 0
+        try:
+            with open(self.path, "rb") as file:
+                for line in file:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError()
+                        records.append(JournalRecord(*orjson.loads(line)))
+                    except (ValueError, TypeError):
+                        # The record that is partially written on a crash
+                        logger.warning(
+                            f"Ignoring the torn '{self.name}' journal record"
+                        )
+                        break
+                    size += len(line)
+        except FileNotFoundError:
+            pass
+
+        return records, size
+
+    def open(self, stored_sequence: int) -> list[JournalRecord]:
+        """
+        Opens the journal for appending the records.
+
+        Args:
+            `stored_sequence`:
+                The sequence of the last record that is stored on the database.
+
+        Returns:
+            The records that are not stored on the database yet
+            and should be replayed.
+        """
+        if not (directory := self.path.parent).exists():
+            directory.mkdir(parents=True, exist_ok=True)
+
+        records, size = self._read()
+        self._pending = [
+            record for record in records if record.sequence > stored_sequence
+        ]
+        self._sequence = max(stored_sequence, records[-1].sequence if records else 0)
+        self._file = open(self.path, "ab")
+        self._file.truncate(size if self._pending else 0)
+        return self._pending
+
+    def append(self, usages: list[tuple[str, int, int, int, int]]) -> JournalRecord:
+        """Durably appends the traffic usages to the journal."""
+        self._sequence += 1
+        record = JournalRecord(self._sequence, usages)
+        self._file.write(orjson.dumps([record.sequence, record.usages]) + b"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending.append(record)
+        return record
+
+    def commit(self, sequence: int) -> None:
+        """
+        Marks the records up to the passed sequence as stored on the database.
+        The stored records do not need to be removed durably.
+        """
+        self._pending = [
+            record for record in self._pending if record.sequence > sequence
+        ]
+        if not self._pending:
+            self._file.truncate(0)
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """Closes and removes the journal."""
+        self.close()
+        self.path.unlink(missing_ok=True)
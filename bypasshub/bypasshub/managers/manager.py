@@ -1,27 +1,51 @@
 import asyncio
 import logging
+import functools
+from time import perf_counter
 from threading import Lock
-from contextlib import suppress
-from typing import Self, Optional
+from typing import Any, NamedTuple, Self, Optional
 from datetime import datetime, timedelta
 from multiprocessing import current_process
-from collections.abc import Iterable
+from collections.abc import Awaitable, Callable, Iterable
+from contextlib import suppress
 
 from .xray import Xray
 from .users import Users
 from .state import State
+from .actor import StateRequest, execute
+from .snapshot import StateSnapshot
+from .checkpoint import Checkpoint
+from .breaker import CircuitBreaker
 from .openconnect import OpenConnect
 from .. import errors
-from ..utils import gather
+from ..utils import gather, get_hash_index, send_datagram
 from ..config import config
-from ..constants import ServiceState, ManagerReason
-from ..types import Credentials, ManagerState, Service
+from ..constants import ServiceState, ManagerReason, OperationAction, StateCommand
+from ..types import (
+    Credentials,
+    ManagerState,
+    Service,
+    Reconciliation,
+    ServiceReconciliation,
+)
+
+BATCH_SIZE = 256
+NOTIFY_BATCH_SIZE = 256
+LOCK_STRIPES = 256
+RETRY_CONCURRENCY = 4
+STATE_CHECKPOINT = "state"
 
 manage_xray = config["main"]["manage_xray"]
 manage_ocserv = config["main"]["manage_ocserv"]
+service_concurrency = config["main"]["service_concurrency"]
+sync_events_socket_path = config["main"]["sync_events_socket_path"]
 logger = logging.getLogger(__name__)
 
 
+class SyncAction(NamedTuple):
+    method: Callable[[], Awaitable[None]] | None
+
+
 class Manager(Users, State[ManagerState]):
     """The interface to manage the users on the services and database.
 
@@ -38,7 +62,8 @@ class Manager(Users, State[ManagerState]):
     """
 
     __pid = None
-    _async_locks = {}
+    _async_locks: list[asyncio.Lock] = []
+    _process_locks: list[Lock] = []
 
     def __init__(self, *, skip_retry: bool | None = None) -> None:
         super().__init__()
@@ -56,12 +81,23 @@ class Manager(Users, State[ManagerState]):
         if not self._services:
             raise RuntimeError("No service is enabled for managing")
 
+        # Limiting the concurrent communications with each service
+        self._semaphores = {
+            service.NAME: asyncio.Semaphore(service_concurrency)
+            for service in self._services
+        }
+
         if Manager.__pid != (pid := current_process().pid):
             Manager.__pid = pid
             if len(Manager._async_locks):
                 # Parent processes forked this process.
                 # Previous values should be ignored.
                 Manager._async_locks.clear()
+                Manager._process_locks.clear()
+
+        # The users' state is read from the snapshot when it's available
+        # and is published to it when the state is modified by this process
+        self._snapshot = StateSnapshot()
 
         State.__init__(self, __name__)
         super().connect(skip_retry=self._skip_retry)
@@ -81,80 +117,258 @@ class Manager(Users, State[ManagerState]):
         # process lock is needed to be acquired. Otherwise, without an
         # asynchronous lock, the acquired process lock will never release
         # and all the involved processes hang forever due to deadlocks.
-        username = None
+        # The users are mapped to a fixed count of the lock stripes
+        # to not allocate the locks in proportion to the users count.
+        with self._access_state():
+            if self._channel:
+                if self._request(StateRequest(StateCommand.INITIALIZE))[0]:
+                    self._bootstrap_state(safe=True)
+            else:
+                with self._global_lock:
+                    if not self._state:
+                        self._state = self._dict()
+                        self._state["reasons"] = self._dict()
+                        self._state["users"] = self._dict()
+                        self._state["locks"] = [
+                            self._lock() for _ in range(LOCK_STRIPES)
+                        ]
+                        self._bootstrap_state()
+
+            if not Manager._process_locks:
+                Manager._process_locks.extend(
+                    [self._channel.lock(stripe) for stripe in range(LOCK_STRIPES)]
+                    if self._channel
+                    else self._state["locks"]
+                )
+
+        if not Manager._async_locks:
+            Manager._async_locks.extend(asyncio.Lock() for _ in range(LOCK_STRIPES))
+
+    def _request(self, *requests: StateRequest) -> list[Any]:
+        """
+        Executes the requests on the state and returns their results.
+        The requests are sent to the state actor in a single round trip.
+
+        Should be used inside the ``self._access_state()``
+        context manager block.
+        """
+        if self._channel:
+            return self._channel.request(requests)
+
+        # The users' state is read and written back as a whole,
+        # so the requests of all the processes are serialized
+        with self._global_lock:
+            return [
+                execute(self._state, request, self._snapshot) for request in requests
+            ]
+
+    def _bootstrap_state(self, safe: bool | None = None) -> None:
+        """
+        Populates the state with all the users of the database.
+        The users' plans are evaluated in a single pass over the
+        database and the users are added to the state at once.
+
+        The state is restored from the checkpoint when it's available.
+        """
+        start_time = perf_counter()
+        active_plans = self._get_active_plans()
+        query_time = perf_counter()
+        if not self._restore_state(active_plans, safe):
+            self._add_user_state(active_plans, synced=True, safe=safe)
+        end_time = perf_counter()
+        logger.debug(
+            f"Loaded the state of {len(active_plans)} users"
+            f" in {end_time - start_time:.3f}s (evaluating the plans:"
+            f" {query_time - start_time:.3f}s, populating the state:"
+            f" {end_time - query_time:.3f}s)"
+        )
+
+    def _restore_state(
+        self, active_plans: dict[str, bool], safe: bool | None = None
+    ) -> bool:
+        """
+        Restores the state from the checkpoint and records the users
+        that are modified on the database since the checkpoint is saved.
+
+        The modified users keep their recorded state to get synchronized
+        with the services by the monitor procedure on the startup.
+
+        Args:
+            `active_plans`:
+                Whether each user currently has an active plan.
+
+        Returns:
+            Whether the state is restored.
+        """
+        if not Checkpoint.ENABLED or not (
+            checkpoint := Checkpoint(STATE_CHECKPOINT).load()
+        ):
+            return False
+
+        service_names = [service.NAME for service in self._services]
+        if checkpoint["services"] != service_names:
+            logger.info("Ignoring the state checkpoint of other managed services")
+            return False
+
+        recorded_users = {
+            username: {
+                "synced": user["synced"],
+                "has_active_plan": user["has_active_plan"],
+                "services": {
+                    name: ServiceState(state)
+                    for name, state in user["services"].items()
+                },
+            }
+            for username, user in checkpoint["users"].items()
+        }
+        users = {}
+        changes = []
+        for username, has_active_plan in active_plans.items():
+            if (user := recorded_users.pop(username, None)) is None:
+                # User is added
+                user = {
+                    "synced": False,
+                    "has_active_plan": has_active_plan,
+                    "services": dict.fromkeys(service_names, ServiceState.UNKNOWN),
+                }
+                changes.append(username)
+            elif not user["synced"] or user["has_active_plan"] != has_active_plan:
+                changes.append(username)
+            users[username] = user
+
+        for username, user in recorded_users.items():
+            # User is deleted and may still exist on the services
+            if any(
+                state != ServiceState.DELETED for state in user["services"].values()
+            ):
+                users[username] = user
+                changes.append(username)
+
+        request = StateRequest(
+            StateCommand.RESTORE_USERS,
+            (
+                users,
+                {
+                    username: ManagerReason(reason)
+                    for username, reason in checkpoint["reasons"].items()
+                },
+                changes,
+                bool(safe),
+            ),
+        )
+        self._request(request)
+
+        logger.info(
+            f"Restored the state of {len(users)} users from the checkpoint"
+            f" ({len(changes)} users are modified since then)"
+        )
+        return True
+
+    def _pop_restored_changes(self) -> list[str]:
+        """
+        Returns the users that are modified since the restored
+        checkpoint is saved. The users are only returned once.
+        """
+        with self._access_state():
+            return self._request(StateRequest(StateCommand.POP_RESTORED_CHANGES))[0]
+
+    def _save_state(self) -> None:
+        """Saves the state to the checkpoint."""
         with self._access_state():
-            with self._global_lock:
-                if not self._state:
-                    self._state = self._dict()
-                    self._state["reasons"] = self._dict()
-                    self._state["users"] = self._dict()
-                    self._add_user_state((username := self.usernames), synced=True)
+            ((users, reasons),) = self._request(StateRequest(StateCommand.DUMP_USERS))
 
-        if not (async_locks := Manager._async_locks):
-            for username in username or self.usernames:
-                async_locks[username] = asyncio.Lock()
+        Checkpoint(STATE_CHECKPOINT).save(
+            {
+                "services": [service.NAME for service in self._services],
+                "users": users,
+                "reasons": reasons,
+            }
+        )
 
     def _add_user_state(
         self,
-        usernames: Iterable[str],
+        active_plans: dict[str, bool],
         service_state: ServiceState | None = None,
         synced: bool | None = None,
         safe: bool | None = None,
     ) -> None:
-        synced = bool(synced)
-        users = self._state["users"]
-        dict = self._dict
-        lock = self._lock
-        global_lock = self._global_lock
-        async_locks = Manager._async_locks
-        service_names = [service.NAME for service in self._services]
-        for username in usernames:
-            async_locks[username] = asyncio.Lock()
-            has_active_plan = self.has_active_plan(username)
-            _service_state = (
-                service_state
-                if service_state is not None
-                else (ServiceState.ADDED if has_active_plan else ServiceState.DELETED)
+        """
+        Adds the users to the state in a single request.
+
+        Args:
+            `active_plans`:
+                Whether each user has an active plan.
+        """
+        request = StateRequest(
+            StateCommand.ADD_USERS,
+            (
+                active_plans,
+                [service.NAME for service in self._services],
+                service_state,
+                bool(synced),
+                bool(safe),
+            ),
+        )
+        self._request(request)
+
+    def _has_user_states(self, usernames: list[str]) -> list[bool]:
+        """
+        Whether each user exists in the state.
+
+        Should be used inside the ``self._access_state()``
+        context manager block.
+        """
+        with suppress(OSError):
+            return [self._snapshot.get(username) is not None for username in usernames]
+
+        return self._request(
+            *(
+                StateRequest(StateCommand.HAS_USER, (username,))
+                for username in usernames
             )
+        )
 
-            try:
-                # Preventing the other processes to replace the state
-                if safe and not global_lock.acquire(blocking=False):
-                    global_lock.acquire()
-                    if username in users:
-                        continue
+    def _has_user_state(self, username: str) -> bool:
+        return self._has_user_states([username])[0]
 
-                users[username] = dict(
-                    {
-                        "lock": lock(),
-                        "synced": synced,
-                        "has_active_plan": has_active_plan,
-                        "services": dict(
-                            {name: _service_state for name in service_names}
-                        ),
-                    }
-                )
-            finally:
-                safe and global_lock.release()
+    def _get_service_state(self, service: Service, username: str) -> ServiceState:
+        """
+        Returns the user's state on the service.
+
+        Should be used inside the ``self._access_state()``
+        context manager block.
+
+        Raises:
+            `KeyError`: When the user does not exist in the state.
+        """
+        with suppress(OSError):
+            if (user := self._snapshot.get(username)) is None:
+                raise KeyError(username)
+            return user.services[service.NAME]
+
+        return self._request(
+            StateRequest(StateCommand.GET_SERVICE_STATE, (username, service.NAME))
+        )[0]
+
+    @staticmethod
+    def _get_lock_stripe(username: str) -> int:
+        """Returns the index of the locks that the user is mapped to."""
+        return get_hash_index(username, LOCK_STRIPES)
 
     def _get_process_lock(
         self, username: str, silent: bool | None = None
     ) -> Optional[Lock]:
         with self._access_state(silent):
-            users = self._state["users"]
-            if username not in users:
+            if not self._has_user_state(username):
                 self._add_user_state(
-                    (username,), service_state=ServiceState.UNKNOWN, safe=True
+                    {username: self.has_active_plan(username)},
+                    service_state=ServiceState.UNKNOWN,
+                    safe=True,
                 )
-            return users[username]["lock"]
+            return Manager._process_locks[self._get_lock_stripe(username)]
 
     def _get_async_lock(self, username: str) -> asyncio.Lock:
-        async_locks = Manager._async_locks
-        try:
-            return async_locks[username]
-        except KeyError:
-            lock = async_locks[username] = asyncio.Lock()
-            return lock
+        return Manager._async_locks[self._get_lock_stripe(username)]
 
     async def _add_user_by_service(
         self,
@@ -167,20 +381,23 @@ class Manager(Users, State[ManagerState]):
     ) -> None:
         with self._access_state(silent):
             if (
-                self._state["users"][username]["services"][service.NAME]
-                == ServiceState.ADDED
-            ):
+                previous_state := self._get_service_state(service, username)
+            ) == ServiceState.ADDED:
                 return
 
         modify_state = None
         try:
-            await service.add_user(username, uuid)
+            async with self._semaphores[service.NAME]:
+                await CircuitBreaker.get(service).call(service.add_user, username, uuid)
         except errors.UserExistError:
             modify_state = True
             if not no_existence_log:
                 logger.debug(
                     f"Tried to add existent user '{username}' to '{service.ALIAS}'"
                 )
+        except Exception:
+            self._defer_operation(service, username, OperationAction.ADD, silent)
+            raise
         else:
             modify_state = True
             if reason:
@@ -189,10 +406,12 @@ class Manager(Users, State[ManagerState]):
                 )
         finally:
             if modify_state:
+                # Only the users with an unknown state may have a pending
+                # operation on the service which is outdated by now
+                if previous_state == ServiceState.UNKNOWN:
+                    self._dequeue_operations(service.NAME, (username,))
                 with self._access_state(silent):
-                    self._state["users"][username]["services"][
-                        service.NAME
-                    ] = ServiceState.ADDED
+                    self._set_service_states(service, {username: ServiceState.ADDED})
 
     async def _delete_user_by_service(
         self,
@@ -204,14 +423,14 @@ class Manager(Users, State[ManagerState]):
     ) -> None:
         with self._access_state(silent):
             if (
-                self._state["users"][username]["services"][service.NAME]
-                == ServiceState.DELETED
-            ):
+                previous_state := self._get_service_state(service, username)
+            ) == ServiceState.DELETED:
                 return
 
         modify_state = None
         try:
-            await service.delete_user(username)
+            async with self._semaphores[service.NAME]:
+                await CircuitBreaker.get(service).call(service.delete_user, username)
         except errors.UserNotExistError:
             modify_state = True
             if not no_existence_log:
@@ -219,6 +438,9 @@ class Manager(Users, State[ManagerState]):
                     f"Tried to remove non-existent user '{username}'"
                     f" from '{service.ALIAS}'"
                 )
+        except Exception:
+            self._defer_operation(service, username, OperationAction.DELETE, silent)
+            raise
         else:
             modify_state = True
             if reason:
@@ -227,10 +449,294 @@ class Manager(Users, State[ManagerState]):
                 )
         finally:
             if modify_state:
+                # Only the users with an unknown state may have a pending
+                # operation on the service which is outdated by now
+                if previous_state == ServiceState.UNKNOWN:
+                    self._dequeue_operations(service.NAME, (username,))
                 with self._access_state(silent):
-                    self._state["users"][username]["services"][
-                        service.NAME
-                    ] = ServiceState.DELETED
+                    self._set_service_states(service, {username: ServiceState.DELETED})
+
+    def _defer_operation(
+        self,
+        service: Service,
+        username: str,
+        action: OperationAction,
+        silent: bool | None = None,
+    ) -> None:
+        """
+        Queues the operation that is failed to be reflected to the service
+        for being retried later by the ``self._retry_operations()`` method.
+        """
+        self._enqueue_operation(username, service.NAME, action)
+        with self._access_state(silent):
+            # The user may or may not be reflected to the service
+            self._set_service_states(service, {username: ServiceState.UNKNOWN})
+
+    def _set_service_states(
+        self, service: Service, service_states: dict[str, ServiceState]
+    ) -> None:
+        """
+        Records the users' states on the service.
+        The users that do not exist in the state are skipped.
+        """
+        self._request(
+            StateRequest(
+                StateCommand.SET_SERVICE_STATES, (service.NAME, service_states)
+            )
+        )
+
+    async def _record_service_states(
+        self,
+        service: Service,
+        service_states: dict[str, ServiceState],
+        reflected: set[str],
+    ) -> None:
+        """
+        Records the users' states on the service after their operations
+        are reflected to the service without holding the users' locks.
+
+        Each user is only locked while its state is recorded. The state is
+        only recorded for the reflected users which do not have a pending
+        operation on the service anymore. The other operations of the users
+        that are finished in the meantime may be overridden on the service,
+        so they are deferred to be reflected again.
+        """
+        for username, service_state in service_states.items():
+            async with self._get_async_lock(username):
+                with self._access_state():
+                    if not self._has_user_state(username):
+                        continue
+
+                    with Manager._process_locks[self._get_lock_stripe(username)]:
+                        current_state = self._get_service_state(service, username)
+                        if current_state not in (ServiceState.UNKNOWN, service_state):
+                            self._defer_operation(
+                                service,
+                                username,
+                                (
+                                    OperationAction.ADD
+                                    if current_state == ServiceState.ADDED
+                                    else OperationAction.DELETE
+                                ),
+                            )
+                        elif username in reflected:
+                            self._set_service_states(service, {username: service_state})
+
+    async def _retry_batch(self, service: Service, usernames: list[str]) -> None:
+        """
+        Retries the pending operations of the users on the service in bulk.
+        The operations that are changed in the meantime are retried later.
+        """
+        operations = self._get_pending_operations(service.NAME, usernames)
+        failures = {}
+        try:
+            if deleting := [
+                operation["username"]
+                for operation in operations
+                if operation["action"] == OperationAction.DELETE
+            ]:
+                failures |= await CircuitBreaker.get(service).call(
+                    service.delete_users, deleting
+                )
+            if adding := [
+                {"username": operation["username"], "uuid": operation["uuid"]}
+                for operation in operations
+                if operation["action"] == OperationAction.ADD
+                # The user is deleted from the database in the meantime
+                and operation["uuid"] is not None
+            ]:
+                failures |= await CircuitBreaker.get(service).call(
+                    service.add_users, adding
+                )
+        except Exception:
+            self._postpone_operations(operations)
+            raise
+
+        failed = []
+        reflected = {OperationAction.ADD: [], OperationAction.DELETE: []}
+        service_states = {}
+        for operation in operations:
+            username = operation["username"]
+            if (error := failures.get(username)) and not isinstance(
+                error, (errors.UserExistError, errors.UserNotExistError)
+            ):
+                failed.append(operation)
+                continue
+
+            reflected[operation["action"]].append(username)
+            if operation["action"] == OperationAction.DELETE:
+                service_states[username] = ServiceState.DELETED
+            elif operation["uuid"] is not None:
+                service_states[username] = ServiceState.ADDED
+
+        self._postpone_operations(failed)
+        dequeued = set()
+        for action, _usernames in reflected.items():
+            # The operations of the other action are queued in the meantime
+            dequeued |= self._dequeue_operations(service.NAME, _usernames, action)
+        await self._record_service_states(service, service_states, dequeued)
+
+        if dequeued:
+            logger.debug(
+                f"Retried {len(dequeued)} pending operations on '{service.ALIAS}'"
+            )
+
+    async def _retry_operations(self) -> None:
+        """
+        Retries the pending operations that are due in batches with a bounded
+        concurrency. The operations of the services that are considered
+        unreachable are skipped until the services are reachable again.
+        """
+        services = {service.NAME: service for service in self._services}
+        pending = {}
+        for operation in self._get_pending_operations():
+            pending.setdefault(operation["service"], []).append(operation["username"])
+
+        batches = []
+        for name, usernames in pending.items():
+            if (service := services.get(name)) is None:
+                # The service is not managed anymore
+                self._dequeue_operations(name, usernames)
+            elif not CircuitBreaker.get(service).is_open:
+                batches.extend(
+                    (service, usernames[index : index + BATCH_SIZE])
+                    for index in range(0, len(usernames), BATCH_SIZE)
+                )
+
+        semaphore = asyncio.Semaphore(RETRY_CONCURRENCY)
+
+        async def retry(service: Service, usernames: list[str]) -> None:
+            async with semaphore:
+                await self._retry_batch(service, usernames)
+
+        if exceptions := (
+            await gather([retry(service, usernames) for service, usernames in batches])
+        )[1]:
+            raise ExceptionGroup(errors.SynchronizationError.GROUP_MESSAGE, exceptions)
+
+    async def _reconcile_batch(
+        self,
+        service: Service,
+        usernames: list[str],
+        actual_users: set[str],
+        active_users: dict[str, str],
+        report: ServiceReconciliation,
+    ) -> None:
+        """
+        Reflects the differences of the passed users to the service.
+        The users that are modified in the meantime are deferred to be
+        reflected again, see ``self._record_service_states()``.
+        """
+        breaker = CircuitBreaker.get(service)
+        # The plans may be changed since the differences are evaluated
+        adding = []
+        deleting = []
+        for username in usernames:
+            try:
+                has_active_plan = self.has_active_plan(username)
+            except errors.UserNotExistError:
+                has_active_plan = False
+
+            if username in actual_users:
+                if not has_active_plan:
+                    deleting.append(username)
+            elif has_active_plan:
+                adding.append({"username": username, "uuid": active_users[username]})
+
+        failures = {}
+        if deleting:
+            failures |= await breaker.call(service.delete_users, deleting)
+        if adding:
+            failures |= await breaker.call(service.add_users, adding)
+
+        service_states = {}
+        for key, action, service_state, _usernames in (
+            ("deleted", OperationAction.DELETE, ServiceState.DELETED, deleting),
+            (
+                "added",
+                OperationAction.ADD,
+                ServiceState.ADDED,
+                [user["username"] for user in adding],
+            ),
+        ):
+            reflected = []
+            for username in _usernames:
+                if (error := failures.get(username)) is None:
+                    report[key].append(username)
+                elif not isinstance(
+                    error, (errors.UserExistError, errors.UserNotExistError)
+                ):
+                    report["failed"].append(username)
+                    continue
+
+                reflected.append(username)
+                service_states[username] = service_state
+
+            self._dequeue_operations(service.NAME, reflected, action)
+
+        # The pending operations of the other action are queued in the meantime
+        pending = self._get_pending_operations(service.NAME, service_states)
+        await self._record_service_states(
+            service,
+            service_states,
+            service_states.keys() - {operation["username"] for operation in pending},
+        )
+
+    async def _reconcile_service(
+        self, service: Service, active_users: dict[str, str]
+    ) -> ServiceReconciliation:
+        """
+        Reflects the differences between the users that actually exist on
+        the service and the users that have an active plan to the service.
+        """
+        start_time = perf_counter()
+        report = {
+            "supported": True,
+            "expected": len(active_users),
+            "actual": 0,
+            "added": [],
+            "deleted": [],
+            "failed": [],
+            "duration": 0,
+        }
+
+        breaker = CircuitBreaker.get(service)
+        if (actual_users := await breaker.call(service.list_users)) is None:
+            # All the expected users are added again instead, which fails
+            # harmlessly for the users that already exist on the service.
+            # The users that should not exist are left to the monitor.
+            report["supported"] = False
+            actual_users = set()
+            logger.debug(f"Listing the users is not supported by '{service.ALIAS}'")
+        else:
+            report["actual"] = len(actual_users)
+
+        differences = sorted(
+            (active_users.keys() - actual_users) | (actual_users - active_users.keys())
+        )
+        for index in range(0, len(differences), BATCH_SIZE):
+            await self._reconcile_batch(
+                service,
+                differences[index : index + BATCH_SIZE],
+                actual_users,
+                active_users,
+                report,
+            )
+
+        report["duration"] = round(perf_counter() - start_time, 3)
+        if report["added"] or report["deleted"] or report["failed"]:
+            logger.info(
+                "Reconciled '{}' with the database in {}s"
+                " ({} added, {} deleted, {} failed)".format(
+                    service.ALIAS,
+                    report["duration"],
+                    len(report["added"]),
+                    len(report["deleted"]),
+                    len(report["failed"]),
+                )
+            )
+
+        return report
 
     async def _add_user(
         self,
@@ -263,11 +769,9 @@ class Manager(Users, State[ManagerState]):
                 )
 
             with self._access_state(silent):
-                user = self._state["users"][username]
-                user["has_active_plan"] = True
-                user["synced"] = True
-                with suppress(KeyError):
-                    del user["reason"]
+                self._request(
+                    StateRequest(StateCommand.SET_ACTIVE_PLAN, (username, True))
+                )
 
         finally:
             if process_lock:
@@ -304,18 +808,11 @@ class Manager(Users, State[ManagerState]):
                 )
 
             with self._access_state(silent):
-                if permanently:
-                    for dic in (
-                        self._state["users"],
-                        self._state["reasons"],
-                        Manager._async_locks,
-                    ):
-                        with suppress(KeyError):
-                            del dic[username]
-                else:
-                    user = self._state["users"][username]
-                    user["has_active_plan"] = False
-                    user["synced"] = True
+                self._request(
+                    StateRequest(StateCommand.DELETE_USERS, ((username,),))
+                    if permanently
+                    else StateRequest(StateCommand.SET_ACTIVE_PLAN, (username, False))
+                )
 
         finally:
             if process_lock:
@@ -323,70 +820,150 @@ class Manager(Users, State[ManagerState]):
                     process_lock.release()
                 async_lock.release()
 
-    async def _sync(self) -> bool:
-        synced = False
-        current_usernames = self.usernames
+    def _get_sync_action(
+        self, username: str, exists: bool | None = None
+    ) -> SyncAction | None:
+        """
+        Determines the action that is needed for
+        synchronizing the user's services with the database.
+        The user's reserved plan gets activated when it's needed.
+
+        Args:
+            `exists`:
+                Whether the user exists in the database.
+                If omitted, it will be checked from the database.
+
+        Returns:
+            The action or `None` if the user is already in sync.
+            The action's method is `None` when only the database is modified.
+        """
+        if exists is None:
+            exists = self._is_exist(username)
+
         with self._access_state():
-            users = self._state["users"]
-            reasons = self._state["reasons"]
+            user, reason = self._request(
+                StateRequest(StateCommand.GET_USER, (username,)),
+                StateRequest(StateCommand.GET_REASON, (username,)),
+            )
+            if not exists:
+                if user is None:
+                    return None
 
-            for username in list(users.keys()):
-                if username not in current_usernames:
-                    # User is deleted
-                    await self._delete_user(
-                        username, ManagerReason.SYNCHRONIZATION, permanently=True
+                # User is deleted
+                return SyncAction(
+                    functools.partial(
+                        self._delete_user,
+                        username,
+                        ManagerReason.SYNCHRONIZATION,
+                        permanently=True,
                     )
-                    synced = True
+                )
 
-            for username in current_usernames:
-                method = args = None
-                has_active_plan = self.has_active_plan(username)
-                user = users.get(username, None)
-                if user and user["synced"]:
-                    # User is existed
-                    had_active_plan = user["has_active_plan"]
-                    if had_active_plan:
-                        if not has_active_plan:
-                            if not self.activate_reserved_plan(username):
-                                method = self._delete_user
-                                args = (ManagerReason.EXPIRED_PLAN,)
-                            else:
-                                synced = True
-                    elif has_active_plan:
-                        method = self._add_user
-                        args = (
-                            self.get_credentials(username)["uuid"],
-                            reasons.get(username, ManagerReason.UPDATED_PLAN),
-                        )
-                    elif self.activate_reserved_plan(username):
-                        reasons[username] = ManagerReason.RESERVED_PLAN
-                        method = self._add_user
-                        args = (
-                            self.get_credentials(username)["uuid"],
-                            ManagerReason.RESERVED_PLAN,
-                        )
-                else:
-                    # User is added
-                    if has_active_plan:
-                        method = self._add_user
-                        args = (
-                            self.get_credentials(username)["uuid"],
-                            reasons.get(username, ManagerReason.SYNCHRONIZATION),
+            method = args = None
+            has_active_plan = self.has_active_plan(username)
+            if user and user["synced"]:
+                # User is existed
+                had_active_plan = user["has_active_plan"]
+                if had_active_plan:
+                    if not has_active_plan:
+                        if not self.activate_reserved_plan(username):
+                            method = self._delete_user
+                            args = (ManagerReason.EXPIRED_PLAN,)
+                        else:
+                            return SyncAction(None)
+                elif has_active_plan:
+                    method = self._add_user
+                    args = (
+                        self.get_credentials(username)["uuid"],
+                        reason or ManagerReason.UPDATED_PLAN,
+                    )
+                elif self.activate_reserved_plan(username):
+                    self._request(
+                        StateRequest(
+                            StateCommand.SET_REASON,
+                            (username, ManagerReason.RESERVED_PLAN),
                         )
-                    elif self.activate_reserved_plan(username):
-                        reasons[username] = ManagerReason.RESERVED_PLAN
-                        method = self._add_user
-                        args = (
-                            self.get_credentials(username)["uuid"],
-                            ManagerReason.RESERVED_PLAN,
+                    )
+                    method = self._add_user
+                    args = (
+                        self.get_credentials(username)["uuid"],
+                        ManagerReason.RESERVED_PLAN,
+                    )
+            else:
+                # User is added
+                if has_active_plan:
+                    method = self._add_user
+                    args = (
+                        self.get_credentials(username)["uuid"],
+                        reason or ManagerReason.SYNCHRONIZATION,
+                    )
+                elif self.activate_reserved_plan(username):
+                    self._request(
+                        StateRequest(
+                            StateCommand.SET_REASON,
+                            (username, ManagerReason.RESERVED_PLAN),
                         )
+                    )
+                    method = self._add_user
+                    args = (
+                        self.get_credentials(username)["uuid"],
+                        ManagerReason.RESERVED_PLAN,
+                    )
+
+        if method:
+            return SyncAction(functools.partial(method, username, *args))
+
+    async def _run_concurrently(
+        self, methods: list[Callable[[], Awaitable[None]]]
+    ) -> list[Exception]:
+        """
+        Runs the passed methods with a pool of workers that
+        is limited by the `service_concurrency` configuration.
+
+        Returns:
+            The exceptions that are raised by the methods.
+        """
+        exceptions = []
+        pending = iter(methods)
+
+        async def worker() -> None:
+            for method in pending:
+                try:
+                    await method()
+                except Exception as error:
+                    exceptions.append(error)
 
-                if method:
-                    await method(username, *args)
-                    synced = True
+        await asyncio.gather(
+            *[worker() for _ in range(min(service_concurrency, len(methods)))]
+        )
+        return exceptions
 
-        if synced:
+    async def _sync(self) -> bool:
+        current_usernames = self.usernames
+        existing_usernames = set(current_usernames)
+        with self._access_state():
+            (usernames,) = self._request(StateRequest(StateCommand.GET_USERNAMES))
+        deleted_usernames = [
+            username for username in usernames if username not in existing_usernames
+        ]
+
+        # Computing the whole actions before reflecting them to the services
+        actions = [
+            action
+            for username, exists in (
+                *((username, False) for username in deleted_usernames),
+                *((username, True) for username in current_usernames),
+            )
+            if (action := self._get_sync_action(username, exists))
+        ]
+        exceptions = await self._run_concurrently(
+            [action.method for action in actions if action.method]
+        )
+
+        if synced := bool(actions):
             self.generate_list()
+        if exceptions:
+            raise ExceptionGroup(errors.SynchronizationError.GROUP_MESSAGE, exceptions)
 
         return synced
 
@@ -617,6 +1194,74 @@ class Manager(Users, State[ManagerState]):
                 "Failed to reflect the database changes to the services", cause=error
             )
 
+    def notify(self, usernames: Iterable[str]) -> bool:
+        """
+        Notifies the monitor procedure that the users are modified
+        on the database to get them synchronized with the services
+        immediately instead of waiting for the next synchronization.
+
+        This method should be called when the database is modified
+        manually or by other external processes.
+
+        Returns:
+            Whether the notification is delivered.
+            If `False` returned, the monitor procedure is not running
+            and the users get synchronized on the next startup.
+
+        Raises:
+            ``errors.InvalidUsernameError``:
+                When any of the usernames contains illegal characters or length.
+        """
+        usernames = [self.validate_username(username) for username in usernames]
+        return all(
+            send_datagram(
+                sync_events_socket_path,
+                "\n".join(usernames[index : index + NOTIFY_BATCH_SIZE]).encode(),
+            )
+            for index in range(0, len(usernames), NOTIFY_BATCH_SIZE)
+        )
+
+    async def reconcile(self) -> Reconciliation:
+        """Reconciles the services with the database.
+
+        Unlike the ``self.sync()`` method which relies on the recorded
+        state of the users, the users that actually exist on the services
+        are compared with the users that have an active plan on the database
+        and only the differences are reflected to the services in bulk.
+        The users that have an active plan are added again in bulk to the
+        services that do not support listing their users (e.g. `Xray-core`
+        before the version which has the `GetInboundUsers` command).
+
+        Returns:
+            The summary of the differences and timings for each service.
+
+        Raises:
+            ``errors.SynchronizationError``:
+                When failed to reconcile the services with the database.
+        """
+        start_time = perf_counter()
+        active_users = self._get_active_credentials()
+        reports, exceptions = await gather(
+            [
+                self._reconcile_service(service, active_users)
+                for service in self._services
+            ]
+        )
+        if exceptions:
+            raise errors.SynchronizationError(
+                "Failed to reconcile the services with the database",
+                cause=ExceptionGroup(
+                    errors.SynchronizationError.GROUP_MESSAGE, exceptions
+                ),
+            )
+
+        return {
+            "services": {
+                service.NAME: report for service, report in zip(self._services, reports)
+            },
+            "duration": round(perf_counter() - start_time, 3),
+        }
+
     async def close(self) -> None:
         """Closes the connections to the services and database."""
         for service in self._services:
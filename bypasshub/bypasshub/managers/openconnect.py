@@ -1,21 +1,32 @@
+import os
 import asyncio
 import logging
-from typing import Any
+from typing import Any, Self
 from pathlib import Path
 from contextlib import suppress
+from collections.abc import Callable, Iterable
 
 import orjson
 
 from .base import BaseService
+from .passwd import Passwd
 from .. import errors
-from ..types import Traffic
+from ..types import Traffic, Credentials
 from ..config import config
+from ..utils import listen_datagram, send_datagram
 from ..constants import OpenConnectService
 
 RETRY_DELAY = 0.01  # seconds
+RETRY_MAX_DELAY = 0.5  # seconds
+BATCH_SIZE = 256
+READ_CHUNK_SIZE = 65536  # bytes
+SESSIONS_EVENT = "sessions"
+SESSIONS_CHUNK_SIZE = 60000  # bytes, fits the received datagrams
 
 timeout = config["main"]["service_timeout"]
 broker_socket_path = Path(config["main"]["occtl_broker_socket_path"])
+events_socket_path = Path(config["main"]["ocserv_events_socket_path"])
+idle_steps = config["main"]["monitor_ocserv_idle_steps"]
 logger = logging.getLogger(__name__)
 
 
@@ -35,6 +46,7 @@ class OpenConnect(BaseService):
 
     NAME = OpenConnectService.NAME
     ALIAS = OpenConnectService.ALIAS
+    TIMEOUT_ERROR = errors.OpenConnectTimeoutError
 
     def __init__(self, timeout: int | float = timeout) -> None:
         self.timeout = timeout
@@ -43,51 +55,225 @@ class OpenConnect(BaseService):
 
         self._last_boot = None
         self._traffic_loaded = None
-        self._traffic = {}
+        self._sessions: dict[int, list[str | int]] = {}
+        self._closed_sessions: set[int] = set()
+        self._closed_traffic: dict[str, Traffic] = {}
+        self._has_new_session = None
+        self._idle_polls = 0
+        self._reload_pending = None
+        self._stop_listening = None
+        self._forwarded = None
+        self._forwarded_chunks: list[bytes] | None = None
+        self._forwarded_sessions: tuple[int, list[dict[str, str | int]]] | None = None
+        self._passwd = Passwd()
 
-    async def _exec(self, command: str) -> Any:
-        """Communicates with the `OpenConnect` message broker script."""
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._receiver: asyncio.Task | None = None
+        self._connecting: asyncio.Lock | None = None
+        self._pending: dict[
+            int, tuple[asyncio.Future, Callable[[bytes], None] | None]
+        ] = {}
+        self._request_id = 0
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exception) -> None:
+        await self.close()
+
+    async def _connect(self) -> None:
+        """
+        Establishes the persistent connection to the `OpenConnect`
+        message broker script if it's not already established.
+
+        The connection attempts are retried with an exponential
+        backoff delay until the surrounding timeout is expired.
+        """
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+
+        async with self._connecting:
+            if self._writer is not None:
+                return
+
+            delay = RETRY_DELAY
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(
+                        broker_socket_path
+                    )
+                except errors.UNIX_SOCKET_FAILURE:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RETRY_MAX_DELAY)
+                else:
+                    break
+
+            self._reader = reader
+            self._writer = writer
+            self._receiver = asyncio.create_task(
+                self._receive(reader), name=f"{self.NAME}_broker_receiver"
+            )
+
+    def _disconnect(self) -> None:
+        """
+        Drops the connection and fails the
+        requests that are waiting for a response.
+        """
+        if (writer := self._writer) is not None:
+            self._reader = self._writer = None
+            writer.close()
+
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(errors.OpenConnectTimeoutError())
+        self._pending.clear()
+
+    async def _receive(self, reader: asyncio.StreamReader) -> None:
+        """Reads the framed responses and resolves the related requests."""
         try:
-            async with asyncio.Timeout(
-                asyncio.get_running_loop().time() + self.timeout
-            ):
-                reader = writer = None
-                while True:
-                    try:
-                        reader, writer = await asyncio.open_unix_connection(
-                            broker_socket_path
-                        )
-                    except errors.UNIX_SOCKET_FAILURE:
-                        await asyncio.sleep(RETRY_DELAY)
-                    else:
-                        break
-
-                writer.write(command.encode())
-                writer.write_eof()
+            while header := await reader.readline():
+                id, exit_code, length = header.split()
+                length = int(length)
+                future, parse = self._pending.pop(int(id), (None, None))
+                if parse is None:
+                    output = await reader.readexactly(length)
+                else:
+                    # Parsing the output line by line as it arrives
+                    # instead of buffering the whole output
+                    output = b""
+                    buffer = b""
+                    while length:
+                        chunk = await reader.read(min(length, READ_CHUNK_SIZE))
+                        if not chunk:
+                            raise asyncio.IncompleteReadError(buffer, length)
+                        length -= len(chunk)
+                        *lines, buffer = (buffer + chunk).split(b"\n")
+                        for line in lines:
+                            parse(line)
+                    if buffer:
+                        parse(buffer)
+
+                if future and not future.done():
+                    future.set_result((int(exit_code), output))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            if self._reader is reader:
+                self._disconnect()
+
+    async def _request(
+        self, command: str, parse: Callable[[bytes], None] | None = None
+    ) -> tuple[int, bytes]:
+        """
+        Sends the command to the `OpenConnect` message broker script
+        through the persistent connection and waits for its response.
+
+        Args:
+            `parse`:
+                If provided, the output is passed line by line to this
+                function as it's received and an empty output is returned.
 
+        Returns:
+            The command's exit code and output.
+        """
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self._connect()
+
+                self._request_id += 1
+                id = self._request_id
+                future = asyncio.get_running_loop().create_future()
+                self._pending[id] = (future, parse)
                 try:
-                    await writer.drain()
-                except ConnectionResetError:
+                    self._writer.write(f"{id} {command}\n".encode())
+                    await self._writer.drain()
+                    return await future
+                except ConnectionError:
+                    self._disconnect()
                     raise errors.OpenConnectTimeoutError()
-                else:
-                    # The first byte is the exit code
-                    if (exit_code := await reader.read(1)) == b"":
-                        raise errors.OpenConnectTimeoutError()
-                    elif (exit_code := int(exit_code)) == 0:
-                        if output := (await reader.read()):
-                            return orjson.loads(output)
-                    elif exit_code == 3:
-                        raise errors.UserExistError()
-                    elif exit_code == 4:
-                        raise errors.UserNotExistError()
                 finally:
-                    writer.close()
-                    with suppress(BrokenPipeError):
-                        await writer.wait_closed()
+                    self._pending.pop(id, None)
         except TimeoutError:
             raise errors.OpenConnectTimeoutError()
 
-    async def _is_restarted(self) -> bool | None:
+    async def _exec(self, command: str) -> Any:
+        """
+        Communicates with the `OpenConnect` message broker script.
+
+        Raises:
+            ``errors.OpenConnectCommandError``:
+                When the message broker script failed to run the command.
+        """
+        exit_code, output = await self._request(command)
+        if exit_code != 0:
+            raise errors.OpenConnectCommandError(command)
+        elif output:
+            return orjson.loads(output)
+
+    async def _exec_sessions(self, command: str) -> list[dict[str, str | int]]:
+        """
+        Lists the sessions with only the fields that are
+        needed for tracking the traffic usage.
+
+        The output is parsed incrementally as it's received
+        from the `OpenConnect` message broker script.
+
+        Raises:
+            ``errors.OpenConnectCommandError``:
+                When the message broker script failed to run the command.
+        """
+        sessions = []
+        session = None
+
+        def parse(line: bytes) -> None:
+            nonlocal session
+            key, _, value = line.decode().partition(" ")
+            if key == "ID":
+                if value.isdigit():
+                    session = {"ID": int(value)}
+                    sessions.append(session)
+                else:
+                    session = None
+            elif session is not None:
+                session[key] = value
+
+        exit_code, _ = await self._request(command, parse)
+        if exit_code != 0:
+            raise errors.OpenConnectCommandError(command)
+
+        return sessions
+
+    async def _exec_batch(self, command: str, arguments: list[str]) -> None:
+        """
+        Runs the batched version of a command for all the passed arguments
+        with the minimum possible requests to the message broker script.
+
+        Raises:
+            ``errors.OpenConnectCommandError``:
+                When the message broker script failed to run the command.
+        """
+        # The requests are pipelined through the same connection
+        for exit_code, _ in await asyncio.gather(*[
+            self._request(
+                f"{command} {' '.join(arguments[index : index + BATCH_SIZE])}"
+            )
+            for index in range(0, len(arguments), BATCH_SIZE)
+        ]):
+            if exit_code != 0:
+                raise errors.OpenConnectCommandError(command)
+
+    async def _reload(self) -> None:
+        """
+        Reloads the password file on the `OpenConnect` server.
+        The failed reload is performed again on the next modification
+        even if the password file is not changed anymore by then.
+        """
+        self._reload_pending = True
+        await self._exec("reload")
+        self._reload_pending = False
+
+    async def _is_restarted(self, current_boot: int | None = None) -> bool | None:
         """
         Whether the `OpenConnect` VPN server is
         restarted since the last time this method was called.
@@ -95,9 +281,15 @@ class OpenConnect(BaseService):
         For the very first time this method is executed, `None`
         will be returned because there is no way to determine
         whether this service is restarted before or not.
+
+        Args:
+            `current_boot`:
+                The start time of the server if it's already known.
+                Otherwise, it's requested from the server.
         """
-        if status := await self._exec("show_status"):
+        if current_boot is None and (status := await self._exec("show_status")):
             current_boot = status["raw_up_since"]
+        if current_boot is not None:
             if self._last_boot is None:
                 self._last_boot = current_boot
                 return None
@@ -107,91 +299,382 @@ class OpenConnect(BaseService):
 
             return False
 
+    def _handle_event(self, event: bytes) -> None:
+        """
+        Handles the session event which is
+        reported by the connect/disconnect hook script.
+
+        The event is in `REASON ID USERNAME UPLINK DOWNLINK` format and
+        the traffic counters are only meaningful on the disconnection.
+        The sessions that are forwarded by ``self.forward_sessions()``
+        are also received as the events.
+        """
+        if event.startswith(SESSIONS_EVENT.encode()):
+            self._receive_sessions(event)
+            return
+
+        try:
+            reason, id, username, uplink, downlink = event.decode().split()
+            id, uplink, downlink = int(id), int(uplink), int(downlink)
+        except ValueError:
+            logger.debug(f"Ignoring the malformed session event: {event!r}")
+            return
+
+        if reason == "connect":
+            self._has_new_session = True
+        elif reason == "disconnect" and self._traffic_loaded:
+            # The session may still be reported by an in-flight poll
+            self._closed_sessions.add(id)
+            previous = self._sessions.pop(id, None)
+            if previous is not None and (
+                previous[0] == username
+                and uplink >= previous[1]
+                and downlink >= previous[2]
+            ):
+                uplink -= previous[1]
+                downlink -= previous[2]
+
+            if uplink or downlink:
+                if (traffic := self._closed_traffic.get(username)) is None:
+                    traffic = self._closed_traffic[username] = {
+                        "uplink": 0,
+                        "downlink": 0,
+                    }
+                traffic["uplink"] += uplink
+                traffic["downlink"] += downlink
+
+    def _receive_sessions(self, event: bytes) -> None:
+        """
+        Collects the chunks of the forwarded sessions. The sessions are only
+        stored when all of their chunks are received in order, so a poll
+        that its chunks are dropped is skipped.
+        """
+        header, _, chunk = event.partition(b"\n")
+        try:
+            _, boot, index, count = header.split()
+            boot, index, count = int(boot), int(index), int(count)
+        except ValueError:
+            logger.debug(f"Ignoring the malformed sessions event: {header!r}")
+            return
+
+        if index == 0:
+            self._forwarded_chunks = []
+        elif self._forwarded_chunks is None or len(self._forwarded_chunks) != index:
+            self._forwarded_chunks = None
+            return
+
+        self._forwarded_chunks.append(chunk)
+        if index + 1 == count:
+            sessions = []
+            for line in b"".join(self._forwarded_chunks).splitlines():
+                id, username, uplink, downlink = line.decode().split()
+                sessions.append(
+                    {"ID": int(id), "Username": username, "TX": uplink, "RX": downlink}
+                )
+            self._forwarded_sessions = (boot, sessions)
+            self._forwarded_chunks = None
+
+    def _merge_closed_traffic(
+        self,
+        traffic: dict[str, Traffic],
+        username: str | None = None,
+        reset: bool | None = None,
+    ) -> None:
+        """Adds the traffic usage of the closed sessions to the passed one."""
+        closed_traffic = self._closed_traffic
+        for _username in [username] if username else list(closed_traffic):
+            if (_closed_traffic := closed_traffic.get(_username)) is None:
+                continue
+            if reset:
+                del closed_traffic[_username]
+
+            if (_traffic := traffic.get(_username)) is None:
+                _traffic = traffic[_username] = {"uplink": 0, "downlink": 0}
+            _traffic["uplink"] += _closed_traffic["uplink"]
+            _traffic["downlink"] += _closed_traffic["downlink"]
+
+    def listen_events(
+        self, path: os.PathLike = events_socket_path, forwarded: bool = False
+    ) -> None:
+        """
+        Starts receiving the session events that are reported by
+        the connect/disconnect hook script of the `OpenConnect` server.
+
+        The traffic usage of the sessions which are closed between
+        the polls are counted exactly and polling the server is
+        skipped while there is no connected session.
+        Only a single instance should listen for the events.
+
+        Args:
+            `path`:
+                The socket location to receive the events on.
+                The default value is equal to `ocserv_events_socket_path`
+                property of the configuration file.
+            `forwarded`:
+                If `True` provided, the server is not polled for the traffic
+                usage of all the users and the sessions that are forwarded
+                along with the events by ``self.forward_sessions()`` are
+                used instead. Each forwarded poll is only used once.
+        """
+        self._forwarded = forwarded
+        if self._stop_listening is None:
+            self._stop_listening = listen_datagram(path, self._handle_event)
+            logger.debug("Listening for the session events")
+
+    async def forward_sessions(
+        self, paths: list[os.PathLike], get_index: Callable[[str], int]
+    ) -> None:
+        """
+        Polls the sessions of the `OpenConnect` server once and forwards
+        each user's sessions to the instance that tracks the user.
+
+        All the instances receive their sessions, even if they have
+        none, as the datagrams which are split into the chunks. The
+        chunks are sent again while the instance's queue is full
+        until the `timeout` is expired.
+
+        Args:
+            `paths`: The socket locations of the instances.
+            `get_index`: Returns the index of the instance that tracks the user.
+
+        Raises:
+            ``errors.OpenConnectCommandError``:
+                When the message broker script failed to run the command.
+        """
+        boot = (await self._exec("show_status"))["raw_up_since"]
+        lines = [[] for _ in paths]
+        for session in await self._exec_sessions("show_users"):
+            if session.get("State") != "pre-auth" and (
+                username := session.get("Username")
+            ):
+                lines[get_index(username)].append(
+                    f"{session['ID']} {username} {session['TX']} {session['RX']}\n"
+                )
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        for path, _lines in zip(paths, lines):
+            chunks = [""]
+            for line in _lines:
+                if len(chunks[-1]) + len(line) > SESSIONS_CHUNK_SIZE:
+                    chunks.append("")
+                chunks[-1] += line
+
+            for index, chunk in enumerate(chunks):
+                datagram = (
+                    f"{SESSIONS_EVENT} {boot} {index} {len(chunks)}\n{chunk}".encode()
+                )
+                # Waiting for the instance to receive the queued datagrams.
+                # The instance skips the poll if any of its chunks is missed.
+                delay = RETRY_DELAY
+                while not send_datagram(path, datagram) and loop.time() < deadline:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    def dump_baselines(self) -> dict[str, Any] | None:
+        """
+        Returns the traffic usage baselines of the sessions
+        to be restored with ``self.restore_baselines()`` method
+        or `None` if the traffic usage is not tracked yet.
+        """
+        if self._traffic_loaded and self._last_boot is not None:
+            return {
+                "last_boot": self._last_boot,
+                "sessions": self._sessions,
+                "closed_traffic": self._closed_traffic,
+            }
+
+    def restore_baselines(self, baselines: dict[str, Any]) -> None:
+        """
+        Restores the traffic usage baselines of the sessions, so
+        the traffic that is consumed by the sessions in the meantime
+        is counted. The baselines are discarded on the next tracking
+        if the `OpenConnect` server is restarted in the meantime.
+        """
+        self._last_boot = baselines["last_boot"]
+        self._sessions = {
+            int(id): session for id, session in baselines["sessions"].items()
+        }
+        self._closed_traffic = baselines["closed_traffic"]
+        self._traffic_loaded = True
+
     async def _traffic_usage(
         self, username: str | None = None, reset: bool | None = None
     ) -> Traffic | dict[str, Traffic]:
         # There is no way to actually reset the client's traffic
         # usage on `OpenConnect` server side unlike the `Xray-core`.
         # Therefore, traffic usage should be tracked manually by
-        # storing the traffic usage for each client and calculating
+        # storing the traffic usage for each session and calculating
         # the difference on each method call.
         #
-        # And again unlike the `Xray-core`, `OpenConnect` doesn't store
-        # the previous traffic usages whenever the client reconnects.
-        if not self._traffic_loaded:
-            self._traffic_loaded = True
-            if reset:
-                try:
-                    # Just ignoring the traffic stats prior to current time
-                    await self._traffic_usage(username, reset)
-                except:
-                    self._traffic_loaded = False
-                    raise
-        elif await self._is_restarted():
-            # The `OpenConnect` process is restarted.
-            self._traffic.clear()
-
-        stats = {}
-        for user in (
-            await self._exec(f"show_user{'s' if not username else f' {username}'}")
-            or ()
-        ):
-            if user["State"] == "pre-auth":
+        # The sessions are identified by their ID which is unique during
+        # the lifetime of the server process. Whenever the client reconnects,
+        # a new session is created with its own counters starting from zero.
+        # Therefore, the whole traffic usage of the unseen sessions is new.
+        #
+        # The hook script also reports the final counters of the
+        # closed sessions, so there is no need to poll the server
+        # while the sessions are known to be disconnected.
+        traffic = {}
+        if not username and self._stop_listening:
+            if (
+                self._traffic_loaded
+                and not self._sessions
+                and not self._has_new_session
+                and self._idle_polls < idle_steps
+            ):
+                self._idle_polls += 1
+                self._merge_closed_traffic(traffic, reset=reset)
+                return traffic
+
+        current_boot = polled_sessions = None
+        if not username and self._forwarded:
+            if self._forwarded_sessions is None:
+                # No poll is forwarded since the last one
+                self._merge_closed_traffic(traffic, reset=reset)
+                return traffic
+
+            current_boot, polled_sessions = self._forwarded_sessions
+            self._forwarded_sessions = None
+
+        skip_existing = not self._traffic_loaded and reset
+        if self._traffic_loaded and await self._is_restarted(current_boot):
+            # The `OpenConnect` process is restarted and
+            # the session IDs are going to be reused.
+            self._sessions.clear()
+            self._closed_sessions.clear()
+
+        if polled_sessions is None:
+            polled_sessions = await self._exec_sessions(
+                f"show_user{'s' if not username else f' {username}'}"
+            )
+        if not username and self._stop_listening:
+            # The polls are only skipped again after a successful poll
+            self._has_new_session = False
+            self._idle_polls = 0
+
+        sessions = self._sessions
+        closed_sessions = self._closed_sessions
+        active_sessions = set()
+        for session in polled_sessions:
+            if session.get("State") == "pre-auth":
                 # `Username` property does not assigned in this stage yet
                 continue
 
-            _username = user["Username"]
+            if (id := session["ID"]) in closed_sessions:
+                # Already accounted by the disconnection event
+                continue
 
-            try:
-                stats[_username]["uplink"] += int(user["TX"])
-                stats[_username]["downlink"] += int(user["RX"])
-            except KeyError:
-                stats[_username] = {
-                    "uplink": int(user["TX"]),
-                    "downlink": int(user["RX"]),
-                }
+            _username = session["Username"]
+            uplink = int(session["TX"])
+            downlink = int(session["RX"])
+            active_sessions.add(id)
+            if (_traffic := traffic.get(_username)) is None:
+                _traffic = traffic[_username] = {"uplink": 0, "downlink": 0}
 
-        traffic = {}
-        for _username, _traffic in stats.items():
-            uplink = _traffic["uplink"]
-            downlink = _traffic["downlink"]
-
-            try:
-                _previous_traffic = self._traffic[_username]
-            except KeyError:
-                self._traffic[_username] = (
-                    _traffic if reset else {"uplink": 0, "downlink": 0}
-                )
-            else:
-                uplink -= _previous_traffic["uplink"]
-                downlink -= _previous_traffic["downlink"]
+            previous = sessions.get(id)
+            if previous is not None and (
+                previous[0] != _username
+                or uplink < previous[1]
+                or downlink < previous[2]
+            ):
+                # The session ID is reused by another session
+                previous = None
 
-                # Client was disconnected and reconnected again
-                if uplink < 0:
-                    uplink = _traffic["uplink"]
-                if downlink < 0:
-                    downlink = _traffic["downlink"]
+            if previous is None:
+                if skip_existing:
+                    # Just ignoring the traffic stats prior to current time
+                    sessions[id] = [_username, uplink, downlink]
+                    continue
 
+                sessions[id] = (
+                    [_username, uplink, downlink] if reset else [_username, 0, 0]
+                )
+                _traffic["uplink"] += uplink
+                _traffic["downlink"] += downlink
+            elif previous[1] != uplink or previous[2] != downlink:
+                _traffic["uplink"] += uplink - previous[1]
+                _traffic["downlink"] += downlink - previous[2]
                 if reset:
-                    _previous_traffic["uplink"] = _traffic["uplink"]
-                    _previous_traffic["downlink"] = _traffic["downlink"]
+                    previous[1] = uplink
+                    previous[2] = downlink
 
-            traffic[_username] = {"uplink": uplink, "downlink": downlink}
+        # Dropping the baselines of the closed sessions
+        for id in [
+            id
+            for id, (_username, *_) in sessions.items()
+            if id not in active_sessions and (not username or _username == username)
+        ]:
+            del sessions[id]
 
+        if not username:
+            closed_sessions.clear()
+        self._merge_closed_traffic(traffic, username, reset)
+        self._traffic_loaded = True
         if username and username in traffic:
             return traffic[username]
         return traffic
 
     async def add_user(self, username: str, uuid: str) -> None:
-        await self._exec(f"add_user {username} {uuid}")
-        logger.debug(f"User '{username}' is added")
+        if failures := await self.add_users([{"username": username, "uuid": uuid}]):
+            raise failures[username]
 
     async def delete_user(self, username: str) -> None:
-        await self._exec(f"delete_user {username}")
-        logger.debug(f"User '{username}' is deleted")
+        if failures := await self.delete_users([username]):
+            raise failures[username]
+
+    async def add_users(
+        self, credentials: Iterable[Credentials]
+    ) -> dict[str, Exception]:
+        changes = await asyncio.to_thread(self._passwd.apply, add=credentials)
+        for username in changes.added:
+            logger.debug(f"User '{username}' is added")
+        if changes.added or self._reload_pending:
+            await self._reload()
+
+        return {username: errors.UserExistError() for username in changes.existed}
+
+    async def delete_users(self, usernames: Iterable[str]) -> dict[str, Exception]:
+        usernames = list(usernames)
+        changes = await asyncio.to_thread(self._passwd.apply, delete=usernames)
+        for username in changes.deleted:
+            logger.debug(f"User '{username}' is deleted")
+
+        # Missed users are also disconnected in case the previous
+        # attempt is failed after the password file modification
+        await self._exec_batch("disconnect_users", usernames)
+        if changes.deleted or self._reload_pending:
+            await self._reload()
+
+        return {username: errors.UserNotExistError() for username in changes.missed}
+
+    async def list_users(self) -> set[str]:
+        # The connected users that are not in the password file anymore
+        # are also included because they still need to be disconnected
+        usernames = await asyncio.to_thread(lambda: self._passwd.usernames)
+        for session in await self._exec_sessions("show_users"):
+            if session.get("State") != "pre-auth" and (
+                username := session.get("Username")
+            ):
+                usernames.add(username)
+
+        return usernames
 
     async def user_traffic_usage(self, username: str, reset: bool = True) -> Traffic:
         return await self._traffic_usage(username, reset)
 
     async def users_traffic_usage(self, reset: bool = True) -> dict[str, Traffic]:
         return await self._traffic_usage(reset=reset)
+
+    async def close(self) -> None:
+        """Closes the connection to the service."""
+        if stop_listening := self._stop_listening:
+            self._stop_listening = None
+            stop_listening()
+
+        if receiver := self._receiver:
+            self._receiver = None
+            self._disconnect()
+            receiver.cancel()
+            with suppress(asyncio.CancelledError):
+                await receiver
@@ -0,0 +1,195 @@
+import os
+import fcntl
+import logging
+from pathlib import Path
+from typing import NamedTuple
+from contextlib import contextmanager
+from collections.abc import Generator, Iterable
+
+import bcrypt
+
+from ..config import config
+from ..types import Credentials
+
+# The passwords are random UUIDs and do not benefit from
+# the key stretching. Using the minimum allowed cost to
+# keep the bulk generation of the users fast.
+HASH_ROUNDS = 4
+GROUP = "*"
+
+passwd_path = Path(config["main"]["ocserv_passwd_path"])
+logger = logging.getLogger(__name__)
+
+
+class PasswdChanges(NamedTuple):
+    added: list[str]
+    deleted: list[str]
+    existed: list[str]
+    missed: list[str]
+
+
+class Passwd:
+    """
+    The `ocpasswd` compatible password file which is
+    used by the `OpenConnect` `plain` authentication method.
+
+    The passwords are hashed with `bcrypt` which is supported by
+    the `crypt()` function of the `OpenConnect` server.
+
+    The usernames are indexed in the memory and all the changes
+    are applied by atomically replacing the file. The file is
+    locked while modifying to prevent the race conditions
+    between the processes and the index is reloaded whenever
+    the file is modified by other processes.
+
+    Attributes:
+        `path`:
+            The password file location.
+            The default value is equal to `ocserv_passwd_path`
+            property of the configuration file.
+    """
+
+    def __init__(self, path: os.PathLike = passwd_path) -> None:
+        self.path = Path(path)
+        self._lock_path = self.path.with_name(f".{self.path.name}.lock")
+        self._entries: dict[str, str] = {}
+        self._signature = None
+
+    @contextmanager
+    def _lock(self) -> Generator[None, None, None]:
+        """Exclusively locks the file among the processes."""
+        if not (directory := self.path.parent).exists():
+            directory.mkdir(parents=True, exist_ok=True)
+
+        lock = os.open(self._lock_path, os.O_WRONLY | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(lock)  # releases the lock
+
+    def _load(self) -> None:
+        """Reloads the index if the file is modified since the last load."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            self._entries.clear()
+            self._signature = None
+            return
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        entries = {}
+        with open(self.path) as file:
+            for line in file:
+                if line := line.rstrip("\n"):
+                    entries[line.split(":", 1)[0]] = line
+
+        self._entries = entries
+        self._signature = signature
+
+    def _write(self) -> None:
+        """Atomically replaces the file with the current entries."""
+        temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(temp_path, "w") as file:
+            if self._entries:
+                file.write("\n".join(self._entries.values()))
+                file.write("\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        temp_path.chmod(0o644)
+        os.replace(temp_path, self.path)
+        stat = self.path.stat()
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _entry(username: str, password: str) -> str:
+        hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(HASH_ROUNDS))
+        return f"{username}:{GROUP}:{hash.decode()}"
+
+    @staticmethod
+    def _verify(entry: str, password: str) -> bool:
+        """Whether the entry is generated for the passed password."""
+        try:
+            return bcrypt.checkpw(password.encode(), entry.split(":", 2)[2].encode())
+        except (IndexError, ValueError):
+            # The entries with other hash methods are regenerated
+            return False
+
+    def apply(
+        self,
+        add: Iterable[Credentials] = (),
+        delete: Iterable[str] = (),
+    ) -> PasswdChanges:
+        """Adds and deletes the users with a single write.
+
+        This method is blocking and should be run in a
+        separate thread when called in asynchronous contexts.
+
+        Returns:
+            The users that are added and deleted plus the ones that
+            are already existed or missed and therefore skipped.
+        """
+        changes = PasswdChanges([], [], [], [])
+        with self._lock():
+            self._load()
+            entries = self._entries
+            for username in delete:
+                if entries.pop(username, None) is None:
+                    changes.missed.append(username)
+                else:
+                    changes.deleted.append(username)
+
+            for credentials in add:
+                if (username := credentials["username"]) in entries:
+                    changes.existed.append(username)
+                else:
+                    entries[username] = self._entry(username, credentials["uuid"])
+                    changes.added.append(username)
+
+            if changes.added or changes.deleted:
+                try:
+                    self._write()
+                except BaseException:
+                    # Forcing the index to be reloaded from the file
+                    self._signature = None
+                    raise
+
+        return changes
+
+    def replace(self, credentials: Iterable[Credentials]) -> None:
+        """Replaces the whole users of the file with the passed ones.
+
+        The entries of the users that are already existed in
+        the file are reused as long as their password is not changed.
+
+        This method is blocking and should be run in a
+        separate thread when called in asynchronous contexts.
+        """
+        with self._lock():
+            self._load()
+            entries = {}
+            previous_entries = self._entries
+            for credential in credentials:
+                username, uuid = credential["username"], credential["uuid"]
+                if not (
+                    (entry := previous_entries.get(username))
+                    and self._verify(entry, uuid)
+                ):
+                    entry = self._entry(username, uuid)
+                entries[username] = entry
+
+            self._entries = entries
+            self._write()
+
+        logger.debug(f"The '{self.path.name}' file is generated")
+
+    @property
+    def usernames(self) -> set[str]:
+        """The users that exist in the file."""
+        with self._lock():
+            self._load()
+            return set(self._entries.keys())
@@ -0,0 +1,189 @@
+from typing import NamedTuple
+from collections.abc import Iterable
+
+import numpy as np
+
+from ..types import PlanRecord
+
+UNLIMITED = -1
+COLUMNS = {
+    "_due_times": np.float64,
+    "_traffics": np.int64,
+    "_traffic_usages": np.int64,
+    "_extra_traffics": np.int64,
+    "_extra_traffic_usages": np.int64,
+}
+
+
+class TrafficChanges(NamedTuple):
+    traffic_usages: list[int]
+    extra_traffic_usages: list[int]
+    remaining_traffics: list[int | None]
+    expired: list[str]
+
+
+class PlanTable:
+    """
+    The columnar in-memory table of the users' plans.
+
+    Each plan field is stored in a separate `NumPy` array and the users
+    are indexed by their row in the arrays. The traffic usage of many
+    users is applied, split between the plan's traffic and the extra
+    traffic and their expiry is evaluated with vector operations over
+    the columns without running any per-user Python code, which keeps
+    the cost of a monitor iteration flat as the users grow.
+
+    The table is not aware of the database modifications and
+    should be reloaded by the owner whenever the plans are modified.
+    """
+
+    def __init__(self) -> None:
+        self._rows: dict[str, int] = {}
+        self._usernames: list[str] = []
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, np.zeros(0, dtype))
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._rows
+
+    def __len__(self) -> int:
+        return len(self._usernames)
+
+    def _reserve(self, size: int) -> None:
+        """Grows the columns geometrically to fit the passed count of rows."""
+        if size > (capacity := len(self._traffics)):
+            capacity = max(size, capacity * 2)
+            for name in COLUMNS:
+                setattr(self, name, np.resize(getattr(self, name), capacity))
+
+    def load(self, records: Iterable[PlanRecord]) -> None:
+        """Replaces the whole table with the passed plans."""
+        self.__init__()
+        self.update(records)
+
+    def update(self, records: Iterable[PlanRecord]) -> None:
+        """Replaces the users' plans or appends them if the users do not exist."""
+        rows = []
+        due_times = []
+        traffics = []
+        traffic_usages = []
+        extra_traffics = []
+        extra_traffic_usages = []
+        for record in records:
+            if (row := self._rows.get(username := record["username"])) is None:
+                row = self._rows[username] = len(self._usernames)
+                self._usernames.append(username)
+
+            due_time = record["plan_due_time"]
+            traffic = record["plan_traffic"]
+            rows.append(row)
+            due_times.append(np.inf if due_time is None else due_time)
+            traffics.append(UNLIMITED if traffic is None else traffic)
+            traffic_usages.append(record["plan_traffic_usage"])
+            extra_traffics.append(record["plan_extra_traffic"])
+            extra_traffic_usages.append(record["plan_extra_traffic_usage"])
+
+        self._reserve(len(self._usernames))
+        for column, values in (
+            (self._due_times, due_times),
+            (self._traffics, traffics),
+            (self._traffic_usages, traffic_usages),
+            (self._extra_traffics, extra_traffics),
+            (self._extra_traffic_usages, extra_traffic_usages),
+        ):
+            column[rows] = values
+
+    def remove(self, usernames: Iterable[str]) -> None:
+        """
+        Removes the users' plans if the users exist.
+        The last rows are moved to the removed ones.
+        """
+        for username in usernames:
+            if (row := self._rows.pop(username, None)) is None:
+                continue
+
+            last_username = self._usernames.pop()
+            if last_username != username:
+                last_row = len(self._usernames)
+                self._rows[last_username] = row
+                self._usernames[row] = last_username
+                for name in COLUMNS:
+                    column = getattr(self, name)
+                    column[row] = column[last_row]
+
+    def remaining_traffic(self, username: str) -> int | None:
+        """
+        Returns the user's remaining traffic including the extra
+        traffic or `None` if the plan does not have a traffic limit.
+        """
+        row = self._rows[username]
+        if (traffic := int(self._traffics[row])) == UNLIMITED:
+            return None
+
+        return int(
+            traffic
+            - self._traffic_usages[row]
+            + self._extra_traffics[row]
+            - self._extra_traffic_usages[row]
+        )
+
+    def apply(
+        self, usernames: list[str], traffic_usages: list[int], time: float
+    ) -> TrafficChanges:
+        """
+        Appends the traffic usages to the users' plans and evaluates their expiry.
+
+        The traffic usage beyond the plan's traffic
+        is charged from the plan's extra traffic.
+
+        Args:
+            `usernames`: The users that exist in the table.
+            `traffic_usages`: The consumed traffic of each user.
+            `time`: The current time as the seconds since the epoch.
+
+        Returns:
+            The traffic and the extra traffic that is charged for each user,
+            their remaining traffic and the users that do not have an
+            active plan anymore.
+        """
+        count = len(usernames)
+        rows = np.fromiter(map(self._rows.__getitem__, usernames), np.intp, count)
+        usages = np.fromiter(traffic_usages, np.int64, count)
+        traffics = self._traffics[rows]
+        extra_traffics = self._extra_traffics[rows]
+        previous_traffic_usages = self._traffic_usages[rows]
+        unlimited = traffics == UNLIMITED
+
+        limited = ~unlimited & (usages != 0)
+        spilled = (
+            limited
+            & (extra_traffics != 0)
+            & (previous_traffic_usages + usages > traffics)
+        )
+        added_traffic_usages = np.where(
+            spilled, traffics - previous_traffic_usages, np.where(limited, usages, 0)
+        )
+        added_extra_traffic_usages = np.where(spilled, usages - added_traffic_usages, 0)
+        self._traffic_usages[rows] = traffic_usages_ = (
+            previous_traffic_usages + added_traffic_usages
+        )
+        self._extra_traffic_usages[rows] = extra_traffic_usages = (
+            self._extra_traffic_usages[rows] + added_extra_traffic_usages
+        )
+
+        remaining_traffics = (
+            traffics - traffic_usages_ + extra_traffics - extra_traffic_usages
+        ).astype(object)
+        remaining_traffics[unlimited] = None
+        expired = (time >= self._due_times[rows]) | (
+            ~unlimited
+            & (traffic_usages_ >= traffics)
+            & (extra_traffic_usages >= extra_traffics)
+        )
+
+        return TrafficChanges(
+            added_traffic_usages.tolist(),
+            added_extra_traffic_usages.tolist(),
+            remaining_traffics.tolist(),
+            [usernames[index] for index in np.flatnonzero(expired).tolist()],
+        )
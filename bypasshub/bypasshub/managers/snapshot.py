@@ -0,0 +1,334 @@
+import os
+import fcntl
+import struct
+import hashlib
+import logging
+from pathlib import Path
+from typing import NamedTuple
+from contextlib import contextmanager, suppress
+from multiprocessing import current_process, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from collections.abc import Generator
+
+from ..config import config
+from ..types import ManagerUserState
+from ..constants import ServiceState, XrayService, OpenConnectService
+
+NAME = "bypasshub_snapshot"
+MIN_CAPACITY = 1024
+PUBLISH_BATCH_SIZE = 256
+READ_ATTEMPTS = 1000
+SERVICES = (XrayService.NAME, OpenConnectService.NAME)
+NOT_MANAGED = 0xFF
+
+# The slot flags
+USED = 1
+EXISTS = 2
+ACTIVE = 4
+SYNCED = 8
+
+# The table statuses
+CURRENT = 0
+RETIRED = 1
+DISABLED = 2
+
+lock_path = Path(config["main"]["temp_path"]).joinpath("snapshot.lock")
+cluster_node = config["main"]["cluster_node"]
+logger = logging.getLogger(__name__)
+
+_root = struct.Struct("<Q")  # generation
+_header = struct.Struct("<QQQQ")  # sequence, capacity, used slots, status
+_slot = struct.Struct(f"<16sB{len(SERVICES)}B")
+
+
+class UserSnapshot(NamedTuple):
+    has_active_plan: bool
+    synced: bool
+    services: dict[str, ServiceState]
+
+
+class StateSnapshot:
+    """The read-optimized snapshot of the users' state in the shared memory.
+
+    The users are stored in an open addressing hash table that is keyed by
+    the digest of the usernames. The publishers are serialized with a file
+    lock and each publish is wrapped between two increments of a sequence
+    counter. The readers in any process look the users up without any lock
+    or communication and retry when the sequence counter is changed while
+    reading. The table is replaced by a bigger one with the next generation
+    when it gets half full and the retired one is marked to make its readers
+    switch to the new one. The disabled table is marked as well to make its
+    readers fail immediately.
+
+    Attributes:
+        `name`:
+            The name of the shared memory block that
+            holds the generation of the current table.
+            It's suffixed with the node's name within a cluster
+            for the nodes that run on the same host.
+    """
+
+    def __init__(self, name: str = NAME) -> None:
+        self.name = f"{name}_{cluster_node}" if cluster_node else name
+        self._root: SharedMemory | None = None
+        self._table: SharedMemory | None = None
+        self._generation = None
+        self._lock = None
+        self._lock_pid = None
+
+    @staticmethod
+    def _open(name: str, size: int = 0) -> SharedMemory:
+        memory = SharedMemory(name, create=bool(size), size=size)
+        # The blocks are unlinked explicitly by the owner and should not be
+        # unlinked by the resource tracker when the attached processes exit
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+    @staticmethod
+    def _unlink(memory: SharedMemory) -> None:
+        # Balancing the unregistration of the resource tracker on unlinking
+        resource_tracker.register(memory._name, "shared_memory")
+        memory.unlink()
+
+    @staticmethod
+    def _key(username: str) -> bytes:
+        return hashlib.blake2b(username.encode(), digest_size=16).digest()
+
+    def _table_name(self, generation: int) -> str:
+        return f"{self.name}_{generation}"
+
+    def _attach(self) -> None:
+        """Attaches to the current table.
+
+        Raises:
+            `FileNotFoundError`: When the snapshot does not exist.
+        """
+        if self._root is None:
+            self._root = self._open(self.name)
+
+        (generation,) = _root.unpack_from(self._root.buf)
+        if generation != self._generation:
+            table = self._open(self._table_name(generation))
+            if self._table:
+                self._table.close()
+            self._table = table
+            self._generation = generation
+
+    @contextmanager
+    def _locked(self) -> Generator[None, None, None]:
+        """Exclusively locks the snapshot among the publishers."""
+        if self._lock_pid != (pid := current_process().pid):
+            # The lock is shared with the parent process after forking
+            self._lock = os.open(lock_path, os.O_WRONLY | os.O_CREAT, 0o660)
+            self._lock_pid = pid
+
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def _create_table(self, generation: int, capacity: int) -> SharedMemory:
+        table = self._open(
+            self._table_name(generation), _header.size + capacity * _slot.size
+        )
+        _header.pack_into(table.buf, 0, 0, capacity, 0, CURRENT)
+        return table
+
+    def _find(
+        self, buffer: memoryview, capacity: int, key: bytes
+    ) -> tuple[int, int, list[int]]:
+        """
+        Returns the offset of the user's slot or the first
+        empty slot if the user does not exist alongside its fields.
+        """
+        mask = capacity - 1
+        index = int.from_bytes(key[:8], "little") & mask
+        while True:
+            offset = _header.size + index * _slot.size
+            _key, flags, *states = _slot.unpack_from(buffer, offset)
+            if not flags & USED or _key == key:
+                return offset, flags, states
+            index = (index + 1) & mask
+
+    def _store(
+        self,
+        buffer: memoryview,
+        capacity: int,
+        key: bytes,
+        user: ManagerUserState | None,
+    ) -> bool:
+        """
+        Stores the user in the table or marks its slot as
+        deleted if `None` is passed for the user's state.
+
+        Returns:
+            Whether an empty slot is used.
+        """
+        offset, flags, _ = self._find(buffer, capacity, key)
+        if user is None:
+            if flags & EXISTS:
+                _slot.pack_into(
+                    buffer, offset, key, USED, *[NOT_MANAGED] * len(SERVICES)
+                )
+            return False
+
+        services = user["services"]
+        _slot.pack_into(
+            buffer,
+            offset,
+            key,
+            USED
+            | EXISTS
+            | (ACTIVE if user["has_active_plan"] else 0)
+            | (SYNCED if user["synced"] else 0),
+            *[
+                (
+                    state.value
+                    if (state := services.get(name)) is not None
+                    else NOT_MANAGED
+                )
+                for name in SERVICES
+            ],
+        )
+        return not flags & USED
+
+    def _grow(self, additions: int) -> None:
+        """
+        Replaces the current table with the next generation that
+        has the room for the passed count of the additional users.
+        """
+        buffer = self._table.buf
+        sequence, capacity, used, _ = _header.unpack_from(buffer)
+        existing = []
+        for index in range(capacity):
+            offset = _header.size + index * _slot.size
+            if _slot.unpack_from(buffer, offset)[1] & EXISTS:
+                existing.append(bytes(buffer[offset : offset + _slot.size]))
+
+        new_capacity = MIN_CAPACITY
+        while new_capacity < (len(existing) + additions) * 2:
+            new_capacity *= 2
+
+        generation = self._generation + 1
+        table = self._create_table(generation, new_capacity)
+        for slot in existing:
+            offset, _, _ = self._find(table.buf, new_capacity, slot[:16])
+            table.buf[offset : offset + _slot.size] = slot
+        _header.pack_into(table.buf, 0, 0, new_capacity, len(existing), CURRENT)
+
+        # Retiring the previous table
+        retired = self._table
+        _header.pack_into(retired.buf, 0, sequence, capacity, used, RETIRED)
+        _root.pack_into(self._root.buf, 0, generation)
+        self._attach()
+        with suppress(FileNotFoundError):
+            self._unlink(retired)
+
+    def create(self) -> None:
+        """Creates an empty snapshot and replaces the existing one."""
+        self.destroy()
+        self._root = self._open(self.name, _root.size)
+        self._table = self._create_table(0, MIN_CAPACITY)
+        self._generation = 0
+        _root.pack_into(self._root.buf, 0, 0)
+
+    def destroy(self) -> None:
+        """Removes the snapshot. Its attached readers fail from now on."""
+        self.disable()
+        for memory in (self._table, self._root):
+            if memory:
+                with suppress(FileNotFoundError):
+                    self._unlink(memory)
+                memory.close()
+
+        self._root = self._table = self._generation = None
+
+    def publish(self, users: dict[str, ManagerUserState | None]) -> None:
+        """
+        Reflects the passed users' state to the snapshot.
+        The users with `None` state are removed.
+
+        The snapshot is disabled if it cannot be modified
+        to not serve the outdated users' state.
+        """
+        if not users:
+            return
+
+        try:
+            with self._locked():
+                self._attach()
+                sequence, capacity, used, status = _header.unpack_from(self._table.buf)
+                if status == DISABLED:
+                    return
+                elif sequence & 1:
+                    # The previous publisher is terminated while modifying the table
+                    raise BlockingIOError("The state snapshot is partially modified")
+
+                if (used + len(users)) * 2 > capacity:
+                    self._grow(len(users))
+
+                items = list(users.items())
+                buffer = self._table.buf
+                for index in range(0, len(items), PUBLISH_BATCH_SIZE):
+                    sequence, capacity, used, status = _header.unpack_from(buffer)
+                    _header.pack_into(buffer, 0, sequence + 1, capacity, used, status)
+                    for username, user in items[index : index + PUBLISH_BATCH_SIZE]:
+                        used += self._store(buffer, capacity, self._key(username), user)
+                    _header.pack_into(buffer, 0, sequence + 2, capacity, used, status)
+        except OSError as error:
+            self.disable()
+            logger.warning(f"The state snapshot is disabled due to {error!r}")
+
+    def disable(self) -> None:
+        """
+        Makes the readers fall back to the state synchronizer.
+        The disabled snapshot is not modified anymore.
+        """
+        with suppress(OSError):
+            self._attach()
+            sequence, capacity, used, _ = _header.unpack_from(self._table.buf)
+            _header.pack_into(self._table.buf, 0, sequence, capacity, used, DISABLED)
+
+    def get(self, username: str) -> UserSnapshot | None:
+        """
+        Returns the user's state or `None` if the user does not exist.
+
+        Raises:
+            `FileNotFoundError`:
+                When the snapshot does not exist.
+            `BlockingIOError`:
+                When the snapshot is disabled or is being modified for too long.
+        """
+        key = self._key(username)
+        if self._table is None:
+            self._attach()
+        for _ in range(READ_ATTEMPTS):
+            buffer = self._table.buf
+            sequence, capacity, _, status = _header.unpack_from(buffer)
+            if status == DISABLED:
+                raise BlockingIOError("The state snapshot is disabled")
+            elif status == RETIRED:
+                self._attach()
+                continue
+            elif sequence & 1:
+                os.sched_yield()
+                continue
+
+            _, flags, states = self._find(buffer, capacity, key)
+            if _header.unpack_from(buffer)[0] != sequence:
+                continue
+
+            if not flags & EXISTS:
+                return None
+            return UserSnapshot(
+                bool(flags & ACTIVE),
+                bool(flags & SYNCED),
+                {
+                    name: ServiceState(state)
+                    for name, state in zip(SERVICES, states)
+                    if state != NOT_MANAGED
+                },
+            )
+
+        raise BlockingIOError("The state snapshot is not available")
@@ -1,7 +1,7 @@
 import time
 import logging
 from pathlib import Path
-from threading import Lock
+from threading import RLock
 from typing import Optional
 from contextlib import suppress, contextmanager
 from multiprocessing import current_process
@@ -9,6 +9,8 @@ from multiprocessing.process import AuthenticationString
 from multiprocessing.managers import SyncManager, DictProxy
 from collections.abc import Generator
 
+from .actor import StateActor, StateChannel
+from .snapshot import StateSnapshot
 from .. import errors
 from ..config import config
 
@@ -17,6 +19,7 @@ CLIENT_RETRY_DELAY = 0.001  # seconds
 RESERVED_NAME = "_global_lock"
 
 socket_path = Path(config["main"]["temp_path"]).joinpath("manager.sock")
+state_actor = config["main"]["state_actor"]
 logger = logging.getLogger(__name__)
 
 # Apparently, `SyncManager` doesn't read the authentication
@@ -39,6 +42,10 @@ class State[T]:
 
     The ``self._state`` property should be used to modify the state.
 
+    When the `state_actor` configuration is enabled, the state is owned by
+    ``StateActor`` in the process that runs the server instead and should
+    be accessed with the requests that are sent through ``self._channel``.
+
     Attributes:
         `name`:
             The name of the state slot.
@@ -46,6 +53,10 @@ class State[T]:
     """
 
     __server_pid = None
+    __actor: StateActor | None = None
+    __snapshot: StateSnapshot | None = None
+    __channel: StateChannel | None = None
+    __channel_pid = None
     _server_started = None
 
     def __init__(self, name: str | None = None) -> None:
@@ -57,8 +68,10 @@ class State[T]:
 
         self._dict = _synchronizer.dict
         self._lock = _synchronizer.Lock
+        self._rlock = _synchronizer.RLock
         self._state_proxy: DictProxy | None = None
-        self._global_lock_proxy: Optional[Lock] = None
+        self._global_lock_proxy: Optional[RLock] = None
+        self._channel: StateChannel | None = None
         self._connected = None
 
     @contextmanager
@@ -97,10 +110,14 @@ class State[T]:
         self._connected = True
         try:
             with self._access_state():
+                if state_actor:
+                    self._channel = State.__channel
+                    return
+
                 self._state_proxy = _synchronizer.state()
                 if RESERVED_NAME not in self._state_proxy:
                     self._global_lock_proxy = self._state_proxy[RESERVED_NAME] = (
-                        self._lock()
+                        self._rlock()
                     )
                 else:
                     self._global_lock_proxy = self._state_proxy[RESERVED_NAME]
@@ -108,6 +125,16 @@ class State[T]:
             self._connected = False
             raise
 
+    def _connect_server(self) -> None:
+        if not state_actor:
+            _synchronizer.connect()
+        elif State.__channel_pid != (pid := current_process().pid):
+            # Each process only needs a single channel
+            channel = StateChannel()
+            channel.connect()
+            State.__channel = channel
+            State.__channel_pid = pid
+
     def run(self) -> None:
         """Runs the process state synchronizer server.
 
@@ -117,11 +144,24 @@ class State[T]:
         if State._server_started:
             raise RuntimeError("Process state synchronizer server is already running")
 
-        if socket_path.is_socket():
-            socket_path.unlink(missing_ok=True)
-            logger.info("Removed the socket file from the previous session")
+        State.__snapshot = StateSnapshot()
+        try:
+            State.__snapshot.create()
+        except OSError as error:
+            logger.warning(f"Failed to create the state snapshot due to {error!r}")
+
+        if state_actor:
+            State.__actor = StateActor()
+            State.__actor.run()
+            State.__channel = StateChannel(State.__actor)
+            State.__channel_pid = current_process().pid
+        else:
+            if socket_path.is_socket():
+                socket_path.unlink(missing_ok=True)
+                logger.info("Removed the socket file from the previous session")
+
+            _synchronizer.start()
 
-        _synchronizer.start()
         self._load_state()
         State.__server_pid = current_process().pid
         State._server_started = True
@@ -158,7 +198,7 @@ class State[T]:
             elapsed = 0
             while True:
                 try:
-                    _synchronizer.connect()
+                    self._connect_server()
                 except errors.UNIX_SOCKET_FAILURE:
                     if skip_retry:
                         logger.debug(
@@ -190,14 +230,24 @@ class State[T]:
                     " from the process that starts the server"
                 )
 
-            if self._state_proxy:
-                with self._access_state():
-                    self._state_proxy.clear()
-                self._state_proxy = None
-                self._global_lock_proxy = None
-
-            with suppress(BrokenPipeError):
-                _synchronizer.shutdown()
+            if state_actor:
+                State.__actor.close()
+                State.__actor = None
+                State.__channel = None
+                State.__channel_pid = None
+                self._channel = None
+            else:
+                if self._state_proxy:
+                    with self._access_state():
+                        self._state_proxy.clear()
+                    self._state_proxy = None
+                    self._global_lock_proxy = None
+
+                with suppress(BrokenPipeError):
+                    _synchronizer.shutdown()
+
+            State.__snapshot.destroy()
+            State.__snapshot = None
 
             State.__server_pid = None
             State._server_started = False
@@ -217,10 +267,10 @@ class State[T]:
         self._state_proxy[self.name] = value
 
     @property
-    def _global_lock(self) -> Optional[Lock]:
+    def _global_lock(self) -> Optional[RLock]:
         """
-        The global process lock to prevent race conditions
-        between processes when modify the state.
+        The global reentrant process lock to prevent race
+        conditions between processes when modify the state.
 
         Should be used inside the ``self._access_state()``
         context manager block.
@@ -3,37 +3,64 @@ import logging
 import sqlite3
 import functools
 from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
 from re import compile
 from io import StringIO
 from typing import Self
 from pathlib import Path
 from shutil import copyfileobj
 from datetime import datetime, timedelta
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
 
+import orjson
+
+from .passwd import Passwd
+from .journal import JournalRecord
 from .. import errors
 from ..config import config
-from ..database import Database
-from ..constants import PlanUpdateAction
+from ..database import Database, database_shards, get_shard
+from ..constants import PlanUpdateAction, OperationAction
 from ..utils import current_time, convert_date, convert_time, convert_size
-from ..types import Credentials, Traffic, Plan, ReservedPlan, PlanHistory
+from ..types import (
+    Credentials,
+    Traffic,
+    Plan,
+    ReservedPlan,
+    PlanHistory,
+    PendingOperation,
+    PlanRecord,
+)
 
 USERNAME_MIN_LENGTH = 1
 USERNAME_MAX_LENGTH = 64
+RETRY_MIN_DELAY = 5  # seconds
+RETRY_MAX_DELAY = 600  # seconds
 
+manage_ocserv = config["main"]["manage_ocserv"]
 temp_path = Path(config["main"]["temp_path"])
 username_pattern = compile(r"\w+$")  # Letters and numbers plus underscore
 logger = logging.getLogger(__name__)
 
 
 class Users:
-    """The interface to manage the users on the database."""
+    """The interface to manage the users on the database.
+
+    Each user's rows are read and modified through the connection of
+    the user's own shard of the database, while the queries over all
+    the users read all the shards through the database's connection.
+    """
 
     _list_generated = None
 
     def __init__(self) -> None:
         self._closed = None
         self._database = Database()
+        self._shards = (
+            [Database(shard) for shard in range(database_shards)]
+            if database_shards > 1
+            else [self._database]
+        )
+        self._executor: ThreadPoolExecutor | None = None
 
     def __enter__(self) -> Self:
         return self
@@ -78,10 +105,51 @@ class Users:
             or plan["plan_extra_traffic_usage"] < plan["plan_extra_traffic"]
         )
 
+    def _get_shard(self, username: str) -> sqlite3.Connection:
+        """Returns the connection of the user's shard."""
+        return self._shards[get_shard(username)]
+
+    @staticmethod
+    def _group_by_shard[T](
+        items: Iterable[T], key: Callable[[T], str]
+    ) -> dict[int, list[T]]:
+        """Groups the items by the shard of their username."""
+        groups = {}
+        for item in items:
+            groups.setdefault(get_shard(key(item)), []).append(item)
+
+        return groups
+
+    def _execute_shards[R](
+        self, function: Callable[[sqlite3.Connection, int], R], shards: Iterable[int]
+    ) -> list[R]:
+        """
+        Calls the function with the connection of each passed shard.
+        The shards are modified in parallel.
+
+        Raises:
+            The first exception that is raised by the function after
+            the function is called for all the shards.
+        """
+        if len(shards := list(shards)) <= 1:
+            return [function(self._shards[shard], shard) for shard in shards]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                len(self._shards), thread_name_prefix="database_shard"
+            )
+
+        return list(
+            self._executor.map(
+                lambda shard: function(self._shards[shard], shard), shards
+            )
+        )
+
     def _is_exist(self, username: str) -> bool:
         """Whether the user is exist in the database."""
-        with self._database:
-            if self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            if database.execute(
                 "SELECT EXISTS(SELECT 1 FROM users WHERE username = ?) AS exist",
                 (username,),
             ).fetchone()["exist"]:
@@ -89,6 +157,13 @@ class Users:
 
         return False
 
+    def _is_uuid_exist(self, uuid: str) -> bool:
+        """Whether the UUID is assigned to a user on any of the shards."""
+        with self._database:
+            return self._database.execute(
+                "SELECT EXISTS(SELECT 1 FROM users WHERE uuid = ?) AS exist", (uuid,)
+            ).fetchone()["exist"]
+
     def _update_traffic(
         self,
         username: str,
@@ -99,8 +174,9 @@ class Users:
         update_activity_date: bool = True,
     ) -> None:
         """Appends user's traffic usage by the given values."""
-        with self._database:
-            self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            database.execute(
                 """
                 UPDATE
                     users
@@ -124,6 +200,633 @@ class Users:
                 ),
             )
 
+    def _store_records(
+        self,
+        journal: str,
+        records: list[JournalRecord],
+        store: Callable[[sqlite3.Connection, dict[str, list[int]]], None],
+    ) -> None:
+        """
+        Stores the sum of the journaled traffic usages on each shard in
+        a single transaction alongside the sequence of the journal's last
+        record. Each shard skips the records that are already stored on it,
+        so the records are stored exactly once even when storing them on
+        some of the shards is failed. The shards are modified in parallel.
+
+        Args:
+            `journal`:
+                The name of the journal that the records are read from.
+            `records`:
+                The records that contain the username, traffic usage, extra
+                traffic usage, upload and download of each user.
+            `store`:
+                The callback that stores the sum of the users'
+                traffic usages on the shard within the transaction.
+        """
+        sequence = records[-1].sequence
+        shard_usages = {}
+        for record in records:
+            for username, *usage in record.usages:
+                shard_usages.setdefault(get_shard(username), []).append(
+                    (record.sequence, username, usage)
+                )
+
+        def _store(database: sqlite3.Connection, shard: int) -> None:
+            with database:
+                if (
+                    stored_sequence := self._read_journal_sequence(database, journal)
+                ) >= sequence:
+                    return
+
+                usages = {}
+                for record_sequence, username, usage in shard_usages.get(shard, ()):
+                    if record_sequence <= stored_sequence:
+                        continue
+                    if (total := usages.get(username)) is None:
+                        usages[username] = usage
+                    else:
+                        usages[username] = [a + b for a, b in zip(total, usage)]
+
+                self._set_journal_sequence(database, journal, sequence)
+                if usages:
+                    store(database, usages)
+
+        self._execute_shards(_store, range(len(self._shards)))
+
+    def _update_traffics(self, journal: str, records: list[JournalRecord]) -> None:
+        """
+        Appends the journaled traffic usages of many users.
+
+        Args:
+            `journal`:
+                The name of the journal that the records are read from.
+            `records`:
+                The records that contain the username, traffic usage, extra
+                traffic usage, upload and download of each user.
+        """
+        date = current_time().isoformat()
+        self._store_records(
+            journal,
+            records,
+            lambda database, usages: database.executemany(
+                """
+                UPDATE
+                    users
+                SET
+                    user_latest_activity_date = ?,
+                    plan_traffic_usage = plan_traffic_usage + ?,
+                    plan_extra_traffic_usage = plan_extra_traffic_usage + ?,
+                    total_upload = total_upload + ?,
+                    total_download = total_download + ?
+                WHERE
+                    username = ?
+                """,
+                [
+                    (
+                        date,
+                        traffic_usage,
+                        extra_traffic_usage,
+                        upload,
+                        download,
+                        username,
+                    )
+                    for username, (
+                        traffic_usage,
+                        extra_traffic_usage,
+                        upload,
+                        download,
+                    ) in usages.items()
+                ],
+            ),
+        )
+
+    def _store_traffic_deltas(
+        self, node: str, journal: str, records: list[JournalRecord]
+    ) -> None:
+        """
+        Appends the journaled traffic usages of many users to the node's
+        traffic deltas. The deltas of all the nodes are merged into
+        the users' plans by the leader.
+
+        Args:
+            `journal`:
+                The name of the journal that the records are read from.
+            `records`:
+                The records that contain the username, traffic usage, extra
+                traffic usage, upload and download of each user. Only the
+                upload and download are stored.
+        """
+        date = current_time().isoformat()
+        self._store_records(
+            journal,
+            records,
+            lambda database, usages: database.executemany(
+                """
+                INSERT INTO traffic_deltas (node, username, upload, download, date)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (node, username) DO UPDATE SET
+                    upload = upload + excluded.upload,
+                    download = download + excluded.download,
+                    date = excluded.date
+                """,
+                [
+                    (node, username, upload, download, date)
+                    for username, (*_, upload, download) in usages.items()
+                ],
+            ),
+        )
+
+    def _merge_traffic_deltas(self) -> int:
+        """
+        Appends the traffic deltas of all the nodes to the users' plans and
+        removes them in a single transaction on each shard. The plan's traffic
+        is consumed before the extra traffic like ``PlanTable`` does.
+        The shards are modified in parallel.
+
+        Returns:
+            The count of the merged deltas.
+        """
+
+        def _merge(database: sqlite3.Connection, _: int) -> int:
+            with database:
+                database.execute(
+                    """
+                    UPDATE
+                        users
+                    SET
+                        user_latest_activity_date = deltas.date,
+                        plan_traffic_usage = plan_traffic_usage + IIF(
+                            plan_traffic IS NULL,
+                            0,
+                            MIN(deltas.traffic, MAX(plan_traffic - plan_traffic_usage, 0))
+                        ),
+                        plan_extra_traffic_usage = plan_extra_traffic_usage + IIF(
+                            plan_traffic IS NULL,
+                            0,
+                            deltas.traffic
+                                - MIN(deltas.traffic, MAX(plan_traffic - plan_traffic_usage, 0))
+                        ),
+                        total_upload = total_upload + deltas.upload,
+                        total_download = total_download + deltas.download
+                    FROM (
+                        SELECT
+                            username,
+                            SUM(upload + download) AS traffic,
+                            SUM(upload) AS upload,
+                            SUM(download) AS download,
+                            MAX(date) AS date
+                        FROM
+                            traffic_deltas
+                        GROUP BY
+                            username
+                    ) AS deltas
+                    WHERE
+                        users.username = deltas.username
+                    """
+                )
+                return database.execute("DELETE FROM traffic_deltas").rowcount
+
+        return sum(self._execute_shards(_merge, range(len(self._shards))))
+
+    def _acquire_lease(self, name: str, node: str, duration: int | float) -> bool:
+        """
+        Acquires the lease for the node or renews it if the node already
+        holds it. The lease is only acquired when it's not held by
+        another node or it's expired.
+
+        Returns:
+            Whether the node holds the lease.
+        """
+        date = current_time()
+        with self._database:
+            return bool(
+                self._database.execute(
+                    """
+                    INSERT INTO leases (name, node, expiry_date) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        node = excluded.node,
+                        expiry_date = excluded.expiry_date
+                    WHERE
+                        leases.node = excluded.node OR leases.expiry_date <= ?
+                    RETURNING node
+                    """,
+                    (
+                        name,
+                        node,
+                        (date + timedelta(seconds=duration)).isoformat(),
+                        date.isoformat(),
+                    ),
+                ).fetchone()
+            )
+
+    def _release_lease(self, name: str, node: str) -> None:
+        """Releases the lease if it's held by the node."""
+        with self._database:
+            self._database.execute(
+                "DELETE FROM leases WHERE name = ? AND node = ?", (name, node)
+            )
+
+    def _get_reserved_usernames(self) -> list[str]:
+        """Returns the users that have a reserved plan."""
+        with self._database:
+            return [
+                user["username"]
+                for user in self._database.execute(
+                    "SELECT username FROM reserved_plans"
+                ).fetchall()
+            ]
+
+    @staticmethod
+    def _set_journal_sequence(
+        database: sqlite3.Connection, name: str, sequence: int
+    ) -> None:
+        """
+        Stores the sequence of the journal's last stored record on the shard.
+        Should be called within the transaction that stores the records.
+        """
+        database.execute(
+            """
+            INSERT INTO journals (name, sequence) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET sequence = excluded.sequence
+            """,
+            (name, sequence),
+        )
+
+    @staticmethod
+    def _read_journal_sequence(database: sqlite3.Connection, name: str) -> int:
+        """Returns the sequence of the journal's last stored record on the shard."""
+        journal = database.execute(
+            "SELECT sequence FROM journals WHERE name = ?", (name,)
+        ).fetchone()
+        return journal["sequence"] if journal else 0
+
+    def _get_journal_sequence(self, name: str) -> int:
+        """
+        Returns the sequence of the journal's last
+        record that is stored on all the shards.
+        """
+        sequences = []
+        for database in self._shards:
+            with database:
+                sequences.append(self._read_journal_sequence(database, name))
+
+        return min(sequences)
+
+    def _get_plan_records(
+        self, usernames: Iterable[str] | None = None
+    ) -> list[PlanRecord]:
+        """
+        Returns the plans of all the users or the specified ones
+        with the plan's due time as the seconds since the epoch.
+        The traffic deltas that are not merged yet are included.
+        The users that do not exist are omitted.
+        """
+        if usernames is None:
+            return self._read_plan_records(self._database)
+
+        records = []
+        for shard, _usernames in self._group_by_shard(
+            usernames, lambda username: username
+        ).items():
+            records.extend(self._read_plan_records(self._shards[shard], _usernames))
+
+        return records
+
+    @staticmethod
+    def _read_plan_records(
+        database: sqlite3.Connection, usernames: list[str] | None = None
+    ) -> list[PlanRecord]:
+        """Reads the plans of all the users or the specified ones from the shard."""
+        with database:
+            return database.execute(
+                f"""
+                SELECT
+                    username,
+                    (JULIANDAY(plan_start_date) - 2440587.5) * 86400
+                        + plan_duration AS plan_due_time,
+                    plan_traffic,
+                    plan_traffic_usage + IIF(
+                        plan_traffic IS NULL,
+                        0,
+                        MIN(
+                            IFNULL(deltas.traffic, 0),
+                            MAX(plan_traffic - plan_traffic_usage, 0)
+                        )
+                    ) AS plan_traffic_usage,
+                    plan_extra_traffic,
+                    plan_extra_traffic_usage + IIF(
+                        plan_traffic IS NULL,
+                        0,
+                        IFNULL(deltas.traffic, 0) - MIN(
+                            IFNULL(deltas.traffic, 0),
+                            MAX(plan_traffic - plan_traffic_usage, 0)
+                        )
+                    ) AS plan_extra_traffic_usage
+                FROM
+                    users
+                LEFT JOIN (
+                    SELECT
+                        username,
+                        SUM(upload + download) AS traffic
+                    FROM
+                        traffic_deltas
+                    GROUP BY
+                        username
+                ) AS deltas USING (username)
+                {
+                    "WHERE username IN (SELECT value FROM json_each(?))"
+                    if usernames is not None
+                    else ""
+                }
+                """,
+                (orjson.dumps(usernames).decode(),) if usernames is not None else (),
+            ).fetchall()
+
+    def _get_active_plans(self) -> dict[str, bool]:
+        """
+        Returns whether each user has an active plan
+        with a single pass over the database.
+        """
+        with self._database:
+            return {
+                user["username"]: bool(user["active"])
+                for user in self._database.execute(
+                    """
+                    SELECT
+                        username,
+                        (
+                            plan_start_date IS NULL
+                            OR plan_duration IS NULL
+                            OR ROUND((JULIANDAY(plan_start_date) - 2440587.5) * 86400)
+                                + plan_duration > CAST(STRFTIME('%s', 'now') AS INTEGER)
+                        ) AND (
+                            plan_traffic IS NULL
+                            OR plan_traffic_usage < plan_traffic
+                            OR plan_extra_traffic_usage < plan_extra_traffic
+                        ) AS active
+                    FROM
+                        users
+                    """
+                ).fetchall()
+            }
+
+    def _get_plan_changes(
+        self, sequences: list[int] | None, node: str | None = None
+    ) -> tuple[list[int], set[str] | None]:
+        """
+        Returns the users that their plan is modified on each shard after
+        the passed sequences of the shards' plan changes. The traffic usages
+        that are stored by the monitor procedures are not considered as
+        a modification except the traffic deltas of the other nodes.
+
+        Args:
+            `sequences`:
+                The sequences of the shards' last read plan changes.
+                If omitted, only the current sequences are returned.
+            `node`: The node that its traffic deltas are ignored.
+
+        Returns:
+            The current sequences of the shards' plan changes alongside
+            the modified users. `None` is returned instead of the users
+            when some of the changes are already pruned.
+        """
+        current_sequences = []
+        usernames = set()
+        for shard, database in enumerate(self._shards):
+            with database:
+                sequence = database.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'plan_changes'"
+                ).fetchone()
+                current_sequences.append(sequence := sequence["seq"] if sequence else 0)
+                if sequences is None or usernames is None:
+                    continue
+
+                changes = database.execute(
+                    "SELECT username, node FROM plan_changes WHERE id > ? AND id <= ?",
+                    (sequences[shard], sequence),
+                ).fetchall()
+                if len(changes) != sequence - sequences[shard]:
+                    usernames = None
+                    continue
+
+                usernames.update(
+                    change["username"]
+                    for change in changes
+                    if change["node"] is None or change["node"] != node
+                )
+
+        return current_sequences, usernames
+
+    def _prune_plan_changes(self, retention: int | float) -> None:
+        """Removes the plan changes that are older than the retention in seconds."""
+
+        def _prune(database: sqlite3.Connection, _: int) -> None:
+            with database:
+                database.execute(
+                    """
+                    DELETE FROM plan_changes
+                    WHERE time < (JULIANDAY('now') - 2440587.5) * 86400 - ?
+                    """,
+                    (retention,),
+                )
+
+        self._execute_shards(_prune, range(len(self._shards)))
+
+    def _enqueue_operation(
+        self, username: str, service: str, action: OperationAction
+    ) -> None:
+        """
+        Stores the operation that is failed to be reflected to the service
+        for being retried later. The latest operation of the user on each
+        service takes precedence over the previous one.
+        """
+        database = self._get_shard(username)
+        with database:
+            database.execute(
+                """
+                INSERT INTO pending_operations (
+                    username,
+                    service,
+                    action,
+                    next_attempt_date
+                )
+                VALUES
+                    (?, ?, ?, ?)
+                ON CONFLICT (username, service) DO UPDATE SET
+                    action = excluded.action,
+                    attempts = 0,
+                    next_attempt_date = excluded.next_attempt_date
+                WHERE
+                    action != excluded.action
+                """,
+                (
+                    username,
+                    service,
+                    action,
+                    (current_time() + timedelta(seconds=RETRY_MIN_DELAY)).isoformat(),
+                ),
+            )
+
+    def _dequeue_operations(
+        self,
+        service: str,
+        usernames: Iterable[str],
+        action: OperationAction | None = None,
+    ) -> set[str]:
+        """
+        Removes the users' pending operations on the service.
+        The shards are modified in parallel.
+
+        Args:
+            `action`: If specified, only the operations of this action are removed.
+
+        Returns:
+            The users that their pending operation is removed.
+        """
+        groups = self._group_by_shard(usernames, lambda username: username)
+
+        def _dequeue(database: sqlite3.Connection, shard: int) -> list[str]:
+            with database:
+                return [
+                    operation["username"]
+                    for operation in database.execute(
+                        """
+                        DELETE FROM
+                            pending_operations
+                        WHERE
+                            service = ?
+                            AND username IN (SELECT value FROM json_each(?))
+                            AND (? IS NULL OR action = ?)
+                        RETURNING
+                            username
+                        """,
+                        (service, orjson.dumps(groups[shard]), action, action),
+                    ).fetchall()
+                ]
+
+        return {
+            username
+            for usernames in self._execute_shards(_dequeue, groups)
+            for username in usernames
+        }
+
+    def _postpone_operations(self, operations: Iterable[PendingOperation]) -> None:
+        """
+        Reschedules the failed operations with an exponential backoff delay.
+        The shards are modified in parallel.
+        """
+        now = current_time()
+        groups = self._group_by_shard(
+            operations, lambda operation: operation["username"]
+        )
+
+        def _postpone(database: sqlite3.Connection, shard: int) -> None:
+            with database:
+                database.executemany(
+                    """
+                    UPDATE
+                        pending_operations
+                    SET
+                        attempts = attempts + 1,
+                        next_attempt_date = ?
+                    WHERE
+                        username = ? AND service = ? AND action = ?
+                    """,
+                    (
+                        (
+                            (
+                                now
+                                + timedelta(
+                                    seconds=min(
+                                        RETRY_MIN_DELAY * 2 ** operation["attempts"],
+                                        RETRY_MAX_DELAY,
+                                    )
+                                )
+                            ).isoformat(),
+                            operation["username"],
+                            operation["service"],
+                            operation["action"],
+                        )
+                        for operation in groups[shard]
+                    ),
+                )
+
+        self._execute_shards(_postpone, groups)
+
+    def _get_pending_operations(
+        self, service: str | None = None, usernames: Iterable[str] | None = None
+    ) -> list[PendingOperation]:
+        """
+        Returns the pending operations that are due for retrying.
+
+        Args:
+            `service`: If specified, only the operations of this service are included.
+            `usernames`:
+                If specified, the operations of these users are
+                included regardless of their retry date.
+        """
+        conditions = []
+        parameters = []
+        if service is not None:
+            conditions.append("service = ?")
+            parameters.append(service)
+        if usernames is not None:
+            usernames = list(usernames)
+            conditions.append(f"username IN ({', '.join('?' * len(usernames))})")
+            parameters.extend(usernames)
+        else:
+            conditions.append("JULIANDAY(next_attempt_date) <= JULIANDAY(?)")
+            parameters.append(current_time().isoformat())
+
+        with self._database:
+            return self._database.execute(
+                f"""
+                SELECT
+                    username,
+                    service,
+                    action,
+                    attempts,
+                    uuid
+                FROM
+                    pending_operations
+                    LEFT JOIN users USING (username)
+                WHERE
+                    {' AND '.join(conditions)}
+                ORDER BY
+                    next_attempt_date
+                """,
+                parameters,
+            ).fetchall()
+
+    def _get_active_credentials(self) -> dict[str, str]:
+        """
+        Returns the credentials of all the users that have
+        an active plan as the UUIDs mapped to the usernames.
+        """
+        credentials = {}
+        with self._database:
+            for user in self._database.execute(
+                """
+                SELECT
+                    username,
+                    uuid,
+                    plan_start_date,
+                    plan_duration,
+                    plan_traffic,
+                    plan_traffic_usage,
+                    plan_extra_traffic,
+                    plan_extra_traffic_usage
+                FROM
+                    users
+                """
+            ).fetchall():
+                if (start_date := user["plan_start_date"]) is not None:
+                    user["plan_start_date"] = convert_date(start_date)
+                if self._is_plan_has_time(user) and self._is_plan_has_traffic(user):
+                    credentials[user["username"]] = user["uuid"]
+
+        return credentials
+
     @staticmethod
     def validate_username(username: str) -> str:
         """Returns the lowercased version of the passed value after the validation.
@@ -143,14 +846,16 @@ class Users:
 
     def validate_credentials(self, credentials: Credentials) -> bool:
         """Whether the user credentials is valid and exist in the database."""
-        with self._database:
-            if self._database.execute(
+        username = self.validate_username(credentials["username"])
+        database = self._get_shard(username)
+        with database:
+            if database.execute(
                 """
                 SELECT EXISTS (
                     SELECT 1 FROM users WHERE username = ? AND uuid = ?
                 ) AS exist
                 """,
-                (self.validate_username(credentials["username"]), credentials["uuid"]),
+                (username, credentials["uuid"]),
             ).fetchone()["exist"]:
                 return True
 
@@ -193,11 +898,16 @@ class Users:
         elif self.has_no_active_capacity():
             raise errors.ActiveUsersCapacityError()
 
-        with self._database:
-            for retry in range(3):
+        database = self._get_shard(username)
+        with database:
+            for _ in range(3):
                 uuid = str(uuid4())
+                # The unique constraint of the UUIDs only covers the user's shard
+                if database_shards > 1 and self._is_uuid_exist(uuid):
+                    continue
+
                 try:
-                    self._database.execute(
+                    database.execute(
                         """
                         INSERT INTO users (username, uuid, user_creation_date)
                         VALUES (?, ?, ?)
@@ -208,14 +918,14 @@ class Users:
                     if error.sqlite_errorcode == errors.SQLITE_CONSTRAINT_PRIMARYKEY:
                         raise errors.UserExistError(username)
                     elif error.sqlite_errorcode == errors.SQLITE_CONSTRAINT_UNIQUE:
-                        if retry < 2:
-                            continue
-                        raise errors.UUIDOverlapError()
+                        continue
                     raise
 
                 logger.debug(f"User '{username}' is added in database")
                 return {"username": username, "uuid": uuid}
 
+        raise errors.UUIDOverlapError()
+
     @_validate_username
     def delete_user(self, username: str) -> None:
         """Deletes the user from the database.
@@ -227,8 +937,9 @@ class Users:
         if not self._is_exist(username):
             raise errors.UserNotExistError(username)
 
-        with self._database:
-            self._database.execute("DELETE FROM users WHERE username = ?", (username,))
+        database = self._get_shard(username)
+        with database:
+            database.execute("DELETE FROM users WHERE username = ?", (username,))
 
         logger.debug(f"User '{username}' is deleted from the database")
 
@@ -240,8 +951,9 @@ class Users:
             ``errors.UserNotExistError``:
                 When the specified user does not exist.
         """
-        with self._database:
-            credentials = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            credentials = database.execute(
                 "SELECT username, uuid FROM users WHERE username = ?", (username,)
             ).fetchone()
 
@@ -258,8 +970,9 @@ class Users:
             ``errors.UserNotExistError``:
                 When the specified user does not exist.
         """
-        with self._database:
-            plan = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            plan = database.execute(
                 """
                 SELECT
                     plan_start_date,
@@ -358,8 +1071,9 @@ class Users:
             username,
         )
 
-        with self._database:
-            self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            database.execute(
                 """
                 UPDATE
                     users
@@ -378,7 +1092,7 @@ class Users:
                 values,
             )
 
-            self._database.execute(
+            database.execute(
                 """
                 INSERT INTO history (
                     id,
@@ -450,8 +1164,9 @@ class Users:
         if not self._is_exist(username):
             raise errors.UserNotExistError(username)
 
-        with self._database:
-            self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            database.execute(
                 """
                 UPDATE
                     users
@@ -466,7 +1181,7 @@ class Users:
                 (extra_traffic, username),
             )
 
-            self._database.execute(
+            database.execute(
                 """
                 INSERT INTO history (
                     id,
@@ -505,8 +1220,9 @@ class Users:
         if not self._is_exist(username):
             raise errors.UserNotExistError(username)
 
-        with self._database:
-            reserved_plan = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            reserved_plan = database.execute(
                 """
                 SELECT
                     plan_reserved_date,
@@ -569,9 +1285,10 @@ class Users:
         if not self.has_active_plan(username):
             raise errors.NoActivePlanError(username)
 
-        with self._database:
+        database = self._get_shard(username)
+        with database:
             try:
-                self._database.execute(
+                database.execute(
                     """
                     INSERT INTO reserved_plans (
                         username,
@@ -595,7 +1312,7 @@ class Users:
                     raise errors.UserNotExistError(username)
                 raise
 
-            self._database.execute(
+            database.execute(
                 """
                 INSERT INTO history (
                     id,
@@ -640,8 +1357,9 @@ class Users:
         if not self._is_exist(username):
             raise errors.UserNotExistError(username)
 
-        with self._database:
-            if self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            if database.execute(
                 "DELETE FROM reserved_plans WHERE username = ? RETURNING *", (username,)
             ).fetchone():
                 logger.info(f"Reserved plan is removed for user '{username}'")
@@ -690,8 +1408,9 @@ class Users:
             id_condition = " AND id = ?"
             values = (username, id)
 
-        with self._database:
-            history = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            history = database.execute(
                 f"SELECT * FROM history WHERE username = ?{id_condition}", values
             ).fetchall()
 
@@ -753,8 +1472,9 @@ class Users:
             ``errors.UserNotExistError``:
                 When the specified user does not exist.
         """
-        with self._database:
-            traffic = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            traffic = database.execute(
                 "SELECT total_upload, total_download FROM users WHERE username = ?",
                 (username,),
             ).fetchone()
@@ -778,8 +1498,9 @@ class Users:
         if not self._is_exist(username):
             raise errors.UserNotExistError(username)
 
-        with self._database:
-            self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            database.execute(
                 """
                 UPDATE
                     users
@@ -804,8 +1525,9 @@ class Users:
             ``errors.UserNotExistError``:
                 When the specified user does not exist.
         """
-        with self._database:
-            activity = self._database.execute(
+        database = self._get_shard(username)
+        with database:
+            activity = database.execute(
                 "SELECT user_latest_activity_date FROM users WHERE username = ?",
                 (username,),
             ).fetchone()
@@ -858,32 +1580,39 @@ class Users:
                 )
             )
 
-    def generate_list(self) -> None:
+    def generate_list(self, *, passwd: bool | None = None) -> None:
         """
         Generates and stores credentials of all the
         users that have an active plan on the disk.
 
         The services should read this list and generate
         the users on the boot time.
+
+        Args:
+            `passwd`:
+                If `True` provided, the `OpenConnect` password file is also
+                regenerated from the list when the service is managed.
+                This should only be done when the users are not being
+                modified concurrently (e.g. on the boot time).
         """
         last_generate = temp_path.joinpath("last-generate")
         last_generate.write_text("")
         stream = StringIO()
+        credentials = []
         try:
-            with self._database:
-                for credentials in self._database.execute(
-                    "SELECT username, uuid FROM users"
-                ).fetchall():
-                    username = credentials["username"]
-                    if self.has_active_plan(username):
-                        # ``self.activate_reserved_plan()``
-                        # method must not be called in here
-                        stream.write(f"{username} {credentials['uuid']}\n")
+            # ``self.activate_reserved_plan()``
+            # method must not be called in here
+            for username, uuid in self._get_active_credentials().items():
+                stream.write(f"{username} {uuid}\n")
+                credentials.append({"username": username, "uuid": uuid})
 
             stream.seek(0)
             with open(temp_path.joinpath("users"), "w") as file:
                 copyfileobj(stream, file)
 
+            if passwd and manage_ocserv:
+                Passwd().replace(credentials)
+
             last_generate.write_text(str(int(time.time())))
             logger.debug(
                 f"The users list is {'re' if self._list_generated else ''}generated"
@@ -893,9 +1622,12 @@ class Users:
             self._list_generated = True
 
     def close(self) -> None:
-        """Closes the database connection."""
+        """Closes the database connections."""
         if not self._closed:
-            self._database.close()
+            if self._executor:
+                self._executor.shutdown()
+            for database in {self._database, *self._shards}:
+                database.close()
             self._closed = True
 
     @property
@@ -917,6 +1649,24 @@ class Users:
                 "SELECT COUNT(*) AS count FROM users"
             ).fetchone()["count"]
 
+    @property
+    def pending_operations(self) -> dict[str, int]:
+        """
+        The count of the operations that are waiting
+        to be reflected to each service.
+        """
+        with self._database:
+            return {
+                row["service"]: row["count"]
+                for row in self._database.execute(
+                    """
+                    SELECT service, COUNT(*) AS count
+                    FROM pending_operations
+                    GROUP BY service
+                    """
+                ).fetchall()
+            }
+
     @property
     def active_capacity(self) -> int:
         """The count of all the users that have an active plan."""
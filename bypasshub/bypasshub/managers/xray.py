@@ -21,6 +21,12 @@ from xray_rpc.app.proxyman.command.command_pb2 import (
     RemoveUserOperation,
 )
 
+try:
+    from xray_rpc.app.proxyman.command.command_pb2 import GetInboundUserRequest
+except ImportError:
+    # Listing the inbound users is not supported by the older `Xray-core` versions
+    GetInboundUserRequest = None
+
 from .base import BaseService
 from .. import errors
 from ..types import Traffic
@@ -66,6 +72,7 @@ class Xray(BaseService):
 
     NAME = XrayService.NAME
     ALIAS = XrayService.ALIAS
+    TIMEOUT_ERROR = errors.XrayTimeoutError
 
     def __init__(self, timeout: int | float = timeout) -> None:
         self.timeout = timeout
@@ -146,6 +153,22 @@ class Xray(BaseService):
             )
         logger.debug(f"User '{username}' is deleted")
 
+    @_exception_handler
+    async def list_users(self) -> set[str] | None:
+        if GetInboundUserRequest is None:
+            return None
+
+        usernames = set()
+        for tag in xray_inbounds:
+            for user in (
+                await self._proxyman_stub.GetInboundUsers(
+                    GetInboundUserRequest(tag=tag), timeout=self.timeout
+                )
+            ).users:
+                usernames.add(user.email.split("@")[0])
+
+        return usernames
+
     @_exception_handler
     async def user_traffic_usage(self, username: str, reset: bool = True) -> Traffic:
         return {
@@ -1,25 +1,80 @@
+import math
+import heapq
 import asyncio
 import logging
 from time import time
 from typing import Literal
+from pathlib import Path
+from contextlib import suppress
 from collections.abc import Coroutine
 
 from . import errors
-from .types import Service
+from .types import Service, Traffic
 from .config import config
-from .managers import Manager, Xray
-from .utils import gather, convert_time
-from .constants import ServiceStatus, ManagerReason
+from .cleanup import Cleanup
+from .database import LEADER_LEASE
+from .managers import (
+    Manager,
+    Xray,
+    OpenConnect,
+    CircuitBreaker,
+    PlanTable,
+    Checkpoint,
+    TrafficJournal,
+)
+from .utils import (
+    Process,
+    convert_size,
+    convert_time,
+    get_hash_index,
+    get_instance_path,
+    listen_datagram,
+    send_datagram,
+)
+from .constants import ServiceState, ServiceStatus, ManagerReason
 
 TASK_NAME_PREFIX = "monitor"
 TASK_GROUP_MESSAGE = "User Monitor Task Group"
+ADAPTIVE_MIN_RATIO = 0.25
+ADAPTIVE_MAX_RATIO = 4
+ADAPTIVE_HIGH_TRAFFIC_RATE = 10 * 1000**2  # bytes per second
+# The users that would exhaust their plan's traffic within this
+# many tracking iterations with their current rate are watched.
+QUOTA_ITERATIONS = 3
+QUOTA_WATCH_LIMIT = 64
+PLAN_CHANGES_RETENTION = 3600  # seconds
+TRAFFIC_CHECKPOINT = "traffic"
+TRAFFIC_JOURNAL = "traffic"
 
 monitor_interval = config["main"]["monitor_interval"]
 monitor_passive_steps = config["main"]["monitor_passive_steps"]
+monitor_intervals = {
+    Xray.NAME: config["main"]["monitor_xray_interval"],
+    OpenConnect.NAME: config["main"]["monitor_ocserv_interval"],
+}
+monitor_adaptive = config["main"]["monitor_adaptive"]
 monitor_zombies = config["main"]["monitor_zombies"]
+quota_interval = config["main"]["monitor_quota_interval"]
+monitor_workers = config["main"]["monitor_workers"]
+monitor_flush_steps = config["main"]["monitor_flush_steps"]
+checkpoint_interval = config["main"]["checkpoint_interval"]
+cluster_node = config["main"]["cluster_node"]
+cluster_lease_time = config["main"]["cluster_lease_time"]
+manage_ocserv = config["main"]["manage_ocserv"]
+sync_events_socket_path = config["main"]["sync_events_socket_path"]
+ocserv_events_socket_path = config["main"]["ocserv_events_socket_path"]
 logger = logging.getLogger(__name__)
 
 
+def get_shard_socket_path(shard: int) -> Path:
+    """
+    Returns the location of the socket that the shard receives
+    the forwarded `OpenConnect` session events on. The first
+    location is used by the pool to receive the events.
+    """
+    return get_instance_path(ocserv_events_socket_path, shard + 1)
+
+
 class Monitor(Manager):
     """
     The monitor procedure that manages the services by tracking the database
@@ -27,11 +82,31 @@ class Monitor(Manager):
 
     Attributes:
         `interval`:
-            The interval in seconds to wait for tracking users traffic usage
-            and remove them from the services if they do not have an active plan.
+            The interval in seconds to retry the failed operations on the
+            services and count the `steps` for the synchronization.
             `ValueError` will be raised if value is not a positive number.
             The default value is equal to `monitor_interval` property of the
             configuration file.
+        `intervals`:
+            The interval in seconds for each service by its name to wait
+            for tracking users traffic usage and remove them from the
+            service if they do not have an active plan.
+            `ValueError` will be raised if any value is not a positive number.
+            The default values are equal to `monitor_xray_interval` and
+            `monitor_ocserv_interval` properties of the configuration file.
+        `adaptive`:
+            Whether to adapt the services tracking intervals to their load.
+            The default value is equal to `monitor_adaptive` property
+            of the configuration file.
+        `shard`:
+            The part of the users that their traffic usage is tracked
+            when the users are distributed between multiple processes.
+            The synchronization with the database is only performed
+            by the first shard which also competes for the leadership
+            of the cluster when the database is shared between servers.
+        `shards`:
+            The count of the parts that the users are distributed between.
+            `ValueError` will be raised if `shard` is not smaller than it.
         `steps`:
             The services synchronization with the database interval.
             This interval is calculated by multiplying the passed value to
@@ -45,182 +120,847 @@ class Monitor(Manager):
         self,
         interval: int | float = monitor_interval,
         steps: int = monitor_passive_steps,
+        intervals: dict[str, int | float] = monitor_intervals,
+        adaptive: bool = monitor_adaptive,
+        shard: int = 0,
+        shards: int = 1,
     ) -> None:
         super().__init__()
         self.interval = interval
         self.steps = steps
+        self.intervals = intervals
+        self.adaptive = adaptive
+        self.shard = shard
+        self.shards = shards
         if self.interval <= 0:
             raise ValueError("The 'interval' parameter should be greater than zero")
         elif self.steps <= 0:
             raise ValueError("The 'steps' parameter should be greater than zero")
+        elif any(self.intervals[service.NAME] <= 0 for service in self._services):
+            raise ValueError(
+                "The 'intervals' parameter values should be greater than zero"
+            )
+        elif not 0 <= self.shard < self.shards:
+            raise ValueError(
+                "The 'shard' parameter should be smaller than the 'shards' parameter"
+            )
+        elif cluster_node and cluster_lease_time <= self.interval:
+            raise ValueError(
+                "The 'cluster_lease_time' configuration should be"
+                " greater than the 'interval' parameter"
+            )
 
         self._task = None
-        self._idle = None
+        self._stopping = asyncio.Event()
+        self._intervals = {
+            service.NAME: self.intervals[service.NAME] for service in self._services
+        }
+        self._watched_users = {service.NAME: [] for service in self._services}
+        self._tracked_at = {}
+        self._plans = PlanTable()
+        self._plan_sequences = None
+        self._counters: dict[str, dict[str, Traffic]] = {}
+        self._overshoot_stats = {
+            service.NAME: {"count": 0, "total": 0, "max": 0}
+            for service in self._services
+        }
         self._counted_steps = 0
+        self._notified_users = set()
+        self._notification_task = None
+        self._stop_listening = None
         self._services_stats = {
             service.ALIAS: {"status": ServiceStatus.CONNECTED, "time": 0}
             for service in self._services
         }
+        suffix = f".{self.shard}" if self.shards > 1 else ""
+        self._traffic_checkpoint = Checkpoint(f"{TRAFFIC_CHECKPOINT}{suffix}")
+        self._journal = TrafficJournal(f"{TRAFFIC_JOURNAL}{suffix}")
+        self._unflushed_steps = 0
+        self._leader = False
+        self._replay_traffic()
 
     async def _passive_monitor(self) -> None:
         """Periodically synchronizes the services with the database."""
+        await self._retry_operations()
         self._counted_steps += 1
         if self._counted_steps < self.steps:
             return
 
         await self._sync()
+        self._prune_plan_changes(PLAN_CHANGES_RETENTION)
         self._counted_steps = 0
 
+    async def _lead(self) -> None:
+        """
+        Acquires or renews the leadership of the cluster and performs
+        the cluster-wide tasks while holding it.
+        """
+        leader = self._acquire_lease(LEADER_LEASE, cluster_node, cluster_lease_time)
+        if leader != self._leader:
+            self._leader = leader
+            logger.info(
+                f"The leadership of the cluster is {'taken' if leader else 'lost'}"
+            )
+        if not leader:
+            return
+
+        if count := self._merge_traffic_deltas():
+            logger.debug(f"Merged '{count}' traffic deltas of the cluster")
+
+        # The reserved plans of the users that are expired on any node
+        if activated := [
+            username
+            for username in self._get_reserved_usernames()
+            if not self.has_active_plan(username)
+            and super().activate_reserved_plan(username)
+        ]:
+            self._schedule_sync(activated)
+
+    def activate_reserved_plan(self, username: str) -> bool:
+        """
+        Replaces the user's current plan with the reserved one if the user has any.
+
+        Within a cluster, the reserved plans are only activated by the leader
+        and the user's reserved plan is considered to be activated meanwhile.
+
+        Returns:
+            Whether the reserved plan is replaced with the user's current plan.
+        """
+        if cluster_node:
+            return self.get_reserved_plan(username) is not None
+
+        return super().activate_reserved_plan(username)
+
+    def _handle_notification(self, data: bytes) -> None:
+        """Schedules the synchronization of the notified users."""
+        self._schedule_sync(data.decode(errors="replace").split())
+
+    def _schedule_sync(self, usernames: list[str]) -> None:
+        """Schedules the synchronization of the passed users."""
+        self._notified_users.update(usernames)
+        if self._notified_users and (
+            self._notification_task is None or self._notification_task.done()
+        ):
+            self._notification_task = asyncio.create_task(
+                self._sync_notified_users(), name=f"{TASK_NAME_PREFIX}_notified"
+            )
+
+    async def _sync_notified_users(self) -> None:
+        """
+        Synchronizes the notified users with the services.
+        The users that are notified meanwhile are synchronized
+        right after the current ones.
+        """
+        while self._notified_users:
+            usernames = self._notified_users
+            self._notified_users = set()
+            try:
+                actions = []
+                for username in usernames:
+                    try:
+                        username = self.validate_username(username)
+                    except errors.InvalidUsernameError:
+                        logger.warning(f"Invalid username '{username}' is notified")
+                        continue
+
+                    if action := self._get_sync_action(username):
+                        actions.append(action)
+
+                if not actions:
+                    continue
+
+                exceptions = await self._run_concurrently(
+                    [action.method for action in actions if action.method]
+                )
+                self.generate_list()
+                if exceptions:
+                    raise ExceptionGroup(
+                        errors.SynchronizationError.GROUP_MESSAGE, exceptions
+                    )
+            except Exception as error:
+                logger.exception(error)
+
+    def _in_shard(self, username: str) -> bool:
+        """Whether the user belongs to the shard of this monitor procedure."""
+        return get_hash_index(username, self.shards) == self.shard
+
+    async def _get_traffic_usages(
+        self, service: Service, usernames: list[str] | None = None
+    ) -> dict[str, Traffic]:
+        """
+        Returns the traffic usage of the passed users or all the users
+        in the shard since the last time this method was called.
+        """
+        breaker = CircuitBreaker.get(service)
+        if self.shards == 1 or not isinstance(service, Xray):
+            if usernames is None:
+                users = await breaker.call(service.users_traffic_usage)
+            else:
+                users = dict(
+                    zip(
+                        usernames,
+                        await asyncio.gather(*[
+                            breaker.call(service.user_traffic_usage, username)
+                            for username in usernames
+                        ]),
+                    )
+                )
+
+            return (
+                users
+                if self.shards == 1
+                else {
+                    username: traffic
+                    for username, traffic in users.items()
+                    if self._in_shard(username)
+                }
+            )
+
+        # Resetting the counters on `Xray-core` affects all the shards.
+        # The usages are calculated from the counters' previous values instead.
+        if usernames is None:
+            counters = await breaker.call(service.users_traffic_usage, False)
+        else:
+            counters = dict(
+                zip(
+                    usernames,
+                    await asyncio.gather(*[
+                        breaker.call(service.user_traffic_usage, username, False)
+                        for username in usernames
+                    ]),
+                )
+            )
+
+        users = {}
+        # The counters are not reset on the previous runs either. Their
+        # first values are only considered as the initial values.
+        initial = service.NAME not in self._counters
+        previous_counters = self._counters.setdefault(service.NAME, {})
+        for username, counter in counters.items():
+            if not self._in_shard(username):
+                continue
+
+            previous_counter = (
+                counter if initial else previous_counters.get(username, {})
+            )
+            traffic = users[username] = {}
+            for direction, value in counter.items():
+                previous_value = previous_counter.get(direction, 0)
+                # The counter is restarted if it's smaller than the previous value
+                traffic[direction] = (
+                    value if value < previous_value else value - previous_value
+                )
+            previous_counters[username] = counter
+
+        return users
+
+    async def _peek_traffic_usages(
+        self, service: Service, usernames: list[str]
+    ) -> dict[str, Traffic]:
+        """
+        Returns the traffic usage of the passed users since the last time
+        that the ``self._get_traffic_usages()`` method was called without
+        consuming it, so it's still tracked by the next call of that method.
+        """
+        breaker = CircuitBreaker.get(service)
+        if self.shards == 1 or not isinstance(service, Xray):
+            return dict(
+                zip(
+                    usernames,
+                    await asyncio.gather(*[
+                        breaker.call(service.peek_traffic_usage, username)
+                        for username in usernames
+                    ]),
+                )
+            )
+
+        if (previous_counters := self._counters.get(service.NAME)) is None:
+            # The initial values of the counters are not known yet
+            return {}
+
+        users = {}
+        for username, counter in zip(
+            usernames,
+            await asyncio.gather(*[
+                breaker.call(service.user_traffic_usage, username, False)
+                for username in usernames
+            ]),
+        ):
+            previous_counter = previous_counters.get(username, {})
+            traffic = users[username] = {}
+            for direction, value in counter.items():
+                previous_value = previous_counter.get(direction, 0)
+                traffic[direction] = (
+                    value if value < previous_value else value - previous_value
+                )
+
+        return users
+
+    def _refresh_plans(self) -> None:
+        """
+        Reloads the plans of the users in the plans table that are modified
+        by others since the last reload. The whole table is only loaded at
+        first or when the modifications are not known anymore.
+        """
+        sequences, usernames = self._get_plan_changes(
+            self._plan_sequences, cluster_node
+        )
+        if self._plan_sequences is None or usernames is None:
+            # The journaled traffic usages are not included in the plans yet
+            self._flush_traffic()
+            self._plans.load(
+                record
+                for record in self._get_plan_records()
+                if self._in_shard(record["username"])
+            )
+        elif usernames := [
+            username for username in usernames if self._in_shard(username)
+        ]:
+            self._flush_traffic()
+            records = self._get_plan_records(usernames)
+            self._plans.remove(
+                set(usernames) - {record["username"] for record in records}
+            )
+            self._plans.update(records)
+
+        self._plan_sequences = sequences
+
+    def _refresh_plan(self, username: str) -> bool:
+        """
+        Reloads the user's plan in the plans table.
+
+        Returns:
+            Whether the user exists on the database.
+        """
+        if records := self._get_plan_records([username]):
+            self._plans.update(records)
+            return True
+
+        return False
+
+    async def _delete_zombie_user(
+        self, service: Service, username: str, traffic_usage: int
+    ) -> None:
+        """Removes the user that does not exist on the database from the service."""
+        if not monitor_zombies:
+            return
+
+        with self._access_state():
+            if self._has_user_state(username):
+                return
+
+        no_log = False
+        if isinstance(service, Xray):
+            if traffic_usage > 0:
+                # Users on `Xray-core` doesn't disconnect immediately
+                # after the API call and the connection still is open
+                # until the idle timeout. Furthermore, `Xray-core` still
+                # reports the traffic usage for the deleted users anyway.
+                # Silently removing the user when the user still consumes
+                # traffic is the best we can do.
+                no_log = True
+            else:
+                # User didn't consume any more traffic
+                return
+
+        if not no_log:
+            logger.warning(
+                f"User '{username}' is active on '{service.ALIAS}'"
+                " but does not exist on the database"
+            )
+        await self._delete_user_by_service(
+            service,
+            username,
+            ManagerReason.ZOMBIE_USER,
+            silent=True,
+            no_existence_log=no_log,
+        )
+
+    async def _expire_user(
+        self, service: Service, username: str, traffic_usage: int = 0
+    ) -> None:
+        """
+        Removes the user that its plan is expired according
+        to the plans table from the services after verifying
+        the plan on the database.
+
+        Args:
+            `traffic_usage`:
+                The user's traffic usage on the service
+                that is not stored on the database yet.
+        """
+        try:
+            plan = self.get_plan(username)
+        except errors.UserNotExistError:
+            return
+
+        remaining_traffic = None
+        if not self._is_unlimited_traffic_plan(plan):
+            remaining_traffic = (
+                plan["plan_traffic"]
+                - plan["plan_traffic_usage"]
+                + plan["plan_extra_traffic"]
+                - plan["plan_extra_traffic_usage"]
+                - traffic_usage
+            )
+
+        if self.has_active_plan_time(username, plan=plan) and (
+            remaining_traffic is None or remaining_traffic > 0
+        ):
+            # The plans table is outdated
+            self._refresh_plan(username)
+            return
+        elif traffic_usage and self.get_reserved_plan(username):
+            # The reserved plan is activated after storing the traffic usage
+            return
+
+        with self._access_state():
+            # The user may be already removed by the ``self._quota_monitor()``
+            removed = (
+                self._has_user_state(username)
+                and self._get_service_state(service, username) == ServiceState.DELETED
+            )
+
+        if remaining_traffic is not None and remaining_traffic <= 0 and not removed:
+            overshoot = -remaining_traffic
+            stats = self._overshoot_stats[service.NAME]
+            stats["count"] += 1
+            stats["total"] += overshoot
+            stats["max"] = max(stats["max"], overshoot)
+            if overshoot:
+                logger.info(
+                    f"User '{username}' exceeded the plan's traffic"
+                    f" by '{convert_size(overshoot)}' on '{service.ALIAS}'"
+                )
+
+        if self.activate_reserved_plan(username):
+            self._refresh_plan(username)
+            return
+
+        await self._delete_user(username, ManagerReason.EXPIRED_PLAN, silent=True)
+
+    async def _track_users(
+        self, service: Service, users: dict[str, Traffic]
+    ) -> dict[str, int | None]:
+        """
+        Updates the users traffic usage and removes those ones
+        that not have an active plan from the service.
+
+        The traffic usage of all the users is applied to the
+        plans table at once and stored in a single transaction.
+
+        Returns:
+            The remaining traffic of the users that exist on the database.
+        """
+        self._refresh_plans()
+        plans = self._plans
+        usernames = []
+        traffic_usages = []
+        zombie_users = []
+        for username, traffic in users.items():
+            traffic_usage = traffic.get("uplink", 0) + traffic.get("downlink", 0)
+            if username in plans or self._refresh_plan(username):
+                usernames.append(username)
+                traffic_usages.append(traffic_usage)
+            else:
+                zombie_users.append((username, traffic_usage))
+
+        changes = plans.apply(usernames, traffic_usages, time())
+
+        # The usages should be journaled before asynchronous context switch
+        if usages := [
+            (
+                username,
+                added_traffic_usage,
+                added_extra_traffic_usage,
+                (traffic := users[username]).get("uplink", 0),
+                traffic.get("downlink", 0),
+            )
+            for (
+                username,
+                traffic_usage,
+                added_traffic_usage,
+                added_extra_traffic_usage,
+            ) in zip(
+                usernames,
+                traffic_usages,
+                changes.traffic_usages,
+                changes.extra_traffic_usages,
+            )
+            if traffic_usage > 0
+        ]:
+            self._journal.append(usages)
+            self._unflushed_steps += 1
+
+        # The plans of the expired users are verified on the database
+        if self._unflushed_steps >= monitor_flush_steps or (
+            changes.expired and self._journal.pending
+        ):
+            self._flush_traffic()
+
+        for username, traffic_usage in zombie_users:
+            await self._delete_zombie_user(service, username, traffic_usage)
+
+        for username in changes.expired:
+            await self._expire_user(service, username)
+
+        return dict(zip(usernames, changes.remaining_traffics))
+
+    def _flush_traffic(self) -> None:
+        """
+        Stores the journaled traffic usages on each shard of the database
+        in a single transaction alongside the journal's sequence.
+        """
+        self._store_journal(self._journal)
+        self._unflushed_steps = 0
+
+    def _store_journal(self, journal: TrafficJournal) -> None:
+        """Stores the pending records of the journal on the database."""
+        if not (records := journal.pending):
+            return
+
+        sequence = records[-1].sequence
+        if cluster_node:
+            # The leader splits the traffic between the plan and extra traffic
+            self._store_traffic_deltas(cluster_node, journal.name, records)
+        else:
+            self._update_traffics(journal.name, records)
+        journal.commit(sequence)
+
+    def _replay_traffic(self) -> None:
+        """
+        Stores the traffic usages that are journaled
+        but not stored on the database before the last shutdown.
+
+        The first shard also stores and removes the journals
+        that are left by the monitor procedures with another
+        count of the shards.
+        """
+        journals = [self._journal]
+        if self.shard == 0:
+            names = (
+                {TRAFFIC_JOURNAL}
+                if self.shards == 1
+                else {f"{TRAFFIC_JOURNAL}.{shard}" for shard in range(self.shards)}
+            )
+            journals.extend(
+                TrafficJournal(name)
+                for name in TrafficJournal.find(TRAFFIC_JOURNAL)
+                if name not in names
+            )
+
+        for journal in journals:
+            if records := journal.open(self._get_journal_sequence(journal.name)):
+                count = len(records)
+                self._store_journal(journal)
+                logger.info(
+                    f"Replayed {count} records of the '{journal.name}' traffic journal"
+                )
+            if journal is not self._journal:
+                journal.remove()
+
+    def _save_traffic(self) -> None:
+        """
+        Saves the traffic usage baselines of the services to the checkpoint
+        alongside the sequence of the last journaled traffic usage.
+        Only the baselines that are not reset on the services are needed.
+        """
+        if not Checkpoint.ENABLED:
+            return
+
+        baselines = self._openconnect and self._openconnect.dump_baselines()
+        if self._counters or baselines:
+            self._traffic_checkpoint.save(
+                {
+                    "shards": self.shards,
+                    "sequence": self._journal.sequence,
+                    "counters": self._counters,
+                    "ocserv": baselines,
+                }
+            )
+
+    def _restore_traffic(self) -> None:
+        """
+        Restores the traffic usage baselines of the services from the checkpoint
+        to count the traffic that is consumed while the app was not running.
+
+        The baselines are outdated when any traffic usage is journaled
+        after saving them and are ignored to not count that usage twice.
+        """
+        if not Checkpoint.ENABLED or not (
+            checkpoint := self._traffic_checkpoint.load()
+        ):
+            return
+        elif checkpoint["shards"] != self.shards:
+            logger.info("Ignoring the traffic checkpoint of other monitor workers")
+            return
+        elif checkpoint.get("sequence") != self._journal.sequence:
+            logger.info("Ignoring the outdated traffic checkpoint")
+            return
+
+        self._counters = {
+            name: counters
+            for name, counters in checkpoint["counters"].items()
+            if name in self._intervals
+        }
+        if self._openconnect and (baselines := checkpoint["ocserv"]):
+            self._openconnect.restore_baselines(baselines)
+
+    async def _checkpoint(self) -> None:
+        """
+        Periodically saves the traffic usage baselines
+        and the users' state to the checkpoints.
+        """
+        self._save_traffic()
+        if self.shard == 0:
+            await asyncio.to_thread(self._save_state)
+
+    def _watch_user(
+        self,
+        service: Service,
+        username: str,
+        traffic_usage: int,
+        elapsed_time: float,
+        remaining_traffic: int | None,
+    ) -> bool:
+        """
+        Adds the user to the service's watched users if the user
+        is about to exhaust the plan's traffic with the current rate.
+
+        Args:
+            `traffic_usage`: The traffic that is consumed in the `elapsed_time`.
+            `remaining_traffic`: The plan's remaining traffic after the usage.
+
+        Returns:
+            Whether the user is about to exhaust the plan's traffic.
+        """
+        if not traffic_usage or remaining_traffic is None:
+            return False
+
+        # The estimated time to exhaust the plan's traffic
+        exhaustion_time = remaining_traffic * elapsed_time / traffic_usage
+        if exhaustion_time > self._intervals[service.NAME] * QUOTA_ITERATIONS:
+            return False
+
+        if remaining_traffic > 0 and quota_interval:
+            heapq.heappush(
+                self._watched_users[service.NAME], (exhaustion_time, username)
+            )
+
+        return True
+
     async def _active_monitor(self, *, service: Service) -> None:
         """
         Updates the traffic usage for the users that are active and connected
         to the specified service in the current time and removes those ones
         that not have an active plan from the service.
 
+        The users that are about to exhaust their plan's traffic
+        are watched by the ``self._quota_monitor()`` method until
+        the next iteration.
+
         NOTE: `Xray-core` still reports traffic usage for the deleted users.
         """
-        for username, traffic in (await service.users_traffic_usage()).items():
-            uplink = traffic["uplink"]
-            downlink = traffic["downlink"]
-            session_traffic_usage = uplink + downlink
+        total_traffic_usage = 0
+        near_quota = False
+        tracked_at = asyncio.get_running_loop().time()
+        previously_tracked_at = self._tracked_at.get(
+            service.NAME, tracked_at - self._intervals[service.NAME]
+        )
+        self._tracked_at[service.NAME] = tracked_at
+        users = await self._get_traffic_usages(service)
+        self._watched_users[service.NAME] = []
+        remaining_traffics = await self._track_users(service, users)
+        for username, traffic in users.items():
+            traffic_usage = traffic.get("uplink", 0) + traffic.get("downlink", 0)
+            total_traffic_usage += traffic_usage
+            if self._watch_user(
+                service,
+                username,
+                traffic_usage,
+                tracked_at - previously_tracked_at,
+                remaining_traffics.get(username),
+            ):
+                near_quota = True
+
+        watched_users = self._watched_users[service.NAME]
+        if len(watched_users) > QUOTA_WATCH_LIMIT:
+            self._watched_users[service.NAME] = heapq.nsmallest(
+                QUOTA_WATCH_LIMIT, watched_users
+            )
+
+        if self.adaptive:
+            self._adapt_interval(service, total_traffic_usage, near_quota)
+
+    async def _quota_monitor(self, *, service: Service) -> None:
+        """
+        Individually checks the traffic usage of the users that are about
+        to exhaust their plan's traffic on the specified service to remove
+        them in time without tracking all the users more often.
+
+        The traffic usage is only read and is still tracked by
+        the ``self._active_monitor()`` method on its next iteration.
+        """
+        if not (watched_users := self._watched_users[service.NAME]):
+            return
+
+        expired_users = {}
+        for username, traffic in (
+            await self._peek_traffic_usages(
+                service, [username for _, username in watched_users]
+            )
+        ).items():
+            traffic_usage = traffic.get("uplink", 0) + traffic.get("downlink", 0)
+            if (
+                username in self._plans
+                and (remaining_traffic := self._plans.remaining_traffic(username))
+                is not None
+                and remaining_traffic <= traffic_usage
+            ):
+                expired_users[username] = traffic_usage
+
+        if expired_users:
+            self._watched_users[service.NAME] = [
+                user
+                for user in self._watched_users[service.NAME]
+                if user[1] not in expired_users
+            ]
+            for username, traffic_usage in expired_users.items():
+                await self._expire_user(service, username, traffic_usage)
+
+    def _adapt_interval(
+        self, service: Service, traffic_usage: int, near_quota: bool
+    ) -> None:
+        """
+        Adapts the service's tracking interval
+        to the latest tracked traffic usage.
+        """
+        base_interval = self.intervals[service.NAME]
+        current_interval = interval = self._intervals[service.NAME]
+        if near_quota:
+            interval = base_interval * ADAPTIVE_MIN_RATIO
+        elif traffic_usage / current_interval >= ADAPTIVE_HIGH_TRAFFIC_RATE:
+            interval = max(current_interval / 2, base_interval * ADAPTIVE_MIN_RATIO)
+        elif traffic_usage:
+            interval = base_interval
+        else:
+            interval = min(current_interval * 2, base_interval * ADAPTIVE_MAX_RATIO)
 
+        if interval != current_interval:
+            self._intervals[service.NAME] = interval
+            logger.debug(
+                f"The '{service.ALIAS}' tracking interval"
+                f" is adapted to '{convert_time(interval)}'"
+            )
+
+    async def _run(
+        self, task: Coroutine, kwargs: dict[Literal["service"], Service], name: str
+    ) -> None:
+        """Runs a single iteration of the task and handles its exceptions."""
+        interruption_errors = []
+        stats = self._services_stats
+
+        try:
             try:
-                plan = self.get_plan(username)
-            except errors.UserNotExistError:
-                if monitor_zombies:
-                    with self._access_state():
-                        if username in self._state["users"]:
-                            continue
-
-                    no_log = False
-                    if isinstance(service, Xray):
-                        if session_traffic_usage > 0:
-                            # Users on `Xray-core` doesn't disconnect immediately
-                            # after the API call and the connection still is open
-                            # until the idle timeout. Furthermore, `Xray-core` still
-                            # reports the traffic usage for the deleted users anyway.
-                            # Silently removing the user when the user still consumes
-                            # traffic is the best we can do.
-                            no_log = True
-                        else:
-                            # User didn't consume any more traffic
-                            continue
-
-                    if not no_log:
+                try:
+                    await asyncio.create_task(task(**kwargs), name=name)
+                except Exception as error:
+                    # Merging all the exceptions
+                    raise ExceptionGroup(
+                        TASK_GROUP_MESSAGE,
+                        (
+                            error.exceptions
+                            if isinstance(error, ExceptionGroup)
+                            else [error]
+                        ),
+                    )
+            except* (
+                errors.XrayTimeoutError,
+                errors.OpenConnectTimeoutError,
+            ) as error:
+                for exception in error.exceptions:
+                    name = exception.ALIAS
+                    service = stats[name]
+                    interruption_errors.append(name)
+                    if service["status"] == ServiceStatus.CONNECTED:
+                        service["status"] = ServiceStatus.DISCONNECTED
+                        service["time"] = time()
                         logger.warning(
-                            f"User '{username}' is active on '{service.ALIAS}'"
-                            " but does not exist on the database"
+                            f"Communication with '{name}' service is interrupted"
                         )
-                    await self._delete_user_by_service(
-                        service,
-                        username,
-                        ManagerReason.ZOMBIE_USER,
-                        silent=True,
-                        no_existence_log=no_log,
+            except* errors.StateSynchronizerTimeout as error:
+                logger.error(error.exceptions[0])
+            finally:
+                # Only the tracked service is known to be reachable
+                if (
+                    (tracked_service := kwargs.get("service"))
+                    and (name := tracked_service.ALIAS) not in interruption_errors
+                    and (service := stats[name])["status"] == ServiceStatus.DISCONNECTED
+                ):
+                    service["status"] = ServiceStatus.CONNECTED
+                    logger.info(
+                        (
+                            "Communication with '{}' service is restored"
+                            " (was disconnected for ~'{}')"
+                        ).format(name, convert_time(time() - service["time"]))
                     )
+        except ExceptionGroup as error:
+            logger.exception(error)
 
-                continue
+    async def _schedule(
+        self, task: Coroutine, kwargs: dict[Literal["service"], Service], name: str
+    ) -> None:
+        """
+        Runs the task at a fixed rate until the monitor procedure is stopped.
 
-            if session_traffic_usage > 0:
-                added_traffic_usage = added_extra_traffic_usage = 0
-                if not self._is_unlimited_traffic_plan(plan):
-                    plan_traffic = plan["plan_traffic"]
-                    previous_traffic_usage = plan["plan_traffic_usage"]
-                    added_traffic_usage = session_traffic_usage
-                    plan["plan_traffic_usage"] += added_traffic_usage
-                    if (
-                        plan["plan_extra_traffic"]
-                        and plan["plan_traffic_usage"] > plan_traffic
-                    ):
-                        added_traffic_usage = plan_traffic - previous_traffic_usage
-                        added_extra_traffic_usage = (
-                            session_traffic_usage - added_traffic_usage
-                        )
-                        plan["plan_traffic_usage"] = plan_traffic
-                        plan["plan_extra_traffic_usage"] += added_extra_traffic_usage
-
-                # The database should be updated before asynchronous context switch
-                self._update_traffic(
-                    username,
-                    added_traffic_usage,
-                    added_extra_traffic_usage,
-                    uplink,
-                    downlink,
+        The interval is measured between the start of the iterations
+        rather than the end of one and the start of the next one.
+        The iterations that are missed because of the previous one
+        overrunning the interval are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        service = kwargs.get("service")
+        deadline = loop.time()
+        while True:
+            if task == self._quota_monitor:
+                interval = quota_interval
+            elif task == self._checkpoint:
+                interval = checkpoint_interval
+            elif service:
+                interval = self._intervals[service.NAME]
+            else:
+                interval = self.interval
+            deadline += interval
+            if (delay := deadline - loop.time()) < 0:
+                skipped = math.ceil(-delay / interval)
+                deadline += skipped * interval
+                delay = deadline - loop.time()
+                logger.warning(
+                    f"The '{name}' task overran its interval"
+                    f" and '{skipped}' iteration(s) are skipped"
                 )
 
-            if not (
-                self.has_active_plan(username, plan=plan)
-                or self.activate_reserved_plan(username)
-            ):
-                async with self._get_async_lock(username):
-                    with self._get_process_lock(username):
-                        await self._delete_user_by_service(
-                            service, username, ManagerReason.EXPIRED_PLAN, silent=True
-                        )
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            if self._stopping.is_set():
+                return
+
+            await self._run(task, kwargs, name)
 
     async def _monitor(
         self, tasks: list[tuple[Coroutine, dict[Literal["service"], Service], str]]
     ) -> None:
-        while True:
-            if not self._task:
-                return
-
-            self._idle = True
-            await asyncio.sleep(self.interval)
-            self._idle = False
+        await asyncio.gather(*[
+            self._schedule(task, kwargs, name) for task, kwargs, name in tasks
+        ])
 
-            interruption_errors = []
-            stats = self._services_stats
-
-            try:
-                try:
-                    if exceptions := (
-                        await gather(
-                            [
-                                asyncio.create_task(task(**kwargs), name=name)
-                                for task, kwargs, name in tasks
-                            ],
-                        )
-                    )[1]:
-                        # Merging all the exceptions
-                        _exceptions = []
-                        for exception in exceptions:
-                            if isinstance(exception, ExceptionGroup):
-                                _exceptions.extend(exception.exceptions)
-                            else:
-                                _exceptions.append(exception)
-                        raise ExceptionGroup(TASK_GROUP_MESSAGE, _exceptions)
-                except* (
-                    errors.XrayTimeoutError,
-                    errors.OpenConnectTimeoutError,
-                ) as error:
-                    for exception in error.exceptions:
-                        name = exception.ALIAS
-                        service = stats[name]
-                        interruption_errors.append(name)
-                        if service["status"] == ServiceStatus.CONNECTED:
-                            service["status"] = ServiceStatus.DISCONNECTED
-                            service["time"] = time()
-                            logger.warning(
-                                f"Communication with '{name}' service is interrupted"
-                            )
-                except* errors.StateSynchronizerTimeout as error:
-                    logger.error(error.exceptions[0])
-                finally:
-                    for name, service in stats.items():
-                        if (
-                            name not in interruption_errors
-                            and service["status"] == ServiceStatus.DISCONNECTED
-                        ):
-                            service["status"] = ServiceStatus.CONNECTED
-                            logger.info(
-                                (
-                                    "Communication with '{}' service is restored"
-                                    " (was disconnected for ~'{}')"
-                                ).format(name, convert_time(time() - service["time"]))
-                            )
-            except ExceptionGroup as error:
-                logger.exception(error)
+    @property
+    def overshoots(self) -> dict[str, dict[Literal["count", "total", "max"], int]]:
+        """
+        The statistics of the traffic that is consumed by the users
+        beyond their plan's traffic until getting removed, for each service.
+        """
+        return {name: stats.copy() for name, stats in self._overshoot_stats.items()}
 
     def start(self) -> asyncio.Task:
         """Starts the monitor procedure.
@@ -246,10 +986,49 @@ class Monitor(Manager):
             )
             for service in self._services
         ]
-        tasks.append((self._passive_monitor, {}, f"{TASK_NAME_PREFIX}_passive"))
+        if quota_interval:
+            tasks.extend(
+                (
+                    self._quota_monitor,
+                    {"service": service},
+                    f"{TASK_NAME_PREFIX}_quota_{service.NAME}",
+                )
+                for service in self._services
+            )
+
+        if self.shard == 0:
+            tasks.append((self._passive_monitor, {}, f"{TASK_NAME_PREFIX}_passive"))
+            if cluster_node:
+                tasks.append((self._lead, {}, f"{TASK_NAME_PREFIX}_lead"))
+            self._stop_listening = listen_datagram(
+                sync_events_socket_path, self._handle_notification
+            )
+
+            # The users that are modified since the restored state
+            # checkpoint are synchronized without waiting for the
+            # next synchronization of all the users
+            if changes := self._pop_restored_changes():
+                self._schedule_sync(changes)
+
+        if Checkpoint.ENABLED:
+            tasks.append((self._checkpoint, {}, f"{TASK_NAME_PREFIX}_checkpoint"))
+
+        self._restore_traffic()
+
+        if self._openconnect:
+            if self.shards > 1:
+                # The sessions are polled and forwarded by the pool
+                self._openconnect.listen_events(
+                    get_shard_socket_path(self.shard), forwarded=True
+                )
+            else:
+                self._openconnect.listen_events()
 
         self._task = asyncio.create_task(self._monitor(tasks), name=TASK_NAME_PREFIX)
-        logger.info("The monitor procedure is started")
+        logger.info(
+            "The monitor procedure is started"
+            + (f" (shard {self.shard + 1}/{self.shards})" if self.shards > 1 else "")
+        )
         return self._task
 
     async def stop(self, force: bool = False) -> None:
@@ -263,14 +1042,193 @@ class Monitor(Manager):
         """
         if _task := self._task:
             self._task = None
-            if self._idle or force:
+            if force:
                 if not _task.cancelled():
                     _task.cancel()
             else:
+                self._stopping.set()
                 await _task
 
-            self._idle = None
+            self._stopping.clear()
             self._counted_steps = 0
+            self._tracked_at.clear()
+            for watched_users in self._watched_users.values():
+                watched_users.clear()
+
+            if self._stop_listening:
+                self._stop_listening()
+                self._stop_listening = None
+            if (task := self._notification_task) and not task.done():
+                task.cancel()
+
+            try:
+                self._flush_traffic()
+            except Exception as error:
+                logger.warning(
+                    "Failed to store the journaled traffic usages"
+                    f" on the database due to {error!r}"
+                )
+            self._journal.close()
+
+            if self._leader:
+                self._leader = False
+                try:
+                    # Letting another node to take over without waiting for the lease
+                    self._release_lease(LEADER_LEASE, cluster_node)
+                except Exception as error:
+                    logger.warning(f"Failed to release the leadership due to {error!r}")
+
+            if Checkpoint.ENABLED:
+                try:
+                    self._save_traffic()
+                    if self.shard == 0:
+                        self._save_state()
+                except Exception as error:
+                    logger.warning(f"Failed to save the checkpoints due to {error!r}")
 
             await self.close()
             logger.info("The monitor procedure is stopped")
+
+
+async def _run_shard(shard: int, shards: int) -> None:
+    """Runs the monitor procedure for a shard of the users."""
+    monitor = Monitor(shard=shard, shards=shards)
+    Cleanup().add(monitor.stop)
+    await monitor.start()
+
+
+class MonitorPool:
+    """
+    The monitor procedures that the users are distributed between
+    by hashing their usernames and each one runs in a separate process
+    with its own connections to the services and database.
+
+    The process that starts the pool only coordinates the procedures
+    and forwards the session events of the `OpenConnect` server to
+    the procedure that tracks the user. The sessions of the server are
+    also polled once by this process for all the procedures and each
+    procedure receives the sessions of its own users.
+
+    Attributes:
+        `workers`:
+            The count of the processes.
+            `ValueError` will be raised if value is smaller than two.
+            The default value is equal to `monitor_workers` property
+            of the configuration file.
+    """
+
+    def __init__(self, workers: int = monitor_workers) -> None:
+        self.workers = workers
+        if self.workers < 2:
+            raise ValueError("The 'workers' parameter should be at least two")
+
+        self._task = None
+        self._processes: list[Process] = []
+        self._stop_forwarding = None
+        self._polling: asyncio.Task | None = None
+
+    def _forward_event(self, event: bytes) -> None:
+        """Forwards the `OpenConnect` session event to the user's shard."""
+        with suppress(IndexError, UnicodeDecodeError):
+            username = event.split(maxsplit=3)[2].decode()
+            send_datagram(
+                get_shard_socket_path(get_hash_index(username, self.workers)), event
+            )
+
+    async def _poll_sessions(self) -> None:
+        """
+        Polls the sessions of the `OpenConnect` server at its tracking
+        interval and forwards them to the procedures, so the polling
+        cost does not grow with the count of the procedures.
+        """
+        openconnect = OpenConnect()
+        paths = [get_shard_socket_path(shard) for shard in range(self.workers)]
+        failed = None
+        try:
+            while True:
+                await asyncio.sleep(monitor_intervals[OpenConnect.NAME])
+                try:
+                    await openconnect.forward_sessions(
+                        paths, lambda username: get_hash_index(username, self.workers)
+                    )
+                except Exception as error:
+                    if not failed:
+                        failed = True
+                        logger.warning(
+                            f"Failed to poll the '{OpenConnect.ALIAS}' sessions"
+                            f" due to {error!r}"
+                        )
+                else:
+                    if failed:
+                        failed = False
+                        logger.info(
+                            f"Polling the '{OpenConnect.ALIAS}' sessions is restored"
+                        )
+        finally:
+            await openconnect.close()
+
+    async def _wait(self) -> None:
+        await asyncio.gather(*[
+            asyncio.to_thread(process.join) for process in self._processes
+        ])
+
+    def start(self) -> asyncio.Task:
+        """Starts the monitor procedures.
+
+        Returns:
+            The related AsyncIO Task that can be awaited on.
+
+        Raises:
+            `RuntimeError`:
+                When called while the monitor procedures are already running.
+        """
+        if self._task is not None:
+            raise RuntimeError("The monitor procedures are already running")
+
+        for shard in range(self.workers):
+            process = Process(
+                target=_run_shard,
+                args=(shard, self.workers),
+                daemon=True,
+                name=f"{__package__}_{TASK_NAME_PREFIX}_{shard}",
+            )
+            process.start()
+            self._processes.append(process)
+
+        if manage_ocserv:
+            self._stop_forwarding = listen_datagram(
+                ocserv_events_socket_path, self._forward_event
+            )
+            self._polling = asyncio.create_task(
+                self._poll_sessions(), name=f"{TASK_NAME_PREFIX}_poll_sessions"
+            )
+
+        self._task = asyncio.create_task(self._wait(), name=TASK_NAME_PREFIX)
+        return self._task
+
+    async def stop(self, force: bool = False) -> None:
+        """Stops the monitor procedures.
+
+        Args:
+            `force`:
+                If `True` provided, kills the processes immediately.
+                Otherwise, waits for the current iteration of
+                the procedures to be finished.
+        """
+        if _task := self._task:
+            self._task = None
+            if self._stop_forwarding:
+                self._stop_forwarding()
+                self._stop_forwarding = None
+            if polling := self._polling:
+                self._polling = None
+                polling.cancel()
+                with suppress(asyncio.CancelledError):
+                    await polling
+
+            for process in self._processes:
+                if process.is_alive():
+                    process.kill() if force else process.terminate()
+
+            await _task
+            self._processes.clear()
@@ -0,0 +1,346 @@
+import time
+import asyncio
+import logging
+import sqlite3
+from pathlib import Path
+
+import orjson
+
+from . import errors
+from .config import config
+from .types import ReplicaStatus
+from .utils import get_instance_path
+from .database import (
+    Database,
+    CHANGELOG_TRIGGER_PREFIX,
+    replica_path,
+    cluster_node,
+)
+
+SHIP_BATCH_SIZE = 10000
+
+replica_interval = config["database"]["replica_interval"]
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    """The hot-standby replica of the database.
+
+    While the replica is enabled, the changes of the tables are recorded
+    in the `changelog` table of the database by the triggers. The recorded
+    changes are shipped to the replica in order and are applied in a single
+    transaction alongside the last applied change, so the replica is always
+    a consistent copy of the database as of that change. The shipped changes
+    are removed from the database afterwards.
+
+    The bookkeeping tables of the monitor procedures (e.g. the journals'
+    sequences and the traffic deltas of the cluster) are not replicated
+    and are left as they were on the last copy, except the traffic deltas
+    and the leases which are removed from the copy. Otherwise, the deltas
+    that are merged afterwards would be merged again on the promoted replica.
+
+    The replica is only fully copied from the database when it does not
+    exist or misses the changes that are already removed from the database
+    (e.g. when another server shipped them). The schema modifications
+    are not shipped and cause the replica to be copied again.
+
+    Each shard of the database has its own replica.
+
+    Attributes:
+        `path`:
+            The location of the replica.
+            The default value is equal to `replica_path` property of
+            the configuration file. The other shards' replicas are
+            located beside it with their number as the suffix.
+        `shard`:
+            The shard of the database that is replicated.
+        `ENABLED`:
+            Whether the replica is enabled.
+    """
+
+    ENABLED = bool(replica_path)
+
+    def __init__(self, path: str | Path = replica_path, shard: int = 0) -> None:
+        self.path = get_instance_path(path, shard)
+        self.shard = shard
+        self._task = None
+        self._database: sqlite3.Connection | None = None
+        self._replica: sqlite3.Connection | None = None
+        self._columns: dict[str, list[str]] = {}
+
+    def _connect(self) -> tuple[sqlite3.Connection, sqlite3.Connection]:
+        if self._database is None:
+            self._database = Database(self.shard)
+        if self._replica is None:
+            if not (directory := self.path.parent).exists():
+                directory.mkdir(parents=True, exist_ok=True)
+            self._replica = sqlite3.connect(self.path, autocommit=False)
+            self._columns.clear()
+
+        return self._database, self._replica
+
+    def _get_cursor(self, replica: sqlite3.Connection) -> int | None:
+        """
+        Returns the last change that is applied to the
+        replica or `None` if the replica is not copied yet.
+        """
+        try:
+            cursor = replica.execute("SELECT cursor FROM replication").fetchone()
+        except sqlite3.OperationalError:
+            cursor = None
+        replica.commit()
+        return cursor[0] if cursor else None
+
+    def _is_missed(self, database: sqlite3.Connection, cursor: int) -> bool:
+        """Whether the changes after the cursor are removed from the database."""
+        with database:
+            first_change = database.execute(
+                "SELECT MIN(id) AS id FROM changelog"
+            ).fetchone()["id"]
+            last_change = database.execute(
+                "SELECT IFNULL(MAX(seq), 0) AS id FROM sqlite_sequence"
+                " WHERE name = 'changelog'"
+            ).fetchone()["id"]
+
+        return (
+            first_change > cursor + 1
+            if first_change is not None
+            else last_change > cursor
+        )
+
+    def _copy(self, database: sqlite3.Connection, replica: sqlite3.Connection) -> int:
+        """
+        Fully copies the database to the replica.
+
+        Returns:
+            The last change that is included in the copy.
+        """
+        database.commit()
+        # The target of the backup should not be within a transaction
+        replica.autocommit = True
+        try:
+            database.backup(replica)
+        finally:
+            replica.autocommit = False
+        self._columns.clear()
+        with replica:
+            cursor = replica.execute(
+                "SELECT IFNULL(MAX(seq), 0) FROM sqlite_sequence"
+                " WHERE name = 'changelog'"
+            ).fetchone()[0]
+            for (name,) in replica.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+                (f"{CHANGELOG_TRIGGER_PREFIX}%",),
+            ).fetchall():
+                replica.execute(f"DROP TRIGGER {name}")
+            replica.execute("DELETE FROM changelog")
+            for table in ("traffic_deltas", "leases"):
+                replica.execute(f"DELETE FROM {table}")
+            replica.execute("CREATE TABLE replication (cursor INT, time REAL)")
+            replica.execute(
+                "INSERT INTO replication (cursor, time) VALUES (?, ?)",
+                (cursor, time.time()),
+            )
+
+        logger.info("The database is fully copied to the replica")
+        return cursor
+
+    def _get_columns(self, replica: sqlite3.Connection, table: str) -> list[str]:
+        if (columns := self._columns.get(table)) is None:
+            columns = self._columns[table] = [
+                column[1]
+                for column in replica.execute(
+                    f"PRAGMA table_info('{table}')"
+                ).fetchall()
+            ]
+
+        return columns
+
+    def ship(self) -> int:
+        """
+        Applies the changes of the database that are not applied
+        to the replica yet. The replica is fully copied first
+        when it's needed.
+
+        Returns:
+            The count of the applied changes.
+        """
+        database, replica = self._connect()
+        count = 0
+        if (cursor := self._get_cursor(replica)) is None or self._is_missed(
+            database, cursor
+        ):
+            cursor = self._copy(database, replica)
+        else:
+            with database:
+                changes = database.execute(
+                    """
+                    SELECT id, table_name, row_id, data FROM changelog
+                    WHERE id > ? ORDER BY id LIMIT ?
+                    """,
+                    (cursor, SHIP_BATCH_SIZE),
+                ).fetchall()
+            if not changes:
+                return 0
+
+            try:
+                cursor = self._apply(replica, changes)
+            except sqlite3.OperationalError as error:
+                logger.warning(f"Copying the database to the replica due to {error!r}")
+                cursor = self._copy(database, replica)
+            count = len(changes)
+
+        with database:
+            database.execute("DELETE FROM changelog WHERE id <= ?", (cursor,))
+
+        return count
+
+    def _apply(self, replica: sqlite3.Connection, changes: list[dict]) -> int:
+        """
+        Applies the changes to the replica in a single transaction.
+
+        Returns:
+            The last applied change.
+
+        Raises:
+            ``sqlite3.OperationalError``:
+                When the tables of the replica are outdated.
+        """
+        with replica:
+            for change in changes:
+                table = change["table_name"]
+                if (data := change["data"]) is None:
+                    replica.execute(
+                        f"DELETE FROM {table} WHERE rowid = ?", (change["row_id"],)
+                    )
+                    continue
+
+                values = orjson.loads(data)
+                if len(columns := self._get_columns(replica, table)) != len(values):
+                    raise sqlite3.OperationalError(
+                        f"The '{table}' table of the replica is outdated"
+                    )
+                replica.execute(
+                    f"""
+                    INSERT OR REPLACE INTO {table} (rowid, {", ".join(columns)})
+                    VALUES (?{", ?" * len(columns)})
+                    """,
+                    (change["row_id"], *values),
+                )
+
+            cursor = changes[-1]["id"]
+            replica.execute(
+                "UPDATE replication SET cursor = ?, time = ?", (cursor, time.time())
+            )
+
+        return cursor
+
+    def status(self) -> ReplicaStatus:
+        """Returns the replication status of the replica."""
+        if self.path.exists():
+            database, replica = self._connect()
+            cursor = self._get_cursor(replica)
+        else:
+            database = self._database = self._database or Database(self.shard)
+            cursor = None
+
+        with database:
+            pending = database.execute(
+                "SELECT COUNT(*) AS count, MIN(time) AS time FROM changelog"
+                " WHERE id > ?",
+                (cursor or 0,),
+            ).fetchone()
+
+        return {
+            "copied": cursor is not None,
+            "cursor": cursor or 0,
+            "pending": pending["count"],
+            "lag": max(time.time() - pending["time"], 0) if pending["time"] else 0,
+        }
+
+    def promote(self) -> None:
+        """
+        Replaces the database's shard with the replica.
+        The current shard is moved to the backups directory if it exists.
+        The app should not be running meanwhile.
+
+        Raises:
+            ``errors.ReplicaNotAvailableError``:
+                When the replica is not copied yet or is corrupted.
+        """
+        self.close()
+        if not self.path.exists():
+            raise errors.ReplicaNotAvailableError()
+
+        replica = sqlite3.connect(self.path, autocommit=True)
+        try:
+            if replica.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise errors.ReplicaNotAvailableError()
+            try:
+                cursor, shipped_time = replica.execute(
+                    "SELECT cursor, time FROM replication"
+                ).fetchone()
+            except sqlite3.OperationalError:
+                raise errors.ReplicaNotAvailableError()
+
+            replica.execute("DROP TABLE replication")
+            replica.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            replica.close()
+
+        Database.replace(self.path, self.shard)
+        logger.info(
+            f"The replica of the database shard '{self.shard}' is promoted"
+            f" as of the change '{cursor}' that was shipped"
+            f" at '{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(shipped_time))}'"
+        )
+
+    def start(self) -> asyncio.Task | None:
+        """Starts shipping the changes of the database to the replica.
+
+        The shipping interval can be configured with `replica_interval`
+        property in the configuration file. Only the leader ships the
+        changes when the database is shared within a cluster.
+
+        Returns:
+            The related AsyncIO Task that can be awaited on.
+
+        Raises:
+            ``RuntimeError``:
+                When called while the procedure is already running.
+        """
+        if self._task is not None:
+            raise RuntimeError("The database replication procedure is already running")
+        elif not self.ENABLED:
+            return
+
+        async def _ship() -> None:
+            logger.info("The database replication procedure is started")
+            while True:
+                try:
+                    await asyncio.sleep(replica_interval)
+                    if cluster_node and not Database.is_leader():
+                        continue
+                    self.ship()
+                except asyncio.CancelledError:
+                    logger.info("The database replication procedure is stopped")
+                    raise
+                except Exception as error:
+                    logger.exception(error)
+
+        self._task = asyncio.create_task(_ship(), name="database_replication")
+        return self._task
+
+    def stop(self) -> None:
+        """Stops shipping the changes of the database to the replica."""
+        if (task := self._task) is not None and not task.cancelled():
+            task.cancel()
+            self._task = None
+        self.close()
+
+    def close(self) -> None:
+        """Closes the connections to the database and replica."""
+        for connection in (self._database, self._replica):
+            if connection:
+                connection.close()
+        self._database = self._replica = None
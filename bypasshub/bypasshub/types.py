@@ -16,13 +16,29 @@ class _ConfigMain(TypedDict):
     max_users: int
     max_active_users: int
     service_timeout: int
+    service_probe_interval: int
+    service_concurrency: int
     monitor_interval: int
     monitor_passive_steps: int
+    monitor_xray_interval: int
+    monitor_ocserv_interval: int
+    monitor_adaptive: bool
+    monitor_quota_interval: int
+    monitor_workers: int
     monitor_zombies: bool
+    monitor_ocserv_idle_steps: int
+    monitor_flush_steps: int
+    state_actor: bool
+    checkpoint_interval: int
+    cluster_node: str
+    cluster_lease_time: int
     temp_path: str
     xray_cdn_ips_path: str
     xray_api_socket_path: str
     occtl_broker_socket_path: str
+    ocserv_passwd_path: str
+    ocserv_events_socket_path: str
+    sync_events_socket_path: str
     nginx_fallback_socket_path: str
 
 
@@ -36,6 +52,11 @@ class _ConfigLog(TypedDict):
 
 class _ConfigDatabase(TypedDict):
     backup_interval: int
+    backup_base_steps: int
+    backup_retention: int
+    shards: int
+    replica_path: str
+    replica_interval: int
     path: str
 
 
@@ -81,6 +102,15 @@ class Plan(_PlanBase):
     plan_extra_traffic_usage: int
 
 
+class PlanRecord(TypedDict):
+    username: str
+    plan_due_time: float | None
+    plan_traffic: int | None
+    plan_traffic_usage: int
+    plan_extra_traffic: int
+    plan_extra_traffic_usage: int
+
+
 class Credentials(TypedDict):
     username: str
     uuid: str
@@ -115,11 +145,48 @@ class DatabaseSchema(TypedDict):
     history: list[PlanHistory]
 
 
+class BackupInfo(TypedDict):
+    name: str
+    date: datetime
+    base: bool
+    size: int
+
+
+class ReplicaStatus(TypedDict):
+    copied: bool
+    cursor: int
+    pending: int
+    lag: float
+
+
 class Traffic(TypedDict):
     uplink: int
     downlink: int
 
 
+class ServiceReconciliation(TypedDict):
+    supported: bool  # whether the service is able to list its users
+    expected: int
+    actual: int
+    added: list[str]
+    deleted: list[str]
+    failed: list[str]
+    duration: float  # seconds
+
+
+class Reconciliation(TypedDict):
+    services: dict[str, ServiceReconciliation]
+    duration: float  # seconds
+
+
+class PendingOperation(TypedDict):
+    username: str
+    service: str
+    action: constants.OperationAction
+    attempts: int
+    uuid: str | None
+
+
 class SerializedError(TypedDict):
     type: str
     message: str
@@ -149,8 +216,7 @@ class TimeUnits(TypedDict):
     d: str
 
 
-class _ManagerUserState(TypedDict):
-    lock: Lock
+class ManagerUserState(TypedDict):
     synced: bool
     has_active_plan: bool
     services: dict[
@@ -161,4 +227,7 @@ class _ManagerUserState(TypedDict):
 
 class ManagerState(TypedDict):
     reasons: dict[str, constants.ManagerReason]
-    users: dict[str, _ManagerUserState]
+    users: dict[str, ManagerUserState]
+    locks: NotRequired[list[Lock]]
+    initialized: NotRequired[bool]
+    restored_changes: NotRequired[list[str]]
@@ -2,13 +2,15 @@ import os
 import sys
 import math
 import fcntl
+import socket
 import asyncio
 import inspect
 import multiprocessing
 from typing import Any
+from hashlib import blake2b
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
 
 import uvloop
 
@@ -134,6 +136,32 @@ def current_time() -> datetime:
     return datetime.now(timezone.utc).replace(microsecond=0)
 
 
+def get_instance_path(path: str | Path, index: int) -> Path:
+    """
+    Returns the instance's dedicated location of the file.
+    The first instance uses the location as it is.
+    """
+    return Path(f"{path}.{index}" if index else path)
+
+
+def get_hash_index(key: str, count: int) -> int:
+    """
+    Returns the index of the instance that the key is placed on among
+    the instances by the jump consistent hashing. Only the keys of the
+    added or removed last instances are moved when the count of the
+    instances is changed.
+    """
+    hash = int.from_bytes(blake2b(key.encode(), digest_size=8).digest())
+    index = -1
+    next_index = 0
+    while next_index < count:
+        index = next_index
+        hash = (hash * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        next_index = int((index + 1) * ((1 << 31) / ((hash >> 33) + 1)))
+
+    return index
+
+
 async def gather(iterable: Iterable) -> tuple[list[Any], list[Exception]]:
     """
     Wrapper around ``asyncio.gather()`` that
@@ -145,3 +173,58 @@ async def gather(iterable: Iterable) -> tuple[list[Any], list[Exception]]:
         (exceptions if isinstance(result, Exception) else returns).append(result)
 
     return (returns, exceptions)
+
+
+def listen_datagram(
+    path: os.PathLike, callback: Callable[[bytes], Any], *, mode: int = 0o660
+) -> Callable[[], None]:
+    """
+    Listens on the `UNIX` datagram socket and calls the
+    callback for each received datagram on the running event loop.
+
+    Args:
+        `mode`: The socket file permissions.
+
+    Returns:
+        The function that stops the listening and removes the socket file.
+    """
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(str(path))
+    path.chmod(mode)
+
+    def receive() -> None:
+        while True:
+            try:
+                data = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            callback(data)
+
+    loop = asyncio.get_running_loop()
+    loop.add_reader(sock.fileno(), receive)
+
+    def close() -> None:
+        if sock.fileno() != -1:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+            path.unlink(missing_ok=True)
+
+    return close
+
+
+def send_datagram(path: os.PathLike, data: bytes) -> bool:
+    """Sends the datagram to the `UNIX` socket without blocking.
+
+    Returns:
+        Whether the datagram is delivered to the socket.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        try:
+            sock.sendto(data, str(path))
+            return True
+        except OSError:
+            return False
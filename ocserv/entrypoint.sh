@@ -2,9 +2,8 @@
 
 trap 'exit' TERM INT
 
-install -d -g users -m 0755 /tmp/ocserv
+install -d -g users -m 0775 /tmp/ocserv
 rm -f /tmp/ocserv/ocserv.sock.* &>/dev/null
-ln -s /dev/shm/passwd /tmp/ocserv/passwd &>/dev/null
 cp -f /etc/ocserv/ocserv.conf /tmp/ocserv/ocserv.conf
 
 # Injecting the environment variables
@@ -59,7 +58,8 @@ mkdir -p /dev/net
 mknod /dev/net/tun c 10 200
 chmod 600 /dev/net/tun
 
-# Waiting for the users list to be generated
+# Waiting for the password file to be generated.
+# The file is owned and modified by `bypasshub`.
 current_time=$(date '+%s')
 for (( timeout=50; timeout > 0; timeout-- )); do
     [ -s /tmp/bypasshub/last-generate ] &&
@@ -67,18 +67,7 @@ for (( timeout=50; timeout > 0; timeout-- )); do
         break
     sleep 0.1
 done
-
-# Injecting the users
-> /dev/shm/passwd
-readarray -t users < /tmp/bypasshub/users
-if [ ! -z "${users}" ]; then
-    for user in "${users[@]}"; do
-        user=($user)
-        ocpasswd --passwd /dev/shm/passwd \
-            ${user[0]} <<< ${user[1]}$'\n'${user[1]};
-    done
-    unset users user
-fi
+[ -f /tmp/ocserv/passwd ] || install -m 0644 -g users /dev/null /tmp/ocserv/passwd
 
 exec ocserv \
     --log-stderr \
@@ -1,5 +1,15 @@
 #!/usr/bin/env sh
 
+EVENTS_SOCK=/tmp/bypasshub/ocserv-events.sock
+
+# Notifying `bypasshub` about the session changes.
+# The counters are only provided on the disconnect event.
+if [ -S $EVENTS_SOCK ] && [ "$REASON" != "host-update" ]; then
+    printf '%s %s %s %s %s' "$REASON" "$ID" "$USERNAME" \
+        "${STATS_BYTES_OUT:-0}" "${STATS_BYTES_IN:-0}" |
+        timeout 1 socat -u - UNIX-SENDTO:$EVENTS_SOCK >/dev/null 2>&1
+fi
+
 if [ "$ENABLE_IPV6" = true ]; then
     # Configuring the NDP Proxy for the downstream clients
     ip -6 neighbour $([ "$REASON" = "connect" ] && echo add || echo del) \
@@ -1,35 +1,62 @@
 #!/usr/bin/env bash
 
-PASSWD=/tmp/ocserv/passwd
+# Each client connection is served by a dedicated instance of this script
+# for as long as the client keeps the connection open.
+#
+# Requests are newline terminated frames in `ID COMMAND [ARGUMENTS...]` format.
+# Each response is a `ID EXIT_CODE LENGTH` header line followed by exactly
+# `LENGTH` bytes of the command's output. The requests are processed in the
+# received order, so the clients are free to pipeline them.
+
+export LC_ALL=C
+set -o pipefail
+
 OCCTL_SOCK=/tmp/ocserv/occtl.sock
 
-function is_exist() {
-    grep --quiet "^$1:.*" $PASSWD
+# The users are managed by `bypasshub` directly in the password file.
+# Disconnecting the users which are removed from the file.
+# A single `occtl` instance runs the commands that are read from its input.
+function disconnect_users() {
+    (($#)) || return 0
+    printf 'disconnect user %s\n' "$@" |
+        occtl --socket-file $OCCTL_SOCK &>/dev/null
+    return 0
 }
 
-function add_user() {
-    is_exist $1 && return 3
-    ocpasswd --passwd $PASSWD $1 <<< ${2}$'\n'${2}
+# Reloading the server to apply the password file modifications
+function reload() {
+    occtl --socket-file $OCCTL_SOCK reload &>/dev/null
 }
 
-function delete_user() {
-    ! is_exist $1 && return 4
-    occtl --socket-file $OCCTL_SOCK disconnect user $1 &>/dev/null
-    ocpasswd --passwd $PASSWD --delete $1
+# Only keeping the fields that are needed for tracking the traffic usage
+# as `KEY VALUE` lines. Each session begins with its `ID` line.
+function list_sessions() {
+    occtl --json --socket-file $OCCTL_SOCK show "$@" |
+        sed -nE 's/^\s*"(ID|Username|State|TX|RX)":\s*"?([^",]*)"?,?\s*$/\1 \2/p'
 }
 
 function show_user() {
-    occtl --debug --json --socket-file $OCCTL_SOCK show user $1
+    list_sessions user $1
 }
 
 function show_users() {
-    occtl --debug --json --socket-file $OCCTL_SOCK show users
+    list_sessions users
 }
 
 function show_status() {
     occtl --debug --json --socket-file $OCCTL_SOCK show status
 }
 
-STDIN=$(cat)
-STDOUT=$($STDIN)
-echo -n "$?$STDOUT"
+while read -r id command arguments; do
+    case $command in
+        disconnect_users | reload | show_user | show_users | show_status)
+            output=$($command $arguments)
+            code=$?
+            ;;
+        *)
+            output=""
+            code=127
+            ;;
+    esac
+    printf '%s %d %d\n%s' "$id" $code ${#output} "$output"
+done